@@ -92,7 +92,7 @@ resource "aws_bedrockagent_agent" "leave_assistant_agent" {
 # 5. Lambda Function for Agent Logic
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_dir  = "./lambda" #  Path to your Lambda function code and database
+  source_dir  = var.lambda_source_dir #  Path to your Lambda function code and database
   output_path = "/tmp/lambda_function_payload.zip" #  Create in /tmp
 }
 
@@ -101,7 +101,7 @@ resource "aws_lambda_function" "agent_lambda_function" {
   role             = aws_iam_role.lambda_execution_role.arn
   handler          = "lambda_function.lambda_handler" #  Make sure this matches your Python file and handler
   filename         = data.archive_file.lambda_zip.output_path
-  runtime          = "python3.11"
+  runtime          = "python3.12"
   source_code_hash = data.archive_file.lambda_zip.output_path
 
   environment {
@@ -109,6 +109,7 @@ resource "aws_lambda_function" "agent_lambda_function" {
       AIRS_API = var.airs_api_key
       AIRS_PROMPT_PROFILE = var.airs_prompt_profile
       AIRS_RESPONSE_PROFILE = local.actual_airs_response_profile
+      AIRS_PREFILTER_DENY_DOMAINS = var.airs_prefilter_deny_domains
     }
   }
 }
@@ -184,7 +185,7 @@ resource "aws_bedrockagent_agent_action_group" "leave_agent_actions" {
         description = "A Lambda function to get all the employees details (which includes their name, data of brith, title, homepage, start date and employment status)."
         parameters {
           map_block_key = "employee_id"
-          type          = "number"
+          type          = "integer"
           description   = "Employee Number"
           required      = true
         }
@@ -194,17 +195,23 @@ resource "aws_bedrockagent_agent_action_group" "leave_agent_actions" {
         description = "A Lambda function to get an employee's leave balance."
         parameters {
           map_block_key = "employee_id"
-          type          = "number"
+          type          = "integer"
           description   = "Employee Number"
           required      = true
         }
+        parameters {
+          map_block_key = "year"
+          type          = "integer"
+          description   = "Leave year, defaults to the current one"
+          required      = false
+        }
       } 
       functions {
         name        = "book_leave"
         description = "A Lambda function to book some employee's leave."
         parameters {
           map_block_key = "employee_id"
-          type          = "number"
+          type          = "integer"
           description   = "Employee Number"
           required      = true
         }
@@ -226,17 +233,41 @@ resource "aws_bedrockagent_agent_action_group" "leave_agent_actions" {
         description = "A Lambda function to  list all of the employee's leave balance."
         parameters {
           map_block_key = "employee_id"
-          type          = "number"
+          type          = "integer"
           description   = "Employee Number"
           required      = true
         }
+        parameters {
+          map_block_key = "start_date"
+          type          = "string"
+          description   = "Only leave with a day on or after this date (YYYY-MM-DD)"
+          required      = false
+        }
+        parameters {
+          map_block_key = "end_date"
+          type          = "string"
+          description   = "Only leave with a day on or before this date (YYYY-MM-DD)"
+          required      = false
+        }
+        parameters {
+          map_block_key = "status"
+          type          = "string"
+          description   = "Only upcoming, current or taken leave"
+          required      = false
+        }
+        parameters {
+          map_block_key = "cursor"
+          type          = "string"
+          description   = "The next_cursor of the previous page, to get the next page"
+          required      = false
+        }
       }
       functions {
         name        = "cancel_leave"
         description = "A Lambda function to cancel some employee's leave."
         parameters {
           map_block_key = "employee_id"
-          type          = "number"
+          type          = "integer"
           description   = "Employee Number"
           required      = true
         }
@@ -247,6 +278,44 @@ resource "aws_bedrockagent_agent_action_group" "leave_agent_actions" {
           required      = true
         }
       }
+      functions {
+        name        = "employees_on_leave"
+        description = "A Lambda function to list the employees who have leave booked on any day between two dates (who is off)."
+        parameters {
+          map_block_key = "start_date"
+          type          = "string"
+          description   = "First date to check (YYYY-MM-DD)"
+          required      = true
+        }
+        parameters {
+          map_block_key = "end_date"
+          type          = "string"
+          description   = "Last date to check (YYYY-MM-DD), defaults to the start date"
+          required      = false
+        }
+      }
+      functions {
+        name        = "leave_summary"
+        description = "A Lambda function to summarise the leave booked per month, by job title or for one employee."
+        parameters {
+          map_block_key = "start_month"
+          type          = "string"
+          description   = "First month (YYYY-MM)"
+          required      = true
+        }
+        parameters {
+          map_block_key = "end_month"
+          type          = "string"
+          description   = "Last month (YYYY-MM), defaults to the start month"
+          required      = false
+        }
+        parameters {
+          map_block_key = "employee_id"
+          type          = "integer"
+          description   = "Employee Number, leave out for the totals by job title"
+          required      = false
+        }
+      }
       # functions {
       #   name        = "airs_make_request"
       #   description = "Simulates a Lambda function to check the question and the response."
@@ -1,28 +1,728 @@
 import os
+import sys
+import time
+import threading
+import importlib.abc
+
+_init_started = time.perf_counter()
+
+# Cold-start import profiler. Like python -X importtime it records the self and cumulative time of every module
+# imported, but reports them as a structured log line so init duration regressions show up in CloudWatch.
+# Off unless IMPORT_PROFILE=on, as it sits in front of every import. Once the last import it reports (the lazy
+# requests one) is done it takes itself out of sys.meta_path.
+IMPORT_PROFILE_ENABLED = os.environ.get('IMPORT_PROFILE', 'off') == 'on'
+IMPORT_PROFILE_TOP = int(os.environ.get('IMPORT_PROFILE_TOP', '15'))
+
+class _TimedLoader:
+    """Wraps a module loader to time exec_module, everything else is passed through to the real loader."""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler.stack()
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self._profiler.timings.append((module.__name__, cumulative - children, cumulative))
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Meta path finder that wraps the loader of every module found by the other finders in a _TimedLoader."""
+
+    def __init__(self):
+        self.timings = []  # (module, self seconds, cumulative seconds)
+        self._local = threading.local()
+
+    def stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def uninstall(self):
+        """Stops profiling imports."""
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self, phase, duration=None):
+        """Logs the timings collected since the last report as one JSON line, then clears them."""
+        timings, self.timings = self.timings, []
+        if not timings:
+            return
+        top = sorted(timings, key=lambda timing: timing[1], reverse=True)[:IMPORT_PROFILE_TOP]
+        logger.info(json.dumps({
+            "metric": "import_profile",
+            "phase": phase,
+            "duration_ms": round((duration if duration is not None else sum(timing[1] for timing in timings)) * 1e3, 2),
+            "modules": len(timings),
+            "top": [{"module": name, "self_us": round(self_time * 1e6), "cumulative_us": round(cumulative * 1e6)} for name, self_time, cumulative in top],
+        }))
+
+import_profiler = None
+if IMPORT_PROFILE_ENABLED:
+    import_profiler = ImportProfiler()
+    sys.meta_path.insert(0, import_profiler)
+
+import re
 import json
+import base64
+import hashlib
 import shutil
 import sqlite3
 import logging
-import requests
-from datetime import datetime
+from bisect import bisect_left
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+from urllib.parse import quote
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # setting logger
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The HTTP stack (requests, urllib3, charset_normalizer, idna, certifi) is only imported by the AIRS paths, so
+# invocations that only touch SQLite never pay for it. See load_requests().
+requests = None
+
+def load_requests():
+    """Imports requests on first use and returns it."""
+    global requests
+    if requests is None:
+        started = time.perf_counter()
+        import requests as requests_module
+        requests = requests_module
+        if import_profiler is not None:
+            import_profiler.report("requests", time.perf_counter() - started)
+            import_profiler.uninstall()
+    return requests
+
+# The queries use RETURNING (SQLite 3.35), UPDATE ... FROM (3.33) and upserts, and the bundled database has WITHOUT
+# ROWID tables and upsert triggers, so even reading it needs a recent SQLite. The python3.12 runtime (Amazon Linux 2023)
+# has 3.40, the Amazon Linux 2 runtimes up to python3.11 have 3.7.17. Fail the cold start rather than every query.
+MIN_SQLITE_VERSION = (3, 35, 0)
+if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+    message = (f"SQLite {sqlite3.sqlite_version} is too old, the leave database needs {'.'.join(map(str, MIN_SQLITE_VERSION))} "
+               "or later (deploy on the python3.12 runtime)")
+    logger.error(message)
+    raise RuntimeError(message)
+
 DB_PATH = "/tmp/employee_database.db"  # Path to the SQLite database file
+# The database shipped with the function. It is read in place until the first write, which copies it to DB_PATH.
+BUNDLED_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "employee_database.db")
+
+# Optional in-memory mode: the database is loaded into a :memory: connection with the backup API at init and every query
+# is served from RAM. Writes are applied in memory and written back to DB_MEMORY_SYNC_PATH (a backup of the whole
+# database) according to DB_MEMORY_SYNC:
+#   'commit'   after every write, nothing is lost if the container goes away but each write pays for the copy
+#   'interval' at most every DB_MEMORY_SYNC_INTERVAL seconds, checked on each write and each invocation
+#   'off'      never, writes only live as long as the container
+# Point DB_MEMORY_SYNC_PATH at durable storage (e.g. an EFS mount) to keep bookings across containers, a cold start
+# loads from it when it exists.
+DB_MEMORY_MODE = os.environ.get('DB_MEMORY_MODE', 'off') == 'on'
+DB_MEMORY_SYNC = os.environ.get('DB_MEMORY_SYNC', 'commit')
+DB_MEMORY_SYNC_INTERVAL = float(os.environ.get('DB_MEMORY_SYNC_INTERVAL', '30'))
+DB_MEMORY_SYNC_PATH = os.environ.get('DB_MEMORY_SYNC_PATH', DB_PATH)
 
-def create_db_connection():
-    """Creates a connection to the SQLite database."""
+# PRAGMAs applied to every new file connection. DB_PRAGMA_PROFILE picks one of the profiles and DB_PRAGMAS (a JSON
+# object, e.g. {"cache_size": -32000}) overrides single settings. 'tuned' uses WAL so readers do not block the writer
+# and a commit is one append to the log instead of several fsyncs. With synchronous=NORMAL a commit survives the
+# process being killed but the last ones can be lost on power loss, 'default' keeps SQLite's own settings.
+DB_PRAGMA_PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8000,  # Negative is in KiB, so 8MB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # Milliseconds to wait for a lock before failing with "database is locked"
+    },
+}
+DB_PRAGMA_PROFILE = os.environ.get('DB_PRAGMA_PROFILE', 'tuned')
+DB_PRAGMAS = json.loads(os.environ.get('DB_PRAGMAS', "{}"))
+PRAGMA_NAME_PATTERN = re.compile(r"[a-z_]+")
+PRAGMA_VALUE_PATTERN = re.compile(r"-?\d+|[A-Za-z]+")
+
+# Connection kept for the life of a warm container, along with the identity of the file it was opened on
+_db_connection = None
+_db_file_id = None
+# Read-only connection to the bundled database, used by reads until a write has made the /tmp copy
+_db_readonly_connection = None
+# In-memory copy of the database and its write-back state, see DB_MEMORY_MODE
+_db_memory_connection = None
+_db_memory_dirty = False
+_db_memory_synced_at = 0.0
+
+def _db_file_identity():
+    """Returns the (device, inode) of the database file, or None if it does not exist."""
+    try:
+        stat = os.stat(DB_PATH)
+        return (stat.st_dev, stat.st_ino)
+    except OSError:
+        return None
+
+def db_pragmas():
+    """Returns the PRAGMA settings for new connections, the selected profile with the DB_PRAGMAS overrides applied."""
+    pragmas = dict(DB_PRAGMA_PROFILES.get(DB_PRAGMA_PROFILE, {}))
+    pragmas.update(DB_PRAGMAS)
+    return pragmas
+
+def apply_db_pragmas(connection):
+    """Applies the PRAGMA profile to a new connection and returns the values now in effect. Settings that are not a
+    plain name and number or keyword are skipped, as are ones the connection cannot take (an immutable read-only file
+    stays in its own journal mode)."""
+    in_effect = {}
+    for name, value in db_pragmas().items():
+        if not PRAGMA_NAME_PATTERN.fullmatch(name) or not PRAGMA_VALUE_PATTERN.fullmatch(str(value)):
+            logger.warning(f"Skipping invalid database PRAGMA {name} = {value!r}")
+            continue
+        try:
+            connection.execute(f"PRAGMA {name} = {value}").fetchall()
+            in_effect[name] = connection.execute(f"PRAGMA {name}").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Could not apply database PRAGMA {name} = {value}: {e}")
+    return in_effect
+
+def _readonly_db_connection():
+    """Returns a connection to the bundled database opened immutable (no locking, no journal, no /tmp copy), or None
+    if the bundled file is missing or its schema is behind the migrations and so needs the writable copy."""
+    global _db_readonly_connection
+    if _db_readonly_connection is None:
+        if not os.path.exists(BUNDLED_DB_PATH):
+            return None
+        connection = sqlite3.connect(f"file:{quote(BUNDLED_DB_PATH)}?mode=ro&immutable=1", uri=True)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < DB_MIGRATIONS[-1][0]:
+            logger.info(f"Bundled database is at schema version {version}, reading from the migrated copy instead")
+            connection.close()
+            return None
+        apply_db_pragmas(connection)
+        _db_readonly_connection = connection
+    return _db_readonly_connection
+
+def _memory_db_connection():
+    """Returns the in-memory copy of the database, loading it with the backup API on first use. The last synced copy
+    is loaded if there is one, otherwise the bundled database."""
+    global _db_memory_connection, _db_memory_dirty, _db_memory_synced_at
+    if _db_memory_connection is None:
+        source_path = DB_MEMORY_SYNC_PATH if os.path.exists(DB_MEMORY_SYNC_PATH) else BUNDLED_DB_PATH
+        started = time.perf_counter()
+        source = sqlite3.connect(f"file:{quote(source_path)}?mode=ro", uri=True)
+        connection = sqlite3.connect(":memory:")
+        try:
+            source.backup(connection)
+        finally:
+            source.close()
+        migrate_database(connection)
+        logger.info(f"Loaded {source_path} into memory in {(time.perf_counter() - started) * 1e3:.1f}ms")
+        _db_memory_connection = connection
+        _db_memory_dirty = False
+        _db_memory_synced_at = time.monotonic()
+    return _db_memory_connection
+
+def sync_memory_db(force=False):
+    """Writes the in-memory database back to DB_MEMORY_SYNC_PATH if it has unsynced writes and DB_MEMORY_SYNC says it
+    is time to (force ignores the policy). Returns True if it synced."""
+    global _db_memory_dirty, _db_memory_synced_at
+    if _db_memory_connection is None or not _db_memory_dirty:
+        return False
+    if not force:
+        if DB_MEMORY_SYNC == 'off':
+            return False
+        if DB_MEMORY_SYNC == 'interval' and time.monotonic() - _db_memory_synced_at < DB_MEMORY_SYNC_INTERVAL:
+            return False
+    started = time.perf_counter()
+    target = sqlite3.connect(DB_MEMORY_SYNC_PATH)
     try:
-        connection = sqlite3.connect(DB_PATH)
-        return connection
+        _db_memory_connection.backup(target)
+    finally:
+        target.close()
+    _db_memory_dirty = False
+    _db_memory_synced_at = time.monotonic()
+    logger.info(f"Synced the in-memory database to {DB_MEMORY_SYNC_PATH} in {(time.perf_counter() - started) * 1e3:.1f}ms")
+    return True
+
+def commit_db_connection(connection):
+    """Commits a write. In memory mode the write is then synced to disk according to DB_MEMORY_SYNC, a failed sync is
+    logged and retried on the next write or invocation rather than failing the write that already committed."""
+    global _db_memory_dirty
+    connection.commit()
+    if connection is _db_memory_connection:
+        _db_memory_dirty = True
+        try:
+            sync_memory_db()
+        except sqlite3.Error as e:
+            logger.error(f"Error syncing the in-memory database to {DB_MEMORY_SYNC_PATH}: {e}")
+
+def create_db_connection(readonly=False):
+    """Returns the warm container's connection to the SQLite database, reconnecting if it is stale or the file was replaced.
+    Read-only callers are served straight from the bundled file until a write has created the /tmp copy.
+    In memory mode every caller gets the in-memory copy."""
+    global _db_connection, _db_file_id
+    try:
+        if DB_MEMORY_MODE:
+            return _memory_db_connection()
+        file_id = _db_file_identity()
+        if readonly and file_id is None:
+            connection = _readonly_db_connection()
+            if connection is not None:
+                return connection
+        if file_id is None:
+            # First write in this container (or a bundled database that needs migrating), take the copy now. A WAL
+            # left behind by a deleted copy must not be replayed into the new one.
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
+            shutil.copy2(BUNDLED_DB_PATH, DB_PATH)
+            file_id = _db_file_identity()
+        if _db_connection is not None:
+            if file_id is not None and file_id == _db_file_id:
+                try:
+                    # Cheap liveness check, does not touch any table pages
+                    _db_connection.execute("SELECT 1")
+                    return _db_connection
+                except sqlite3.Error as e:
+                    logger.warning(f"Cached database connection is unusable, reconnecting: {e}")
+            else:
+                logger.info("Database file has changed, reconnecting")
+            close_db_connection()
+        _db_connection = sqlite3.connect(DB_PATH)
+        _db_file_id = _db_file_identity()
+        logger.info(f"Database PRAGMAs ({DB_PRAGMA_PROFILE}): {apply_db_pragmas(_db_connection)}")
+        # Schema changes are applied once per new connection, normally only at cold start
+        try:
+            migrate_database(_db_connection)
+        except sqlite3.Error as e:
+            logger.error(f"Error migrating the database: {e}")
+        return _db_connection
     except Exception as e:
+        logger.error(f"Error connecting to the database: {e}")
         return None
 
+def release_db_connection(connection):
+    """Hands a connection back after use, rolling back anything left uncommitted so the next invocation starts clean."""
+    try:
+        if connection.in_transaction:
+            connection.rollback()
+    except sqlite3.Error as e:
+        logger.warning(f"Error releasing database connection: {e}")
+        close_db_connection()
+
+def close_db_connection():
+    """Closes the warm container's connections, the next create_db_connection() will open new ones. Unsynced in-memory
+    writes are synced first unless DB_MEMORY_SYNC is 'off'."""
+    global _db_connection, _db_file_id, _db_readonly_connection, _db_memory_connection
+    if _db_memory_connection is not None and DB_MEMORY_SYNC != 'off':
+        try:
+            sync_memory_db(force=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error syncing the in-memory database to {DB_MEMORY_SYNC_PATH}: {e}")
+    for connection in (_db_connection, _db_readonly_connection, _db_memory_connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+    _db_connection = None
+    _db_file_id = None
+    _db_readonly_connection = None
+    _db_memory_connection = None
+    # The team leave index mirrors the database it was built from
+    clear_team_leave_index()
+
+# Materialized leave summary, kept current by triggers on planned_vacations so reports read precomputed rows instead of
+# aggregating the bookings. A booking counts in the month it starts in, with all of its days. leave_summary holds the
+# bookings and days per employee per month, leave_title_summary the same per job title (the employee's title when the
+# booking was made or cancelled) per month. Rebuild them with rebuild_leave_summary() after changing bookings with the
+# triggers off, or an employee's job title.
+LEAVE_SUMMARY_TABLES = [
+    "CREATE TABLE IF NOT EXISTS leave_summary (employee_id INTEGER NOT NULL, month TEXT NOT NULL, bookings INTEGER NOT NULL, days INTEGER NOT NULL, PRIMARY KEY (employee_id, month)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS leave_title_summary (month TEXT NOT NULL, job_title TEXT NOT NULL, bookings INTEGER NOT NULL, days INTEGER NOT NULL, PRIMARY KEY (month, job_title)) WITHOUT ROWID",
+]
+# The job title of a booking's employee, '' when there is none
+_BOOKING_JOB_TITLE = "COALESCE((SELECT employee_job_title FROM employees WHERE employee_id = {row}.employee_id), '')"
+_ADD_TO_SUMMARY = f"""
+        INSERT INTO leave_summary (employee_id, month, bookings, days)
+        VALUES (NEW.employee_id, substr(NEW.vacation_start_date, 1, 7), 1, COALESCE(NEW.vacation_days_taken, 0))
+        ON CONFLICT (employee_id, month) DO UPDATE SET bookings = bookings + 1, days = days + excluded.days;
+        INSERT INTO leave_title_summary (month, job_title, bookings, days)
+        VALUES (substr(NEW.vacation_start_date, 1, 7), {_BOOKING_JOB_TITLE.format(row="NEW")}, 1, COALESCE(NEW.vacation_days_taken, 0))
+        ON CONFLICT (month, job_title) DO UPDATE SET bookings = bookings + 1, days = days + excluded.days;"""
+_REMOVE_FROM_SUMMARY = f"""
+        UPDATE leave_summary SET bookings = bookings - 1, days = days - COALESCE(OLD.vacation_days_taken, 0)
+        WHERE employee_id = OLD.employee_id AND month = substr(OLD.vacation_start_date, 1, 7);
+        DELETE FROM leave_summary WHERE employee_id = OLD.employee_id AND month = substr(OLD.vacation_start_date, 1, 7) AND bookings <= 0;
+        UPDATE leave_title_summary SET bookings = bookings - 1, days = days - COALESCE(OLD.vacation_days_taken, 0)
+        WHERE month = substr(OLD.vacation_start_date, 1, 7) AND job_title = {_BOOKING_JOB_TITLE.format(row="OLD")};
+        DELETE FROM leave_title_summary WHERE month = substr(OLD.vacation_start_date, 1, 7) AND job_title = {_BOOKING_JOB_TITLE.format(row="OLD")} AND bookings <= 0;"""
+LEAVE_SUMMARY_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS planned_vacations_summary_insert AFTER INSERT ON planned_vacations BEGIN{_ADD_TO_SUMMARY}\n    END",
+    f"CREATE TRIGGER IF NOT EXISTS planned_vacations_summary_delete AFTER DELETE ON planned_vacations BEGIN{_REMOVE_FROM_SUMMARY}\n    END",
+    # Recalculated durations (utils/recalculate_leave_durations.py) and moved bookings
+    f"CREATE TRIGGER IF NOT EXISTS planned_vacations_summary_update AFTER UPDATE OF employee_id, vacation_start_date, vacation_days_taken ON planned_vacations BEGIN{_REMOVE_FROM_SUMMARY}{_ADD_TO_SUMMARY}\n    END",
+]
+# The summary computed from scratch, used to fill the tables and to check them
+LEAVE_SUMMARY_QUERY = """
+    SELECT employee_id, substr(vacation_start_date, 1, 7) AS month, COUNT(*), SUM(COALESCE(vacation_days_taken, 0))
+    FROM planned_vacations
+    GROUP BY employee_id, month
+"""
+LEAVE_TITLE_SUMMARY_QUERY = """
+    SELECT substr(p.vacation_start_date, 1, 7) AS month, COALESCE(e.employee_job_title, '') AS job_title, COUNT(*), SUM(COALESCE(p.vacation_days_taken, 0))
+    FROM planned_vacations p LEFT JOIN employees e ON e.employee_id = p.employee_id
+    GROUP BY month, job_title
+"""
+LEAVE_SUMMARY_FILL = [
+    "DELETE FROM leave_summary",
+    "DELETE FROM leave_title_summary",
+    f"INSERT INTO leave_summary (employee_id, month, bookings, days) {LEAVE_SUMMARY_QUERY}",
+    f"INSERT INTO leave_title_summary (month, job_title, bookings, days) {LEAVE_TITLE_SUMMARY_QUERY}",
+]
+
+# Schema migrations, applied in order. Each entry is (user_version, description, statements).
+# Add new changes to the end with the next version number, never edit one that has shipped.
+DB_MIGRATIONS = [
+    (1, "Indexes for the employee and leave lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_employees_employee_name ON employees (employee_name)",
+        "CREATE INDEX IF NOT EXISTS idx_vacations_employee_id ON vacations (employee_id)",
+        "CREATE INDEX IF NOT EXISTS idx_planned_vacations_employee_id_start ON planned_vacations (employee_id, vacation_start_date)",
+    ]),
+    (2, "Index covering the booking date ranges for overlap checks", [
+        "CREATE INDEX IF NOT EXISTS idx_planned_vacations_employee_id_start_end ON planned_vacations (employee_id, vacation_start_date, vacation_end_date)",
+        # Same leading columns as the new index, which serves every query the old one did
+        "DROP INDEX IF EXISTS idx_planned_vacations_employee_id_start",
+    ]),
+    (3, "Leave calendars with weekmasks and public holidays", [
+        "CREATE TABLE IF NOT EXISTS leave_calendars (calendar TEXT PRIMARY KEY, weekmask TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS public_holidays (calendar TEXT NOT NULL, holiday_date TEXT NOT NULL, holiday_name TEXT, PRIMARY KEY (calendar, holiday_date), FOREIGN KEY(calendar) REFERENCES leave_calendars(calendar))",
+        "INSERT OR IGNORE INTO leave_calendars (calendar, weekmask) VALUES ('default', '1111100')",
+        "ALTER TABLE employees ADD COLUMN employee_calendar TEXT NOT NULL DEFAULT 'default'",
+    ]),
+    (4, "Index on the booking end dates for the team availability query", [
+        "CREATE INDEX IF NOT EXISTS idx_planned_vacations_end_start ON planned_vacations (vacation_end_date, vacation_start_date)",
+    ]),
+    (5, "One vacations row per employee per leave year, with the days carried over into it", [
+        "ALTER TABLE vacations ADD COLUMN employee_carried_over_days INTEGER",
+        # The existing rows already hold whatever was carried into them
+        "UPDATE vacations SET employee_carried_over_days = 0",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_vacations_employee_id_year ON vacations (employee_id, year)",
+        # Same leading column as the new index, which serves every query the old one did
+        "DROP INDEX IF EXISTS idx_vacations_employee_id",
+    ]),
+    (6, "Leave summary tables maintained by triggers on planned_vacations", LEAVE_SUMMARY_TABLES + LEAVE_SUMMARY_TRIGGERS + LEAVE_SUMMARY_FILL),
+    (7, "Index on each employee's booking end dates for the overlap check", [
+        "CREATE INDEX IF NOT EXISTS idx_planned_vacations_employee_id_end_start ON planned_vacations (employee_id, vacation_end_date, vacation_start_date)",
+    ]),
+]
+
+def migrate_database(connection, in_transaction=False):
+    """Brings the database schema up to date, using PRAGMA user_version to track the migrations already applied.
+    Each migration commits on its own, unless in_transaction says the caller has a transaction open: the migrations
+    then commit or roll back with the caller's work."""
+    current_version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, statements in DB_MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info(f"Applying database migration {version}: {description}")
+        try:
+            if not in_transaction:
+                connection.execute("BEGIN")
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {int(version)}")
+            if not in_transaction:
+                connection.commit()
+        except sqlite3.Error:
+            if not in_transaction:
+                connection.rollback()
+            raise
+        current_version = version
+    return current_version
+
+# Leave duration engine. A leave day is a day set in the calendar's weekmask (seven 0/1 flags, Monday first, as in
+# numpy's busday_count) that is not one of the calendar's public holidays. Calendars are read from the leave_calendars
+# and public_holidays tables once per container and counted with week arithmetic and a binary search over the
+# holidays, so a range costs the same whatever its length and a batch needs no per-day loop.
+DEFAULT_LEAVE_CALENDAR = "default"
+DEFAULT_WEEKMASK = "1111100"
+WEEKMASK_PATTERN = re.compile(r"[01]{7}")
+
+_leave_calendars = {}  # calendar name -> compiled calendar, see compile_leave_calendar()
+
+class LeaveCalendarError(Exception):
+    """A calendar stored in the database (its weekmask or a holiday) is malformed. Kept apart from ValueError so the
+    functions do not report bad stored data as a mistake in the dates they were given."""
+
+def compile_leave_calendar(weekmask, holidays=()):
+    """Returns a calendar for count_leave_days() from a weekmask string and an iterable of holiday dates (date objects
+    or YYYY-MM-DD strings). Holidays that fall on a day off anyway are dropped so they are not subtracted twice."""
+    if not WEEKMASK_PATTERN.fullmatch(weekmask) or "1" not in weekmask:
+        raise ValueError(f"Invalid weekmask {weekmask!r}, expected seven 0/1 flags starting on Monday")
+    mask = [int(flag) for flag in weekmask]
+    # Working days in the first n days of a week starting on each weekday, from a doubled mask
+    prefix = [0]
+    for flag in mask + mask:
+        prefix.append(prefix[-1] + flag)
+    ordinals = set()
+    for holiday in holidays:
+        if isinstance(holiday, str):
+            try:
+                holiday = date.fromisoformat(holiday)
+            except ValueError:
+                raise ValueError(f"Invalid holiday {holiday!r}, expected YYYY-MM-DD")
+        if mask[holiday.weekday()]:
+            ordinals.add(holiday.toordinal())
+    return {"weekmask": weekmask, "week_days": prefix[7], "prefix": prefix, "holidays": sorted(ordinals)}
+
+def load_leave_calendar(connection, name=DEFAULT_LEAVE_CALENDAR):
+    """Returns the named calendar from the database, cached for the life of the container. An unknown calendar (or a
+    database from before the calendar tables) gets the default weekmask with no holidays, a malformed one raises
+    LeaveCalendarError."""
+    calendar = _leave_calendars.get(name)
+    if calendar is None:
+        weekmask, holidays = DEFAULT_WEEKMASK, []
+        try:
+            row = connection.execute("SELECT weekmask FROM leave_calendars WHERE calendar = ?", (name,)).fetchone()
+            if row:
+                weekmask = row[0]
+                holidays = [holiday for (holiday,) in connection.execute("SELECT holiday_date FROM public_holidays WHERE calendar = ?", (name,))]
+            else:
+                logger.warning(f"Leave calendar {name} not found, using the {DEFAULT_WEEKMASK} weekmask with no holidays")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Leave calendars unavailable, using the {DEFAULT_WEEKMASK} weekmask with no holidays: {e}")
+        try:
+            calendar = compile_leave_calendar(weekmask, holidays)
+        except (ValueError, TypeError, AttributeError) as e:
+            raise LeaveCalendarError(f"Leave calendar {name} stored in the database is invalid: {e}")
+        _leave_calendars[name] = calendar
+    return calendar
+
+def clear_leave_calendars():
+    """Drops the cached calendars, the next lookup reads them from the database again."""
+    _leave_calendars.clear()
+
+def employee_leave_calendar(connection, employee_number):
+    """Returns the calendar of the employee, the default one if the employee is unknown."""
+    try:
+        row = connection.execute("SELECT employee_calendar FROM employees WHERE employee_id = ?", (employee_number,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return load_leave_calendar(connection, row[0] if row else DEFAULT_LEAVE_CALENDAR)
+
+def _count_leave_days(first, last, calendar):
+    """Leave days from ordinal first to ordinal last inclusive."""
+    if last < first:
+        return 0
+    days = last - first + 1
+    weeks, remainder = divmod(days, 7)
+    weekday = (first + 6) % 7  # date.fromordinal(1) is a Monday
+    prefix = calendar["prefix"]
+    count = weeks * calendar["week_days"] + prefix[weekday + remainder] - prefix[weekday]
+    holidays = calendar["holidays"]
+    return count - (bisect_left(holidays, last + 1) - bisect_left(holidays, first))
+
+def count_leave_days(start_date, end_date, calendar):
+    """Returns the number of leave days from start_date to end_date inclusive (date objects or YYYY-MM-DD strings)."""
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+    return _count_leave_days(start_date.toordinal(), end_date.toordinal(), calendar)
+
+def count_leave_days_many(ranges, calendar):
+    """Batched count_leave_days(): returns the leave days of every (start, end) pair in ranges, in order."""
+    to_ordinal = date.toordinal
+    parse = date.fromisoformat
+    return [
+        _count_leave_days(
+            to_ordinal(parse(start) if isinstance(start, str) else start),
+            to_ordinal(parse(end) if isinstance(end, str) else end),
+            calendar,
+        )
+        for start, end in ranges
+    ]
+
+# Leave years. The vacations table holds one row per employee per leave year. A leave year is named after the calendar
+# year it starts in and runs from LEAVE_YEAR_START_MONTH for twelve months, so a booking is taken from the row of the
+# year each of its days falls in and one that crosses a year end is split between the two rows.
+# A year's row is opened by the first booking in it, with the entitlement of the year before (LEAVE_ANNUAL_ENTITLEMENT
+# if there is no year before). Once the year has started, up to LEAVE_CARRY_OVER_MAX_DAYS of the days left over from
+# the year before are carried into it, recorded in employee_carried_over_days (NULL until that has happened). Every
+# step is an index seek on (employee_id, year), so a booking costs the same however many years an employee has.
+LEAVE_YEAR_START_MONTH = int(os.environ.get('LEAVE_YEAR_START_MONTH', '1'))
+LEAVE_ANNUAL_ENTITLEMENT = int(os.environ.get('LEAVE_ANNUAL_ENTITLEMENT', '20'))
+LEAVE_CARRY_OVER_MAX_DAYS = int(os.environ.get('LEAVE_CARRY_OVER_MAX_DAYS', '5'))
+
+def leave_year(day):
+    """Returns the leave year a date (or YYYY-MM-DD string) falls in."""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.year if day.month >= LEAVE_YEAR_START_MONTH else day.year - 1
+
+def leave_year_start(year):
+    """Returns the first day of a leave year."""
+    return date(year, LEAVE_YEAR_START_MONTH, 1)
+
+def leave_days_by_year(start_date, end_date, calendar, total=None):
+    """Splits the leave days from start_date to end_date into [(leave year, days)], one entry per year the range
+    touches. With total (the days a booking actually took, which for an old booking may differ from what the calendar
+    counts today) the split is made to add up to it, shared between the years in proportion to their calendar days so
+    no year gets less than nothing or more than the total."""
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date)
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+    first_year, last_year = leave_year(start_date), leave_year(end_date)
+    if first_year >= last_year:
+        days = total if total is not None else count_leave_days(start_date, end_date, calendar)
+        return [(first_year, days)]
+    split = []
+    for year in range(first_year, last_year + 1):
+        first = max(start_date, leave_year_start(year))
+        last = min(end_date, leave_year_start(year + 1) - timedelta(days=1))
+        split.append([year, count_leave_days(first, last, calendar)])
+    counted = sum(days for _, days in split)
+    if total is not None and total != counted:
+        if counted <= 0:
+            return [(year, total if year == first_year else 0) for year, _ in split]
+        # Whole days in proportion, the days left over from rounding down go to the largest remainders
+        shares = [[year, days * total // counted, days * total % counted] for year, days in split]
+        for share in sorted(shares, key=lambda share: -share[2])[:total - sum(share[1] for share in shares)]:
+            share[1] += 1
+        return [(year, days) for year, days, _ in shares]
+    return [(year, days) for year, days in split]
+
+# Opens an employee's row for a leave year if there is none, with the entitlement of the year before
+OPEN_LEAVE_YEAR = """
+    INSERT OR IGNORE INTO vacations (employee_id, year, employee_total_vacation_days, employee_vacation_days_taken,
+                                     employee_vacation_days_available, employee_carried_over_days)
+    SELECT employee_id, :year, days, 0, days, NULL
+    FROM (
+        SELECT e.employee_id,
+               COALESCE((SELECT employee_total_vacation_days - COALESCE(employee_carried_over_days, 0)
+                         FROM vacations WHERE employee_id = :employee_id AND year = :year - 1), :entitlement) AS days
+        FROM employees e
+        WHERE e.employee_id = :employee_id
+    )
+"""
+
+# Carries the days left over from the year before into a leave year that has started, once. Without a row for the
+# year before nothing is updated, and SETTLE_NO_CARRY_OVER then records that nothing was carried.
+SETTLE_CARRY_OVER = """
+    UPDATE vacations
+    SET employee_carried_over_days = MIN(:carry_max, MAX(0, COALESCE(prev.employee_vacation_days_available, 0))),
+        employee_total_vacation_days = vacations.employee_total_vacation_days + MIN(:carry_max, MAX(0, COALESCE(prev.employee_vacation_days_available, 0))),
+        employee_vacation_days_available = vacations.employee_vacation_days_available + MIN(:carry_max, MAX(0, COALESCE(prev.employee_vacation_days_available, 0)))
+    FROM vacations AS prev
+    WHERE vacations.employee_id = :employee_id AND vacations.year = :year AND vacations.employee_carried_over_days IS NULL
+    AND prev.employee_id = :employee_id AND prev.year = :year - 1
+"""
+SETTLE_NO_CARRY_OVER = """
+    UPDATE vacations SET employee_carried_over_days = 0
+    WHERE employee_id = :employee_id AND year = :year AND employee_carried_over_days IS NULL
+"""
+
+# Balances for a leave year computed from the employee's row for that year and the one before, without writing
+# anything: a year that has not been opened yet shows the entitlement it would open with, and a year that has
+# started but not yet had its carry-over settled shows the days that would be carried.
+LEAVE_BALANCES_SELECT = """
+    SELECT employee_id, employee_name, employee_job_title, entitlement, carried_over, taken,
+           COALESCE(available, entitlement) + CASE WHEN settled THEN 0 ELSE carried_over END AS available
+    FROM (
+        SELECT e.employee_id, e.employee_name, e.employee_job_title,
+               COALESCE(cur.employee_total_vacation_days - COALESCE(cur.employee_carried_over_days, 0),
+                        prev.employee_total_vacation_days - COALESCE(prev.employee_carried_over_days, 0),
+                        :entitlement) AS entitlement,
+               COALESCE(cur.employee_carried_over_days,
+                        CASE WHEN :carry_due THEN MIN(:carry_max, MAX(0, prev.employee_vacation_days_available)) END,
+                        0) AS carried_over,
+               COALESCE(cur.employee_vacation_days_taken, 0) AS taken,
+               cur.employee_vacation_days_available AS available,
+               cur.employee_carried_over_days IS NOT NULL AS settled
+        FROM employees e
+        LEFT JOIN vacations cur ON cur.employee_id = e.employee_id AND cur.year = :year
+        LEFT JOIN vacations prev ON prev.employee_id = e.employee_id AND prev.year = :year - 1
+    )
+"""
+LEAVE_BALANCE_QUERY = LEAVE_BALANCES_SELECT.rstrip() + "\n    WHERE employee_id = :employee_id\n"
+LEAVE_BALANCE_REPORT_QUERY = LEAVE_BALANCES_SELECT.rstrip() + "\n    ORDER BY employee_id\n"
+
+def leave_balance_parameters(year, **extra):
+    """The parameters for the balance queries for a leave year."""
+    today = datetime.now().date()
+    return {
+        "year": year,
+        "entitlement": LEAVE_ANNUAL_ENTITLEMENT,
+        "carry_max": LEAVE_CARRY_OVER_MAX_DAYS,
+        "carry_due": int(today >= leave_year_start(year)),
+        **extra,
+    }
+
+def open_leave_year(connection, employee_number, year):
+    """Opens the employee's row for the leave year if needed and settles its carry-over if the year has started.
+    Must run inside the caller's write transaction."""
+    connection.execute(OPEN_LEAVE_YEAR, {"employee_id": employee_number, "year": year, "entitlement": LEAVE_ANNUAL_ENTITLEMENT})
+    if datetime.now().date() >= leave_year_start(year):
+        connection.execute(SETTLE_CARRY_OVER, {"employee_id": employee_number, "year": year, "carry_max": LEAVE_CARRY_OVER_MAX_DAYS})
+        connection.execute(SETTLE_NO_CARRY_OVER, {"employee_id": employee_number, "year": year})
+
+def leave_balance_report(year=None):
+    """Returns the balance of every employee for a leave year (the current one by default) from one set-based query."""
+    connection = create_db_connection(readonly=True)
+    if connection is None:
+        return {"error": "Failed to connect to database"}
+
+    try:
+        year = int(year) if year else leave_year(datetime.now().date())
+        cursor = connection.cursor()
+        cursor.execute(LEAVE_BALANCE_REPORT_QUERY, leave_balance_parameters(year))
+        return {
+            "leave_year": year,
+            "balances": [
+                {
+                    "employee_id": row[0],
+                    "employee_name": row[1],
+                    "employee_job_title": row[2],
+                    "entitlement": row[3],
+                    "carried_over_days": row[4],
+                    "days_taken": row[5],
+                    "days_available": row[6],
+                }
+                for row in cursor
+            ],
+        }
+    except Exception as e:
+        return {"error": f"Error building the leave balance report: {e}"}
+    finally:
+        release_db_connection(connection)
+
 def get_employee_id(employee_name: str)  -> int:
     """Simulates a Lambda function to lookup an employee's id based on their name."""
-    connection = create_db_connection()
+    connection = create_db_connection(readonly=True)
     if connection is None:
         return {"error": "Failed to connect to database"}
 
@@ -40,11 +740,11 @@ def get_employee_id(employee_name: str)  -> int:
     except Exception as e:
         return {"error": f"Error fetching leave balance: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
     
 def employee_details(employee_number: int) -> dict[str, any]:
     """Simulates a Lambda function to get all the employees details."""
-    connection = create_db_connection()
+    connection = create_db_connection(readonly=True)
     if connection is None:
         return {"error": "Failed to connect to database"}
 
@@ -72,29 +772,62 @@ def employee_details(employee_number: int) -> dict[str, any]:
     except Exception as e:
         return {"error": f"Error fetching employee details: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
 
-def get_leave_balance(employee_number: int) -> dict[str, any]:
-    """Simulates a Lambda function to get an employee's leave balance."""
-    connection = create_db_connection()
+def get_leave_balance(employee_number: int, year: int = None) -> dict[str, any]:
+    """Simulates a Lambda function to get an employee's leave balance for a leave year (the current one by default)."""
+    connection = create_db_connection(readonly=True)
     if connection is None:
         return {"error": "Failed to connect to database"}
 
     try:
+        year = int(year) if year else leave_year(datetime.now().date())
         cursor = connection.cursor()
-        cursor.execute(
-            "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = ?",
-            (employee_number,),
-        )
+        cursor.execute(LEAVE_BALANCE_QUERY, leave_balance_parameters(year, employee_id=employee_number))
         result = cursor.fetchone()
         if result:
-            return {"employee_number": employee_number, "employee_vacation_days_available": result[0]}
+            return {
+                "employee_number": employee_number,
+                "leave_year": year,
+                "employee_vacation_days_available": result[6],
+                "carried_over_days": result[4],
+            }
         else:
             return {"error": "Employee not found"}
     except Exception as e:
         return {"error": f"Error fetching leave balance: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
+
+# Conditional balance update for book_leave, for one leave year of the booking. The row is only debited if it has
+# enough days left and, once the year has started, its carry-over has been settled. Returns no rows otherwise, then
+# book_leave opens and settles the year and tries once more.
+BOOK_LEAVE_UPDATE = """
+    UPDATE vacations
+    SET employee_vacation_days_available = employee_vacation_days_available - :days,
+        employee_vacation_days_taken = COALESCE(employee_vacation_days_taken, 0) + :days
+    WHERE employee_id = :employee_id AND year = :year AND employee_vacation_days_available >= :days
+    AND (employee_carried_over_days IS NOT NULL OR NOT :carry_due)
+    RETURNING employee_vacation_days_available
+"""
+
+# Credits a cancelled booking's days back to one leave year
+CANCEL_LEAVE_UPDATE = """
+    UPDATE vacations
+    SET employee_vacation_days_available = employee_vacation_days_available + :days,
+        employee_vacation_days_taken = COALESCE(employee_vacation_days_taken, 0) - :days
+    WHERE employee_id = :employee_id AND year = :year
+"""
+
+# Existing bookings that overlap a date range. The seek is on the employee's bookings ending on or after the start of
+# the range, and as a new booking never starts in the past those are the upcoming ones, not the whole history. It does
+# not rely on the existing bookings being apart from each other, older data can hold overlapping ones. The unary +
+# keeps the planner off the start date index, which would walk every earlier booking instead.
+OVERLAPPING_LEAVE_QUERY = """
+    SELECT vacation_start_date, vacation_end_date, vacation_days_taken
+    FROM planned_vacations
+    WHERE employee_id = :employee_id AND vacation_end_date >= :start_date AND +vacation_start_date <= :end_date
+"""
 
 def book_leave(employee_number: int, start_date_str: str, end_date_str: str) -> dict[str, any]:
     """Simulates a Lambda function to book leave for an employee."""
@@ -114,27 +847,62 @@ def book_leave(employee_number: int, start_date_str: str, end_date_str: str) ->
         logger.info(f"{start_date}-{end_date} vs {today}")
 
         logger.info(f"Employee : {employee_number}")
+        # Working days only, weekends and public holidays in the employee's calendar are not taken from the balance.
+        # Each leave year the booking touches pays for its own days.
+        days_by_year = leave_days_by_year(start_date, end_date, employee_leave_calendar(connection, employee_number))
+        leave_duration = sum(days for _, days in days_by_year)
+        if leave_duration == 0:
+            return {"error": "No working days in the requested range"}
         cursor = connection.cursor()
-            # Check employee exists and has enough leave.
-        cursor.execute(
-                "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = ?",
-                (employee_number,),
-            )
-        result = cursor.fetchone()
-        logger.info(f"Result : {result}")
-
-        if not result:
-            return {"error": "Employee not found"}
-        leave_available = result[0]
-        leave_duration = (end_date - start_date).days + 1  # Inclusive
-
-        if leave_available < leave_duration:
+        # Take the write lock up front, so the balance check and the booking are one atomic step and two concurrent
+        # bookings cannot both pass the check
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(OVERLAPPING_LEAVE_QUERY, {"employee_id": employee_number, "start_date": str(start_date), "end_date": str(end_date)})
+        conflicts = sorted(cursor.fetchall())
+        if conflicts:
+            connection.rollback()
             return {
-                "error": "Insufficient leave available",
-                "leave_available": leave_available,
+                "error": "Leave overlaps existing bookings",
+                "conflicts": [
+                    {
+                        "start_date": row[0],
+                        "end_date": row[1],
+                        "days of vacation": row[2],
+                    }
+                    for row in conflicts
+                ],
             }
 
-            # Book the leave
+        # Take the leave only if every year's balance covers its part
+        for year, days in days_by_year:
+            if days == 0:
+                continue
+            params = {"employee_id": employee_number, "year": year, "days": days, "carry_due": int(today >= leave_year_start(year))}
+            cursor.execute(BOOK_LEAVE_UPDATE, params)
+            updated = cursor.fetchall()
+            if not updated:
+                # The year may not be open yet, or not have had its carry-over
+                open_leave_year(connection, employee_number, year)
+                cursor.execute(BOOK_LEAVE_UPDATE, params)
+                updated = cursor.fetchall()
+            logger.info(f"Result {year} : {updated}")
+
+            if not updated:
+                cursor.execute(
+                    "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = ? AND year = ?",
+                    (employee_number, year),
+                )
+                result = cursor.fetchone()
+                connection.rollback()
+                if not result:
+                    return {"error": "Employee not found"}
+                return {
+                    "error": "Insufficient leave available",
+                    "leave_year": year,
+                    "leave_available": result[0],
+                }
+
+        # Book the leave
         cursor.execute(
                 """
                 INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken)
@@ -142,60 +910,140 @@ def book_leave(employee_number: int, start_date_str: str, end_date_str: str) ->
                 """,
                 (employee_number, str(start_date), str(end_date),leave_duration),
             )
-            #update the leave balance.
-        cursor.execute(
-                "UPDATE vacations SET employee_vacation_days_available = employee_vacation_days_available - ? WHERE employee_id = ?",
-                (leave_duration, employee_number),
-            )
-        connection.commit()
+        request_id = cursor.lastrowid
+        commit_db_connection(connection)
+        if _team_leave_index is not None:
+            _team_leave_index.add(request_id, employee_number, str(start_date), str(end_date), leave_duration)
         return {
                 "message": "Leave booked successfully",
                 "employee_number": employee_number,
                 "start_date": start_date_str,
                 "end_date": end_date_str,
                 "leave_duration": leave_duration,
+                "leave_by_year": [{"leave_year": year, "days": days} for year, days in days_by_year if days],
             }
+    except LeaveCalendarError as e:
+        logger.error(str(e))
+        return {"error": str(e)}
     except ValueError:
         return {"error": "Invalid date format. Use YYYY-MM-DD"}
     except Exception as e:
         return {"error": f"Error booking leave: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
 
 
-def list_leave(employee_number: int) -> dict[str, any]:
-    """Simulates a Lambda function to list leave for an employee."""
-    connection = create_db_connection()
+# Paging for list_leave. Bookings come back in (vacation_start_date, request_id) order, LIST_LEAVE_LIMIT at a time
+# (at most LIST_LEAVE_MAX_LIMIT), and next_cursor carries the last key of a page so the next page starts right after
+# it with an index seek, however deep it is.
+LIST_LEAVE_LIMIT = int(os.environ.get('LIST_LEAVE_LIMIT', '20'))
+LIST_LEAVE_MAX_LIMIT = int(os.environ.get('LIST_LEAVE_MAX_LIMIT', '100'))
+LIST_LEAVE_STATUSES = ("upcoming", "current", "taken")
+
+# One page of an employee's bookings. Only bookings ending on or after :end_floor are wanted, so none of them starts
+# before the earliest start among those, found with a seek on the end date index (the same one OVERLAPPING_LEAVE_QUERY
+# uses). That start date bounds the index range from below without assuming the bookings never overlap. Without a
+# date filter the bound is skipped. The cursor's start date is part of the same bound, SQLite only seeks on one lower
+# bound and the row value comparison alone would not be it.
+# The seek has no upper bound on the end date, so a date range in the middle of a long history reads every booking
+# ending after :end_floor to find that start (75ms for one in the middle of 1M bookings, against 120us near the end).
+LIST_LEAVE_QUERY = """
+    SELECT request_id, vacation_start_date, vacation_end_date, vacation_days_taken
+    FROM planned_vacations
+    WHERE employee_id = :employee_id
+    AND vacation_start_date >= MAX(:start_floor, :after_start, CASE WHEN :end_floor = '' THEN '' ELSE COALESCE(
+        (SELECT MIN(vacation_start_date) FROM planned_vacations INDEXED BY idx_planned_vacations_employee_id_end_start
+         WHERE employee_id = :employee_id AND vacation_end_date >= :end_floor), :end_floor) END)
+    AND vacation_start_date <= :start_ceiling
+    AND vacation_end_date >= :end_floor AND vacation_end_date <= :end_ceiling
+    AND (vacation_start_date, request_id) > (:after_start, :after_request_id)
+    ORDER BY vacation_start_date, request_id
+    LIMIT :limit
+"""
+
+def encode_leave_cursor(start_date, request_id):
+    """Returns the opaque cursor for the page after the booking (start_date, request_id)."""
+    return base64.urlsafe_b64encode(json.dumps([start_date, request_id], separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_leave_cursor(cursor):
+    """Returns (start_date, request_id) from a cursor made by encode_leave_cursor(), raises ValueError if it is not one."""
+    try:
+        start_date, request_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(start_date, str) or not isinstance(request_id, int):
+        raise ValueError("Invalid cursor")
+    return start_date, request_id
+
+def list_leave_parameters(employee_number, start_date=None, end_date=None, status=None, cursor=None, limit=None):
+    """Turns the list_leave filters into the LIST_LEAVE_QUERY parameters. The dates are kept as YYYY-MM-DD strings,
+    '' and '9999-12-31' stand for no bound. Raises ValueError for a bad filter."""
+    params = {
+        "employee_id": employee_number,
+        "start_floor": "",
+        "start_ceiling": "9999-12-31",
+        "end_floor": "",
+        "end_ceiling": "9999-12-31",
+        "after_start": "",
+        "after_request_id": 0,
+    }
+    # A date range keeps the bookings with at least one day in it
+    try:
+        if start_date:
+            params["end_floor"] = str(datetime.strptime(start_date, "%Y-%m-%d").date())
+        if end_date:
+            params["start_ceiling"] = str(datetime.strptime(end_date, "%Y-%m-%d").date())
+    except ValueError:
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+    if status:
+        if status not in LIST_LEAVE_STATUSES:
+            raise ValueError(f"Invalid status, use one of {', '.join(LIST_LEAVE_STATUSES)}")
+        today = datetime.now().date()
+        if status == "upcoming":
+            params["start_floor"] = str(today + timedelta(days=1))
+        elif status == "current":
+            params["end_floor"] = max(params["end_floor"], str(today))
+            params["start_ceiling"] = min(params["start_ceiling"], str(today))
+        else:
+            params["end_ceiling"] = str(today - timedelta(days=1))
+    if cursor:
+        params["after_start"], params["after_request_id"] = decode_leave_cursor(cursor)
+    limit = int(limit) if limit else LIST_LEAVE_LIMIT
+    # One more than the page, to know whether there is a next one
+    params["limit"] = max(1, min(limit, LIST_LEAVE_MAX_LIMIT)) + 1
+    return params
+
+def list_leave(employee_number: int, start_date: str = None, end_date: str = None, status: str = None,
+               cursor: str = None, limit: int = None) -> dict[str, any]:
+    """Simulates a Lambda function to list leave for an employee, a page at a time. start_date and end_date keep the
+    bookings with a day in that range, status keeps the upcoming, current or taken ones, and cursor is the
+    next_cursor of the previous page."""
+    connection = create_db_connection(readonly=True)
     if connection is None:
         return {"error": "Failed to connect to database"}
 
     try:
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT vacation_start_date, vacation_end_date, vacation_days_taken
-            FROM planned_vacations
-            WHERE employee_id = ?
-            """,
-            (employee_number,),
-        )
-        results = cursor.fetchall()
-        if results:
-            leave_list = [
-                {
-                    "start_date": row[0],
-                    "end_date": row[1],
-                    "days of vacation": row[2],
-                }
-                for row in results
-            ]
-            return {"employee_number": employee_number, "leave_requests": leave_list}
-        else:
-            return {"employee_number": employee_number, "leave_requests": []}
+        params = list_leave_parameters(employee_number, start_date, end_date, status, cursor, limit)
+        db_cursor = connection.cursor()
+        db_cursor.execute(LIST_LEAVE_QUERY, params)
+        results = db_cursor.fetchall()
+        page_size = params["limit"] - 1
+        next_cursor = encode_leave_cursor(results[page_size - 1][1], results[page_size - 1][0]) if len(results) > page_size else None
+        leave_list = [
+            {
+                "start_date": row[1],
+                "end_date": row[2],
+                "days of vacation": row[3],
+            }
+            for row in results[:page_size]
+        ]
+        return {"employee_number": employee_number, "leave_requests": leave_list, "next_cursor": next_cursor}
+    except ValueError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"Error listing leave: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
 
 
 def cancel_leave(employee_number: int, start_date_str: str) -> dict[str, any]:
@@ -208,103 +1056,930 @@ def cancel_leave(employee_number: int, start_date_str: str) -> dict[str, any]:
         start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
 
         cursor = connection.cursor()
-        # Check if the leave entry exists
+        # Take the write lock up front, as book_leave does, so two concurrent cancellations of the same booking
+        # cannot both find it and both credit it back
+        cursor.execute("BEGIN IMMEDIATE")
         cursor.execute(
-                "SELECT vacation_end_date FROM planned_vacations WHERE employee_id = ? AND vacation_start_date = ?",
+                "DELETE FROM planned_vacations WHERE employee_id = ? AND vacation_start_date = ? RETURNING request_id, vacation_end_date, vacation_days_taken",
                 (employee_number, str(start_date)),
             )
-        result = cursor.fetchone()
-        if not result:
+        cancelled = cursor.fetchall()
+        if not cancelled:
+            connection.rollback()
             return {"error": "Leave entry not found"}
 
-        end_date = datetime.strptime(result[0], "%Y-%m-%d").date()
-        leave_duration = (end_date - start_date).days + 1
+        # Credit back what the booking took to the years it was taken from, even if the calendar has changed since
+        calendar = employee_leave_calendar(connection, employee_number)
+        for _, end_date, days_taken in cancelled:
+            for year, days in leave_days_by_year(start_date, end_date, calendar, total=days_taken):
+                if days:
+                    cursor.execute(CANCEL_LEAVE_UPDATE, {"employee_id": employee_number, "year": year, "days": days})
+                    if cursor.rowcount == 0:
+                        logger.warning(f"No {year} leave year for employee {employee_number}, {days} days not credited")
+        commit_db_connection(connection)
+        if _team_leave_index is not None:
+            for request_id, _, _ in cancelled:
+                _team_leave_index.remove(request_id)
+        return {"message": f"Leave starting on {start_date} cancelled successfully"}
+    except LeaveCalendarError as e:
+        logger.error(str(e))
+        return {"error": str(e)}
+    except ValueError:
+        return {"error": "Invalid date format. Use YYYY-MM-DD"}
+    except Exception as e:
+        return {"error": f"Error cancelling leave: {e}"}
+    finally:
+        release_db_connection(connection)
 
-        # Delete the leave entry
-        cursor.execute(
-                "DELETE FROM planned_vacations WHERE employee_id = ? AND vacation_start_date = ?",
-                (employee_number, str(start_date)),
-            )
 
-            # Credit the leave back to the employee
-        cursor.execute(
-                "UPDATE vacations SET employee_vacation_days_available = employee_vacation_days_available + ? WHERE employee_id = ?",
-                (leave_duration, employee_number),
-            )
-        connection.commit()
-        return {"message": "Leave starting on {start_date} cancelled successfully"}
+# Team availability. employees_on_leave() answers "who is off between X and Y" with one range query over the bookings
+# joined to the employees. It seeks on vacation_end_date, so it reads the bookings ending on or after X: for the usual
+# "next week" question that is the upcoming bookings, not the whole history.
+# With TEAM_LEAVE_INDEX=on, an in-memory interval index of every booking is built on the first question in a container
+# and kept up to date by book_leave and cancel_leave. It answers in time proportional to the length of the range and
+# the number of bookings found, however many bookings there are.
+TEAM_LEAVE_INDEX_ENABLED = os.environ.get('TEAM_LEAVE_INDEX', 'off') == 'on'
+TEAM_LEAVE_MAX_DAYS = int(os.environ.get('TEAM_LEAVE_MAX_DAYS', '366'))  # Longest range a single question may cover
+
+EMPLOYEES_ON_LEAVE_QUERY = """
+    SELECT e.employee_id, e.employee_name, p.vacation_start_date, p.vacation_end_date, p.vacation_days_taken
+    FROM planned_vacations p JOIN employees e ON e.employee_id = p.employee_id
+    WHERE p.vacation_end_date >= :start_date AND p.vacation_start_date <= :end_date
+"""
+
+class LeaveIntervalIndex:
+    """Interval index over the bookings' day ordinals. The days are split into aligned power-of-two blocks, and a booking
+    lives in the smallest block that holds all of it, which is found from the highest bit where its first and last day
+    differ. Adding or removing a booking is a couple of dict operations, and a range question only visits the blocks
+    that touch the range at each level, checking the bookings in blocks the range only partly covers."""
+
+    def __init__(self):
+        self.bookings = {}  # request_id -> (first ordinal, last ordinal, employee_id, days)
+        self.blocks = {}  # (level, block number) -> set of request_ids
+        self.level_counts = [0] * 32  # bookings per level, so empty levels are skipped
+
+    def add(self, request_id, employee_id, start_date, end_date, days):
+        first = date.fromisoformat(start_date).toordinal()
+        last = date.fromisoformat(end_date).toordinal()
+        if last < first:
+            first, last = last, first
+        if request_id in self.bookings:
+            self.remove(request_id)
+        level = (first ^ last).bit_length()
+        self.blocks.setdefault((level, first >> level), set()).add(request_id)
+        self.level_counts[level] += 1
+        self.bookings[request_id] = (first, last, employee_id, days)
+
+    def remove(self, request_id):
+        booking = self.bookings.pop(request_id, None)
+        if booking is None:
+            return
+        first, last = booking[0], booking[1]
+        level = (first ^ last).bit_length()
+        block = self.blocks[(level, first >> level)]
+        block.discard(request_id)
+        if not block:
+            del self.blocks[(level, first >> level)]
+        self.level_counts[level] -= 1
+
+    def overlapping(self, first, last):
+        """Returns (request_id, first ordinal, last ordinal, employee_id, days) for every booking overlapping the
+        ordinals first to last inclusive."""
+        found = []
+        bookings = self.bookings
+        for level, count in enumerate(self.level_counts):
+            if not count:
+                continue
+            for number in range(first >> level, (last >> level) + 1):
+                block = self.blocks.get((level, number))
+                if not block:
+                    continue
+                inside = number << level >= first and ((number + 1) << level) - 1 <= last
+                for request_id in block:
+                    booking = bookings[request_id]
+                    if inside or (booking[0] <= last and booking[1] >= first):
+                        found.append((request_id,) + booking)
+        return found
+
+    def __len__(self):
+        return len(self.bookings)
+
+_team_leave_index = None
+
+def team_leave_index(connection):
+    """Returns the container's interval index of the bookings, building it from the database on first use."""
+    global _team_leave_index
+    if _team_leave_index is None:
+        started = time.perf_counter()
+        index = LeaveIntervalIndex()
+        for row in connection.execute("SELECT request_id, employee_id, vacation_start_date, vacation_end_date, vacation_days_taken FROM planned_vacations"):
+            index.add(*row)
+        logger.info(f"Built the team leave index of {len(index)} bookings in {(time.perf_counter() - started) * 1e3:.1f}ms")
+        _team_leave_index = index
+    return _team_leave_index
+
+def clear_team_leave_index():
+    """Drops the team leave index, the next question rebuilds it."""
+    global _team_leave_index
+    _team_leave_index = None
+
+def _employees_on_leave_indexed(connection, start_date, end_date):
+    """The team availability rows from the interval index, with the names looked up in one query."""
+    found = team_leave_index(connection).overlapping(start_date.toordinal(), end_date.toordinal())
+    if not found:
+        return []
+    employee_ids = json.dumps(sorted({booking[3] for booking in found}))
+    names = dict(connection.execute(
+        "SELECT employee_id, employee_name FROM employees WHERE employee_id IN (SELECT value FROM json_each(?))",
+        (employee_ids,),
+    ))
+    return [
+        (employee_id, names.get(employee_id), str(date.fromordinal(first)), str(date.fromordinal(last)), days)
+        for _, first, last, employee_id, days in found
+        if employee_id in names
+    ]
+
+def employees_on_leave(start_date_str: str, end_date_str: str = None) -> dict[str, any]:
+    """Lists the employees with leave booked on any day from start_date to end_date (inclusive, defaults to start_date)."""
+    connection = create_db_connection(readonly=True)
+    if connection is None:
+        return {"error": "Failed to connect to database"}
+
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else start_date
+        if end_date < start_date:
+            return {"error": "End date must be after start date"}
+        if (end_date - start_date).days + 1 > TEAM_LEAVE_MAX_DAYS:
+            return {"error": f"Date range is too long, ask about {TEAM_LEAVE_MAX_DAYS} days or fewer"}
+
+        if TEAM_LEAVE_INDEX_ENABLED:
+            rows = _employees_on_leave_indexed(connection, start_date, end_date)
+        else:
+            cursor = connection.cursor()
+            cursor.execute(EMPLOYEES_ON_LEAVE_QUERY, {"start_date": str(start_date), "end_date": str(end_date)})
+            rows = cursor.fetchall()
+        rows.sort(key=lambda row: (row[1] or "", row[2], row[0]))
+        return {
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            "employees_on_leave": [
+                {
+                    "employee_id": row[0],
+                    "employee_name": row[1],
+                    "start_date": row[2],
+                    "end_date": row[3],
+                    "days of vacation": row[4],
+                }
+                for row in rows
+            ],
+        }
     except ValueError:
         return {"error": "Invalid date format. Use YYYY-MM-DD"}
     except Exception as e:
-        return {"error": f"Error cancelling leave: {e}"}
+        return {"error": f"Error listing employees on leave: {e}"}
+    finally:
+        release_db_connection(connection)
+
+
+# Leave summary reads, see LEAVE_SUMMARY_TABLES. Each question reads the precomputed rows for its months with a primary
+# key seek, however many bookings are behind them.
+MONTH_PATTERN = re.compile(r"\d{4}-(0[1-9]|1[0-2])")
+
+def rebuild_leave_summary(connection):
+    """Refills the leave summary tables from planned_vacations in one transaction, returns the rows written to each."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in LEAVE_SUMMARY_FILL:
+            connection.execute(statement)
+        counts = {
+            table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("leave_summary", "leave_title_summary")
+        }
+        connection.commit()
+    except sqlite3.Error:
+        connection.rollback()
+        raise
+    return counts
+
+def check_leave_summary(connection):
+    """Compares the leave summary tables with the summary computed from planned_vacations. Returns a list of
+    (table, key, stored (bookings, days), expected (bookings, days)), empty when they agree."""
+    differences = []
+    for table, query, key_columns in (
+        ("leave_summary", LEAVE_SUMMARY_QUERY, "employee_id, month"),
+        ("leave_title_summary", LEAVE_TITLE_SUMMARY_QUERY, "month, job_title"),
+    ):
+        expected = {row[:2]: row[2:] for row in connection.execute(query)}
+        stored = {row[:2]: row[2:] for row in connection.execute(f"SELECT {key_columns}, bookings, days FROM {table}")}
+        for key in sorted(expected.keys() | stored.keys(), key=str):
+            if expected.get(key) != stored.get(key):
+                differences.append((table, key, stored.get(key), expected.get(key)))
+    return differences
+
+def leave_summary(start_month: str, end_month: str = None, employee_number: int = None) -> dict[str, any]:
+    """Returns the leave booked per month from start_month to end_month (YYYY-MM, inclusive, defaults to start_month),
+    per job title, or for one employee if employee_number is given."""
+    end_month = end_month or start_month
+    if not MONTH_PATTERN.fullmatch(start_month or "") or not MONTH_PATTERN.fullmatch(end_month):
+        return {"error": "Invalid month format. Use YYYY-MM"}
+    if end_month < start_month:
+        return {"error": "End month must be after start month"}
+
+    connection = create_db_connection(readonly=True)
+    if connection is None:
+        return {"error": "Failed to connect to database"}
+
+    try:
+        cursor = connection.cursor()
+        if employee_number:
+            cursor.execute(
+                "SELECT month, bookings, days FROM leave_summary WHERE employee_id = ? AND month BETWEEN ? AND ? ORDER BY month",
+                (employee_number, start_month, end_month),
+            )
+            rows = [{"month": row[0], "bookings": row[1], "days": row[2]} for row in cursor]
+            return {"employee_number": employee_number, "start_month": start_month, "end_month": end_month, "leave_by_month": rows}
+        cursor.execute(
+            "SELECT month, job_title, bookings, days FROM leave_title_summary WHERE month BETWEEN ? AND ? ORDER BY month, job_title",
+            (start_month, end_month),
+        )
+        rows = [{"month": row[0], "job_title": row[1] or None, "bookings": row[2], "days": row[3]} for row in cursor]
+        return {"start_month": start_month, "end_month": end_month, "leave_by_month": rows}
+    except Exception as e:
+        return {"error": f"Error reading the leave summary: {e}"}
     finally:
-        connection.close()
+        release_db_connection(connection)
+
+
+# AIRS API endpoint, AIRS_BASE_URL can point it at a local stand-in server for testing
+AIRS_BASE_URL = os.environ.get('AIRS_BASE_URL', "https://service.api.aisecurity.paloaltonetworks.com")
+AIRS_SYNC_SCAN_PATH = "/v1/scan/sync/request"
+# Connection pool sizing for the AIRS session, see requests.adapters.HTTPAdapter
+AIRS_POOL_CONNECTIONS = int(os.environ.get('AIRS_POOL_CONNECTIONS', '1'))
+AIRS_POOL_MAXSIZE = int(os.environ.get('AIRS_POOL_MAXSIZE', '4'))
+
+# Timeouts for AIRS calls in seconds, they are capped by the time left in the invocation minus a reserve kept for
+# building and returning the response
+AIRS_CONNECT_TIMEOUT = float(os.environ.get('AIRS_CONNECT_TIMEOUT', '3.05'))
+AIRS_READ_TIMEOUT = float(os.environ.get('AIRS_READ_TIMEOUT', '10'))
+AIRS_DEADLINE_RESERVE = float(os.environ.get('AIRS_DEADLINE_RESERVE', '0.5'))
+AIRS_MIN_TIMEOUT = 0.05  # Not worth starting a call with less than this left
+# What to return when AIRS cannot give a verdict in time, 'closed' blocks the content and 'open' lets it through
+AIRS_FAIL_MODE = os.environ.get('AIRS_FAIL_MODE', 'closed')
+
+# Session kept for the life of a warm container so the TCP/TLS connection to AIRS is reused between invocations
+_airs_session = None
+
+def get_airs_session():
+    """Returns the warm container's AIRS session, creating it with a keep-alive connection pool on first use."""
+    global _airs_session
+    if _airs_session is None:
+        load_requests()
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=AIRS_POOL_CONNECTIONS, pool_maxsize=AIRS_POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _airs_session = session
+    return _airs_session
+
+def close_airs_session():
+    """Closes the AIRS session and its pooled connections, the next call will create a new one."""
+    global _airs_session
+    if _airs_session is not None:
+        _airs_session.close()
+    _airs_session = None
+
+# AIRS verdict cache. Verdicts are keyed on a hash of (reqtype, profile name, normalized content) and expire after a TTL,
+# allow and block verdicts have separate TTLs so a policy change takes effect within a bounded window.
+AIRS_CACHE_MAX_ENTRIES = int(os.environ.get('AIRS_CACHE_MAX_ENTRIES', '1024'))
+AIRS_CACHE_ALLOW_TTL = float(os.environ.get('AIRS_CACHE_ALLOW_TTL', '300'))
+AIRS_CACHE_BLOCK_TTL = float(os.environ.get('AIRS_CACHE_BLOCK_TTL', '60'))
+# Optional on-disk tier (a SQLite file, e.g. /tmp/airs_verdict_cache.db), disabled when empty
+AIRS_CACHE_DB_PATH = os.environ.get('AIRS_CACHE_DB_PATH', "")
+
+_airs_verdict_cache = OrderedDict()  # key -> (expires_at, verdict), least recently used first
+_airs_cache_disk = None
+_airs_cache_lock = threading.Lock()  # Scans can run on several threads, see airs_scan_many()
+airs_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+def airs_profile_name(reqtype):
+    """Returns the AIRS profile name configured for the request type."""
+    return os.environ['AIRS_PROMPT_PROFILE'] if reqtype == 'prompt' else os.environ['AIRS_RESPONSE_PROFILE']
+
+def airs_cache_key(reqtype, profile_name, content):
+    """Returns the cache key for a scan, whitespace is normalized so reformatted content still hits."""
+    normalized = " ".join(content.split())
+    return hashlib.sha256(f"{reqtype}\0{profile_name}\0{normalized}".encode("utf-8")).hexdigest()
 
+def _airs_cache_disk_connection():
+    """Returns the connection to the on-disk cache tier, or None if it is disabled or unavailable."""
+    global _airs_cache_disk
+    if not AIRS_CACHE_DB_PATH:
+        return None
+    if _airs_cache_disk is None:
+        try:
+            connection = sqlite3.connect(AIRS_CACHE_DB_PATH, check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS airs_verdicts (cache_key TEXT PRIMARY KEY, expires_at REAL, verdict TEXT)")
+            connection.execute("DELETE FROM airs_verdicts WHERE expires_at < ?", (time.time(),))
+            connection.commit()
+            _airs_cache_disk = connection
+        except sqlite3.Error as e:
+            logger.warning(f"AIRS verdict cache on disk is unavailable: {e}")
+            return None
+    return _airs_cache_disk
+
+def airs_cache_get(key):
+    """Returns the cached verdict for the key, or None if it is missing or expired."""
+    with _airs_cache_lock:
+        now = time.time()
+        entry = _airs_verdict_cache.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _airs_verdict_cache.move_to_end(key)
+                airs_cache_stats["hits"] += 1
+                return entry[1]
+            del _airs_verdict_cache[key]
+        disk = _airs_cache_disk_connection()
+        if disk is not None:
+            try:
+                row = disk.execute("SELECT expires_at, verdict FROM airs_verdicts WHERE cache_key = ? AND expires_at > ?", (key, now)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Error reading the AIRS verdict cache: {e}")
+                row = None
+            if row:
+                verdict = json.loads(row[1])
+                _airs_cache_put_memory(key, row[0], verdict)
+                airs_cache_stats["disk_hits"] += 1
+                return verdict
+        airs_cache_stats["misses"] += 1
+        return None
+
+def _airs_cache_put_memory(key, expires_at, verdict):
+    _airs_verdict_cache[key] = (expires_at, verdict)
+    _airs_verdict_cache.move_to_end(key)
+    while len(_airs_verdict_cache) > AIRS_CACHE_MAX_ENTRIES:
+        _airs_verdict_cache.popitem(last=False)
+
+def airs_cache_put(key, verdict):
+    """Caches a verdict using the TTL for its action."""
+    with _airs_cache_lock:
+        ttl = AIRS_CACHE_BLOCK_TTL if verdict["action"] == "block" else AIRS_CACHE_ALLOW_TTL
+        if ttl <= 0 or AIRS_CACHE_MAX_ENTRIES <= 0:
+            return
+        expires_at = time.time() + ttl
+        _airs_cache_put_memory(key, expires_at, verdict)
+        disk = _airs_cache_disk_connection()
+        if disk is not None:
+            try:
+                disk.execute("INSERT OR REPLACE INTO airs_verdicts (cache_key, expires_at, verdict) VALUES (?, ?, ?)", (key, expires_at, json.dumps(verdict)))
+                disk.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Error writing the AIRS verdict cache: {e}")
+
+def airs_cache_clear():
+    """Empties both tiers of the AIRS verdict cache and resets the counters."""
+    with _airs_cache_lock:
+        _airs_verdict_cache.clear()
+        disk = _airs_cache_disk_connection()
+        if disk is not None:
+            disk.execute("DELETE FROM airs_verdicts")
+            disk.commit()
+        for name in airs_cache_stats:
+            airs_cache_stats[name] = 0
+
+def invocation_deadline(context):
+    """Returns the time.monotonic() deadline for this invocation from the Lambda context, or None when run without one."""
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000.0
+
+def airs_timeout(deadline):
+    """Returns the urllib3 Timeout for an AIRS call within the deadline, or None if there is no time left for one."""
+    load_requests()
+    from urllib3.util import Timeout
+    connect_timeout = AIRS_CONNECT_TIMEOUT
+    read_timeout = AIRS_READ_TIMEOUT
+    total = None
+    if deadline is not None:
+        total = deadline - time.monotonic() - AIRS_DEADLINE_RESERVE
+        if total < AIRS_MIN_TIMEOUT:
+            return None
+        connect_timeout = min(connect_timeout, total)
+        read_timeout = min(read_timeout, total)
+    return Timeout(connect=connect_timeout, read=read_timeout, total=total)
+
+# The verdict used when AIRS could not give one, depending on AIRS_FAIL_MODE
+def airs_fallback_verdict(prompt, reason, fail_mode=None):
+    fail_mode = fail_mode or AIRS_FAIL_MODE
+    logger.warning(f"AIRS verdict unavailable ({reason}), failing {fail_mode}")
+    if fail_mode == 'open':
+        return {"action": "allow", "detected": {}, "message": prompt}
+    return {"action": "block", "detected": {}, "message": f"The content could not be checked by the security service ({reason}) and has been blocked."}
+
+# Circuit breaker in front of the AIRS calls. It opens when enough of the calls in the rolling window fail or are slow,
+# rejects calls while open, then lets a single probe through (half-open) to decide whether to close again.
+AIRS_BREAKER_WINDOW = float(os.environ.get('AIRS_BREAKER_WINDOW', '60'))
+AIRS_BREAKER_MIN_CALLS = int(os.environ.get('AIRS_BREAKER_MIN_CALLS', '5'))
+AIRS_BREAKER_ERROR_RATE = float(os.environ.get('AIRS_BREAKER_ERROR_RATE', '0.5'))
+AIRS_BREAKER_SLOW_CALL = float(os.environ.get('AIRS_BREAKER_SLOW_CALL', '5'))  # Calls slower than this count as failures
+AIRS_BREAKER_OPEN_SECONDS = float(os.environ.get('AIRS_BREAKER_OPEN_SECONDS', '30'))
+AIRS_BREAKER_FAIL_MODE = os.environ.get('AIRS_BREAKER_FAIL_MODE', AIRS_FAIL_MODE)
+# Optional SQLite file to share the open state between containers (e.g. on a shared file system), disabled when empty
+AIRS_BREAKER_DB_PATH = os.environ.get('AIRS_BREAKER_DB_PATH', "")
+
+_airs_breaker = {"state": "closed", "opened_at": 0.0, "probe_in_flight": False, "calls": deque()}
+_airs_breaker_lock = threading.Lock()
+_airs_breaker_shared = None
+airs_breaker_stats = {"state": "closed", "transitions": 0, "rejected": 0}
+
+def _airs_breaker_shared_connection():
+    """Returns the connection to the shared breaker state, or None if it is disabled or unavailable."""
+    global _airs_breaker_shared
+    if not AIRS_BREAKER_DB_PATH:
+        return None
+    if _airs_breaker_shared is None:
+        try:
+            connection = sqlite3.connect(AIRS_BREAKER_DB_PATH, timeout=1, check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS airs_breaker (name TEXT PRIMARY KEY, state TEXT, opened_at REAL)")
+            connection.commit()
+            _airs_breaker_shared = connection
+        except sqlite3.Error as e:
+            logger.warning(f"Shared AIRS breaker state is unavailable: {e}")
+            return None
+    return _airs_breaker_shared
+
+def _airs_breaker_transition(state, reason):
+    """Moves the breaker to a new state, recording the transition in the metrics and the shared state."""
+    previous = _airs_breaker["state"]
+    if previous == state:
+        return
+    _airs_breaker["state"] = state
+    _airs_breaker["probe_in_flight"] = False
+    _airs_breaker["calls"].clear()
+    if state == "open":
+        _airs_breaker["opened_at"] = time.time()
+    airs_breaker_stats["state"] = state
+    airs_breaker_stats["transitions"] += 1
+    transition = f"{previous}_to_{state}"
+    airs_breaker_stats[transition] = airs_breaker_stats.get(transition, 0) + 1
+    logger.info(json.dumps({"metric": "airs_breaker_transition", "from": previous, "to": state, "reason": reason, "stats": airs_breaker_stats}))
+    shared = _airs_breaker_shared_connection()
+    if shared is not None:
+        try:
+            shared.execute("INSERT OR REPLACE INTO airs_breaker (name, state, opened_at) VALUES ('airs', ?, ?)", (state, _airs_breaker["opened_at"]))
+            shared.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing the shared AIRS breaker state: {e}")
+
+def airs_breaker_allow():
+    """Returns True if an AIRS call may go ahead, False if the breaker is rejecting calls."""
+    with _airs_breaker_lock:
+        now = time.time()
+        shared = _airs_breaker_shared_connection()
+        if shared is not None and _airs_breaker["state"] == "closed":
+            try:
+                row = shared.execute("SELECT state, opened_at FROM airs_breaker WHERE name = 'airs'").fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Error reading the shared AIRS breaker state: {e}")
+                row = None
+            # Another container saw AIRS failing recently, stay away until its open period is over
+            if row and row[0] == "open" and now - row[1] < AIRS_BREAKER_OPEN_SECONDS:
+                _airs_breaker["state"] = "open"
+                _airs_breaker["opened_at"] = row[1]
+                airs_breaker_stats["state"] = "open"
+        if _airs_breaker["state"] == "open":
+            if now - _airs_breaker["opened_at"] < AIRS_BREAKER_OPEN_SECONDS:
+                airs_breaker_stats["rejected"] += 1
+                return False
+            _airs_breaker_transition("half_open", "open period elapsed")
+        if _airs_breaker["state"] == "half_open":
+            if _airs_breaker["probe_in_flight"]:
+                airs_breaker_stats["rejected"] += 1
+                return False
+            _airs_breaker["probe_in_flight"] = True
+        return True
+
+def airs_breaker_record(success, latency):
+    """Records the outcome of an AIRS call, a call slower than AIRS_BREAKER_SLOW_CALL counts as a failure."""
+    failed = not success or latency > AIRS_BREAKER_SLOW_CALL
+    with _airs_breaker_lock:
+        if _airs_breaker["state"] == "half_open":
+            if failed:
+                _airs_breaker_transition("open", "probe call failed")
+            else:
+                _airs_breaker_transition("closed", "probe call succeeded")
+            return
+        if _airs_breaker["state"] != "closed":
+            return
+        now = time.time()
+        calls = _airs_breaker["calls"]
+        calls.append((now, failed))
+        while calls and now - calls[0][0] > AIRS_BREAKER_WINDOW:
+            calls.popleft()
+        failures = sum(1 for _, call_failed in calls if call_failed)
+        if len(calls) >= AIRS_BREAKER_MIN_CALLS and failures / len(calls) >= AIRS_BREAKER_ERROR_RATE:
+            _airs_breaker_transition("open", f"{failures} of the last {len(calls)} calls failed or were slow")
+
+def airs_breaker_reset():
+    """Closes the breaker and clears its history and metrics."""
+    with _airs_breaker_lock:
+        _airs_breaker.update({"state": "closed", "opened_at": 0.0, "probe_in_flight": False})
+        _airs_breaker["calls"].clear()
+        airs_breaker_stats.clear()
+        airs_breaker_stats.update({"state": "closed", "transitions": 0, "rejected": 0})
 
-# Call AIRS Must define the reqest type to be prompt or response, the body an app name app user and transcaction id. It will return True if it allowed, else will give a string with the reason.
-def airs_make_request(reqtype, prompt, app_name, app_user, tr_id):
+# Local pre-filter run before AIRS. It blocks content with URLs on known-bad domains or matching deny patterns, and
+# allows short content that fully matches an allow pattern (with only allowlisted URLs). Anything else goes to AIRS.
+# Patterns are JSON, deny patterns map each regex to the detection flag it raises, allow patterns are a list of regexes.
+AIRS_PREFILTER_ENABLED = os.environ.get('AIRS_PREFILTER', 'on') != 'off'
+AIRS_PREFILTER_DENY_DOMAINS = os.environ.get('AIRS_PREFILTER_DENY_DOMAINS', "")  # Set from the airs_prefilter_deny_domains variable
+AIRS_PREFILTER_ALLOW_DOMAINS = os.environ.get('AIRS_PREFILTER_ALLOW_DOMAINS', "")
+AIRS_PREFILTER_DENY_PATTERNS = os.environ.get('AIRS_PREFILTER_DENY_PATTERNS', "{}")
+AIRS_PREFILTER_ALLOW_PATTERNS = os.environ.get('AIRS_PREFILTER_ALLOW_PATTERNS', "[]")
+AIRS_PREFILTER_ALLOW_MAX_LENGTH = int(os.environ.get('AIRS_PREFILTER_ALLOW_MAX_LENGTH', '200'))
+
+URL_HOST_PATTERN = re.compile(r"\b(?:https?://|www\.)([a-z0-9.-]+)", re.IGNORECASE)
+airs_prefilter_stats = {"allowed": 0, "blocked": 0, "deferred": 0}
+
+def _domain_set(domains):
+    return {domain.strip().lower().lstrip(".") for domain in domains.split(",") if domain.strip()}
+
+def airs_prefilter_compile(deny_domains, allow_domains, deny_patterns, allow_patterns):
+    """Compiles the pre-filter rules. The deny patterns are combined into one regex with a named group per pattern
+    so a single pass finds every match, the allow patterns into one anchored alternation."""
+    deny_flags = {}
+    deny_parts = []
+    for position, (pattern, flag) in enumerate(json.loads(deny_patterns).items()):
+        deny_flags[f"p{position}"] = flag
+        deny_parts.append(f"(?P<p{position}>{pattern})")
+    allow_parts = [f"(?:{pattern})" for pattern in json.loads(allow_patterns)]
+    return {
+        "deny_domains": _domain_set(deny_domains),
+        "allow_domains": _domain_set(allow_domains),
+        "deny_regex": re.compile("|".join(deny_parts), re.IGNORECASE) if deny_parts else None,
+        "deny_flags": deny_flags,
+        "allow_regex": re.compile("(?:" + "|".join(allow_parts) + r")\Z", re.IGNORECASE) if allow_parts else None,
+    }
+
+def _domain_listed(host, domains):
+    """True if the host or any parent domain of it is in the set."""
+    labels = host.lower().rstrip(".").split(".")
+    return any(".".join(labels[i:]) in domains for i in range(len(labels)))
+
+def airs_prefilter(content, rules=None):
+    """Returns a verdict when the local rules are confident about the content, or None to defer to AIRS."""
+    rules = rules or _airs_prefilter_rules
+    detected = {}
+    hosts = URL_HOST_PATTERN.findall(content)
+    if any(_domain_listed(host, rules["deny_domains"]) for host in hosts):
+        detected["url_cats"] = True
+    if rules["deny_regex"] is not None:
+        for match in rules["deny_regex"].finditer(content):
+            detected[rules["deny_flags"][match.lastgroup]] = True
+    if detected:
+        airs_prefilter_stats["blocked"] += 1
+        return {"action": "block", "detected": detected}
+    if (rules["allow_regex"] is not None
+            and len(content) <= AIRS_PREFILTER_ALLOW_MAX_LENGTH
+            and all(_domain_listed(host, rules["allow_domains"]) for host in hosts)
+            and rules["allow_regex"].match(content.strip())):
+        airs_prefilter_stats["allowed"] += 1
+        return {"action": "allow", "detected": {}}
+    airs_prefilter_stats["deferred"] += 1
+    return None
+
+_airs_prefilter_rules = airs_prefilter_compile(AIRS_PREFILTER_DENY_DOMAINS, AIRS_PREFILTER_ALLOW_DOMAINS, AIRS_PREFILTER_DENY_PATTERNS, AIRS_PREFILTER_ALLOW_PATTERNS)
+
+# Turn a verdict into the text returned to the agent, the reasons if it was blocked otherwise the content itself
+def airs_verdict_message(verdict, prompt):
+    if verdict["action"] == "block":
+        return airs_construct_response(verdict["detected"])
+    return prompt
+
+# Scan some content with AIRS. Returns the verdict as a dict with the action ('allow', 'block' or 'error'), the
+# detection flags and the message for the agent.
+def airs_scan(reqtype, prompt, app_name, app_user, tr_id, deadline=None):
     try: 
-        req = airs_construct_request(reqtype, prompt.replace("\n", " "), app_name, app_user, tr_id)
+        if AIRS_PREFILTER_ENABLED:
+            verdict = airs_prefilter(prompt)
+            if verdict is not None:
+                logger.info(f"AIRS pre-filter {verdict['action']}, calls saved {airs_prefilter_stats['allowed'] + airs_prefilter_stats['blocked']}: {airs_prefilter_stats}")
+                return dict(verdict, message=airs_verdict_message(verdict, prompt))
+
+        cache_key = airs_cache_key(reqtype, airs_profile_name(reqtype), prompt)
+        verdict = airs_cache_get(cache_key)
+        logger.info(f"AIRS verdict cache {'hit' if verdict is not None else 'miss'}: {airs_cache_stats}")
+        if verdict is not None:
+            return dict(verdict, message=airs_verdict_message(verdict, prompt))
+
+        req = airs_construct_request(reqtype, prompt, app_name, app_user, tr_id)
         # URL of the API endpoint
-        url = "https://service.api.aisecurity.paloaltonetworks.com/v1/scan/sync/request"
+        url = AIRS_BASE_URL + AIRS_SYNC_SCAN_PATH
         header = {
             "x-pan-token":os.environ['AIRS_API'], 
             "Content-Type": "application/json"
             }
-        # Making the API call
-        resp = requests.post(url, headers=header, json=req)
+        timeout = airs_timeout(deadline)
+        if timeout is None:
+            return airs_fallback_verdict(prompt, "no time left in the invocation")
+        if not airs_breaker_allow():
+            return airs_fallback_verdict(prompt, "the service is unavailable", AIRS_BREAKER_FAIL_MODE)
+        # Making the API call. The outcome is recorded whatever happens, a half-open breaker's probe must always
+        # be resolved or the breaker would reject every call from then on.
+        started = time.monotonic()
+        healthy = False
+        try:
+            resp = get_airs_session().post(url, headers=header, json=req, timeout=timeout)
+            # Server errors and throttling mean AIRS is degraded, other statuses are answers from a healthy service
+            healthy = resp.status_code < 500 and resp.status_code != 429
+        except requests.exceptions.Timeout as e:
+            logger.warning(f"AIRS call timed out: {e}")
+            return airs_fallback_verdict(prompt, "timed out")
+        finally:
+            airs_breaker_record(healthy, time.monotonic() - started)
         json_resp = resp.json()
         #json_resp = json.loads(resp)
         # Checking the response
         if resp.status_code == 200:
             # Successful API call
             print(f"API call successful. Response: {json_resp}")
-            if json_resp['action'] == "block":
-                if reqtype == 'prompt':
-                    return airs_construct_response(json_resp['prompt_detected'])
-                else:
-                    return airs_construct_response(json_resp['response_detected'])
-            else:
-                return prompt
+            verdict = {
+                "action": json_resp['action'],
+                "detected": json_resp['prompt_detected'] if reqtype == 'prompt' else json_resp['response_detected'],
+            }
+            airs_cache_put(cache_key, verdict)
+            return dict(verdict, message=airs_verdict_message(verdict, prompt))
         else:
             # Failed API call
             print(f"Failed to make API call. Status code: {resp.status_code}  request: {req}")
             print(resp.text)
-            return f"Failed to make API call. Status code: {resp.status_code}  request: {req}"
+            return {"action": "error", "detected": {}, "message": f"Failed to make API call. Status code: {resp.status_code}  request: {req}"}
     except Exception as e:
         print("Error: ", e)
-        return f"Error: {e}"
+        return {"action": "error", "detected": {}, "message": f"Error: {e}"}
 
-# Construct the URL Request Json body
-def airs_construct_request(reqtype, input_value, app_name, app_user, tr_id):
-    # Set the right profile name
-    profile_name = os.environ['AIRS_PROMPT_PROFILE'] if reqtype == 'prompt' else  os.environ['AIRS_RESPONSE_PROFILE']
-    # JSON data for the API call
-    try:
-        req = '''
+# Call AIRS Must define the reqest type to be prompt or response, the body an app name app user and transcaction id. It will return the prompt if it allowed, else will give a string with the reason.
+def airs_make_request(reqtype, prompt, app_name, app_user, tr_id, deadline=None):
+    return airs_scan_chunked(reqtype, prompt, app_name, app_user, tr_id, deadline)["message"]
+
+# Worker threads for running independent scans at once, they share the pooled AIRS session so keep it no larger than the pool
+AIRS_SCAN_WORKERS = int(os.environ.get('AIRS_SCAN_WORKERS', str(AIRS_POOL_MAXSIZE)))
+_airs_executor = None
+
+def get_airs_executor():
+    """Returns the warm container's thread pool for AIRS scans, creating it on first use."""
+    global _airs_executor
+    if _airs_executor is None:
+        _airs_executor = ThreadPoolExecutor(max_workers=AIRS_SCAN_WORKERS, thread_name_prefix="airs-scan")
+    return _airs_executor
+
+def airs_merge_verdicts(verdicts):
+    """Combines several verdicts into one, blocked if any of them was, with the detection flags and reasons of them all."""
+    detected = {}
+    for verdict in verdicts:
+        for key, flagged in verdict.get("detected", {}).items():
+            if flagged:
+                detected[key] = True
+    actions = [verdict["action"] for verdict in verdicts]
+    if "block" in actions:
+        action = "block"
+    elif "error" in actions:
+        action = "error"
+    else:
+        return {"action": "allow", "detected": detected, "message": ""}
+    reasons = [airs_construct_response(detected)] if detected else []
+    # Fallbacks and errors have no detection flags, their message is the reason
+    reasons += [verdict["message"] for verdict in verdicts if verdict["action"] != "allow" and not any(verdict.get("detected", {}).values())]
+    return {"action": action, "detected": detected, "message": " ".join(dict.fromkeys(reasons))}
+
+def airs_scan_many(items, deadline=None):
+    """Runs independent AIRS scans concurrently. Each item is a dict with reqtype and input_val, and optionally
+    app_name, app_user and tr_id. Returns the verdicts in the same order as the items, plus the merged verdict."""
+    futures = [
+        get_airs_executor().submit(
+            airs_scan,
+            item["reqtype"],
+            item["input_val"],
+            item.get("app_name", "test app"),
+            item.get("app_user", "test user"),
+            item.get("tr_id", "test id"),
+            deadline,
+        )
+        for item in items
+    ]
+    verdicts = [future.result() for future in futures]
+    return {"verdicts": verdicts, "merged": airs_merge_verdicts(verdicts)}
+
+# Content longer than AIRS_CHUNK_SIZE characters is split on line or sentence boundaries and the chunks are scanned
+# concurrently, each chunk repeats the last AIRS_CHUNK_OVERLAP characters of the previous one so nothing is lost at a cut
+AIRS_CHUNK_SIZE = int(os.environ.get('AIRS_CHUNK_SIZE', '16000'))
+AIRS_CHUNK_OVERLAP = int(os.environ.get('AIRS_CHUNK_OVERLAP', '200'))
+CHUNK_BOUNDARY_PATTERN = re.compile(r"\n|[.!?]+\s+")
+
+def airs_split_content(text, max_chars=None, overlap=None):
+    """Splits text into chunks of at most max_chars, cutting after a line or sentence end where possible."""
+    max_chars = max_chars or AIRS_CHUNK_SIZE
+    overlap = min(AIRS_CHUNK_OVERLAP if overlap is None else overlap, max_chars // 2)
+    if len(text) <= max_chars:
+        return [text]
+    # Units between boundaries, hard split when a unit could never fit in a chunk next to the overlap
+    limit = max_chars - overlap
+    units = []
+    start = 0
+    for match in CHUNK_BOUNDARY_PATTERN.finditer(text):
+        units.append(text[start:match.end()])
+        start = match.end()
+    units.append(text[start:])
+    units = [unit[i:i + limit] for unit in units for i in range(0, len(unit), limit)]
+    chunks = []
+    current = ""
+    has_new = False
+    for unit in units:
+        if has_new and len(current) + len(unit) > max_chars:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else ""
+            has_new = False
+        current += unit
+        has_new = True
+    if has_new:
+        chunks.append(current)
+    return chunks
+
+def airs_scan_chunked(reqtype, prompt, app_name, app_user, tr_id, deadline=None):
+    """Scans content of any length, chunks are scanned concurrently and their detection flags merged into one verdict.
+    As soon as a chunk is blocked the chunks that have not started are cancelled."""
+    chunks = airs_split_content(prompt)
+    if len(chunks) == 1:
+        return airs_scan(reqtype, prompt, app_name, app_user, tr_id, deadline)
+    logger.info(f"Scanning {len(prompt)} characters as {len(chunks)} chunks")
+    futures = [get_airs_executor().submit(airs_scan, reqtype, chunk, app_name, app_user, tr_id, deadline) for chunk in chunks]
+    verdicts = []
+    for future in as_completed(futures):
+        verdict = future.result()
+        verdicts.append(verdict)
+        if verdict["action"] == "block":
+            cancelled = sum(1 for other in futures if other.cancel())
+            logger.info(f"Chunk blocked, cancelled {cancelled} of {len(chunks)} chunk scans")
+            break
+    merged = airs_merge_verdicts(verdicts)
+    if merged["action"] == "allow":
+        merged["message"] = prompt
+    return merged
+
+# Asynchronous batch scanning, for bulk work such as re-scanning every employee homepage. Many contents are submitted
+# in one request and the results are polled for with exponential backoff.
+AIRS_ASYNC_SCAN_PATH = "/v1/scan/async/request"
+AIRS_SCAN_RESULTS_PATH = "/v1/scan/results"
+AIRS_ASYNC_BATCH_SIZE = int(os.environ.get('AIRS_ASYNC_BATCH_SIZE', '100'))  # Contents per async request
+AIRS_RESULTS_MAX_SCAN_IDS = 5  # Scan ids per results request
+AIRS_POLL_INTERVAL = float(os.environ.get('AIRS_POLL_INTERVAL', '0.5'))
+AIRS_POLL_MAX_INTERVAL = float(os.environ.get('AIRS_POLL_MAX_INTERVAL', '5'))
+# Longest the results are polled for, results still missing then get an error verdict. Bounds callers without a
+# deadline (such as utils/rescan_homepages.py) when a result never completes or its scan id is never reported.
+AIRS_POLL_MAX_WAIT = float(os.environ.get('AIRS_POLL_MAX_WAIT', '600'))
+
+def _airs_headers():
+    return {
+        "x-pan-token": os.environ['AIRS_API'],
+        "Content-Type": "application/json"
+    }
+
+def airs_async_submit(batch, deadline=None):
+    """Submits a batch of (req_id, item) pairs to the async scan endpoint, returns the scan id."""
+    body = [
         {
-            "metadata": {
-            "ai_model": "Test AI model",
-            "app_name": "%s",
-            "app_user": "%s"
-            },
-            "contents": [
-            {
-            "%s": "%s"
-            }
-            ],
-            "tr_id": "%s",
-            "ai_profile": {
-            "profile_name": "%s"
-            }
+            "req_id": req_id,
+            "scan_req": airs_construct_request(
+                item["reqtype"],
+                item["input_val"],
+                item.get("app_name", "test app"),
+                item.get("app_user", "test user"),
+                item.get("tr_id", "test id"),
+            ),
         }
-        ''' %(app_name, app_user, reqtype, input_value, tr_id, profile_name)
-        json_data = json.loads(req)
-        return json_data
-    except Exception as e:
-        print("Error ", e)
-        return False
-    
+        for req_id, item in batch
+    ]
+    timeout = airs_timeout(deadline)
+    if timeout is None:
+        raise Exception("No time left in the invocation to submit the scan")
+    resp = get_airs_session().post(AIRS_BASE_URL + AIRS_ASYNC_SCAN_PATH, headers=_airs_headers(), json=body, timeout=timeout)
+    if resp.status_code != 200:
+        raise Exception(f"Failed to submit async scan. Status code: {resp.status_code} {resp.text}")
+    return resp.json()["scan_id"]
+
+def airs_async_results(scan_ids, deadline=None):
+    """Fetches the results for up to AIRS_RESULTS_MAX_SCAN_IDS scan ids, returns the list of per request results."""
+    timeout = airs_timeout(deadline)
+    if timeout is None:
+        raise Exception("No time left in the invocation to fetch the scan results")
+    resp = get_airs_session().get(
+        AIRS_BASE_URL + AIRS_SCAN_RESULTS_PATH,
+        headers=_airs_headers(),
+        params={"scan_ids": ",".join(scan_ids)},
+        timeout=timeout,
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Failed to fetch scan results. Status code: {resp.status_code} {resp.text}")
+    return resp.json()
+
+def airs_scan_async_iter(items, deadline=None):
+    """Scans the items (dicts as for airs_scan_many) through the async endpoint and yields (index, verdict) pairs
+    as the verdicts complete, cached verdicts first. A result that ends in any status other than complete, or is still
+    missing after AIRS_POLL_MAX_WAIT seconds, gets an error verdict. Raises if the deadline passes before every
+    result is in."""
+    pending = {}  # (scan_id, req_id) -> (cache key, [(index, item), ...])
+    to_submit = {}  # cache key -> [(index, item), ...], identical content is only scanned once
+    for index, item in enumerate(items):
+        verdict = airs_prefilter(item["input_val"]) if AIRS_PREFILTER_ENABLED else None
+        if verdict is not None:
+            yield index, dict(verdict, message=airs_verdict_message(verdict, item["input_val"]))
+            continue
+        cache_key = airs_cache_key(item["reqtype"], airs_profile_name(item["reqtype"]), item["input_val"])
+        verdict = airs_cache_get(cache_key) if cache_key not in to_submit else None
+        if verdict is not None:
+            yield index, dict(verdict, message=airs_verdict_message(verdict, item["input_val"]))
+        else:
+            to_submit.setdefault(cache_key, []).append((index, item))
+
+    to_submit = list(to_submit.items())
+    for start in range(0, len(to_submit), AIRS_ASYNC_BATCH_SIZE):
+        batch = to_submit[start:start + AIRS_ASYNC_BATCH_SIZE]
+        # req_id is the position in the batch, it only has to be unique within a scan
+        scan_id = airs_async_submit([(req_id, entries[0][1]) for req_id, (_, entries) in enumerate(batch)], deadline)
+        for req_id, entry in enumerate(batch):
+            pending[(scan_id, req_id)] = entry
+
+    interval = AIRS_POLL_INTERVAL
+    give_up_at = time.monotonic() + AIRS_POLL_MAX_WAIT
+    while pending:
+        scan_ids = list(dict.fromkeys(scan_id for scan_id, _ in pending))
+        completed = 0
+        for start in range(0, len(scan_ids), AIRS_RESULTS_MAX_SCAN_IDS):
+            for result in airs_async_results(scan_ids[start:start + AIRS_RESULTS_MAX_SCAN_IDS], deadline):
+                key = (result.get("scan_id"), result.get("req_id"))
+                status = result.get("status")
+                if status == "pending" or key not in pending:
+                    continue
+                cache_key, entries = pending.pop(key)
+                completed += 1
+                if status != "complete":
+                    # Failed scans are not cached, the next scan of the content tries again
+                    for index, item in entries:
+                        yield index, {"action": "error", "detected": {}, "message": f"AIRS async scan {key[0]} ended with status {status}"}
+                    continue
+                json_resp = result["result"]
+                verdict = {
+                    "action": json_resp['action'],
+                    "detected": json_resp['prompt_detected'] if entries[0][1]["reqtype"] == 'prompt' else json_resp['response_detected'],
+                }
+                airs_cache_put(cache_key, verdict)
+                for index, item in entries:
+                    yield index, dict(verdict, message=airs_verdict_message(verdict, item["input_val"]))
+        if not pending:
+            break
+        # Back off while nothing is finishing, poll quickly again once results start arriving
+        if completed:
+            interval = AIRS_POLL_INTERVAL
+        if deadline is not None and time.monotonic() + interval + AIRS_DEADLINE_RESERVE > deadline:
+            raise Exception(f"No time left in the invocation, {len(pending)} scan results still pending")
+        if time.monotonic() + interval > give_up_at:
+            logger.warning(f"Gave up on {len(pending)} AIRS async scan results after {AIRS_POLL_MAX_WAIT:.0f}s")
+            for (scan_id, _), (_, entries) in pending.items():
+                for index, item in entries:
+                    yield index, {"action": "error", "detected": {}, "message": f"AIRS async scan {scan_id} gave no result within {AIRS_POLL_MAX_WAIT:.0f}s"}
+            return
+        time.sleep(interval)
+        interval = min(interval * 2, AIRS_POLL_MAX_INTERVAL)
+
+def airs_scan_async(items, deadline=None):
+    """Scans the items through the async endpoint, returns the verdicts in the same order as the items."""
+    verdicts = [None] * len(items)
+    for index, verdict in airs_scan_async_iter(items, deadline):
+        verdicts[index] = verdict
+    return verdicts
+
+# The parts of the request body that only depend on the profile and app, built once and shared between requests.
+# They must not be modified.
+@lru_cache(maxsize=64)
+def _airs_request_static(profile_name, app_name, app_user):
+    metadata = {
+        "ai_model": "Test AI model",
+        "app_name": app_name,
+        "app_user": app_user,
+    }
+    ai_profile = {"profile_name": profile_name}
+    return metadata, ai_profile
+
+# Construct the URL Request Json body, as a dict that is serialized once when it is sent
+def airs_construct_request(reqtype, input_value, app_name, app_user, tr_id):
+    metadata, ai_profile = _airs_request_static(airs_profile_name(reqtype), app_name, app_user)
+    return {
+        "metadata": metadata,
+        "contents": [{reqtype: input_value}],
+        "tr_id": tr_id,
+        "ai_profile": ai_profile,
+    }
+
 # Return a more descriptive sentence based on the keys in the josn provided being true.
 def airs_construct_response(response_json):
     response_mapping = {
@@ -326,13 +2001,139 @@ def airs_construct_response(response_json):
 
     return " ".join(response_parts)
 
+# Convert the Bedrock parameter value to the type declared in the function schema
+def _parse_integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not number.is_integer():
+        raise ValueError(f"not a whole number: {value!r}")
+    return int(number)
+
+PARAMETER_TYPES = {
+    "string": str,
+    "integer": _parse_integer,
+}
+
+def parse_parameters(parameters, spec):
+    """Parses the Bedrock parameter list into a dict in a single pass, applying types, defaults and mandatory checks from the spec.
+    A value that does not convert to its type raises ValueError, naming the parameter."""
+    args = {}
+    for param in parameters:
+        name = param.get("name")
+        if name in spec:
+            args[name] = param.get("value")
+    for name, (param_type, required, default) in spec.items():
+        value = args.get(name)
+        if not value:
+            if required:
+                raise Exception(f"Missing mandatory parameter: {name}")
+            args[name] = default
+        else:
+            try:
+                args[name] = PARAMETER_TYPES[param_type](value)
+            except ValueError as e:
+                raise ValueError(f"Invalid {name}: {e}")
+    return args
+
+# Handlers for each Bedrock function, they take the parsed parameters and the invocation deadline and return the response body text
+def handle_get_employee_id(args, deadline):
+    employee_id = get_employee_id(args["employee_name"])
+    return f"employees id for {args['employee_name']}: {employee_id}"
+
+def handle_employee_details(args, deadline):
+    employee_file = employee_details(args["employee_id"])
+    return f"employee details: {employee_file}"
+
+def handle_get_leave_balance(args, deadline):
+    vacation_days = get_leave_balance(args["employee_id"], args["year"])
+    return f"available vacation days for employed_id {args['employee_id']}: {vacation_days}"
+
+def handle_book_leave(args, deadline):
+    return json.dumps(book_leave(args["employee_id"], args["start_date"], args["end_date"]))
+
+def handle_list_leave(args, deadline):
+    return json.dumps(list_leave(args["employee_id"], args["start_date"], args["end_date"], args["status"], args["cursor"]))
+
+def handle_cancel_leave(args, deadline):
+    return json.dumps(cancel_leave(args["employee_id"], args["start_date"]))
+
+def handle_employees_on_leave(args, deadline):
+    return json.dumps(employees_on_leave(args["start_date"], args["end_date"]))
+
+def handle_leave_summary(args, deadline):
+    return json.dumps(leave_summary(args["start_month"], args["end_month"], args["employee_id"]))
+
+def handle_prompt_check(args, deadline):
+    return airs_make_request("prompt", args["input_val"], args["app_name"], args["app_user"], args["tr_id"], deadline)
+
+def handle_response_check(args, deadline):
+    return airs_make_request("response", args["input_val"], args["app_name"], args["app_user"], args["tr_id"], deadline)
+
+# Parameter specs, name -> (type, required, default). These mirror the function schemas in bedrock_agent.tf
+EMPLOYEE_ID_PARAMETERS = {
+    "employee_id": ("integer", True, None),
+}
+AIRS_CHECK_PARAMETERS = {
+    "input_val": ("string", True, None),
+    "app_name": ("string", False, "test app"),
+    "app_user": ("string", False, "test user"),
+    "tr_id": ("string", False, "test id"),
+}
+
+# Bedrock function name -> (handler, parameter spec)
+FUNCTION_REGISTRY = {
+    "get_employee_id": (handle_get_employee_id, {"employee_name": ("string", True, None)}),
+    "employee_details": (handle_employee_details, EMPLOYEE_ID_PARAMETERS),
+    "get_leave_balance": (handle_get_leave_balance, {
+        "employee_id": ("integer", True, None),
+        "year": ("integer", False, None),
+    }),
+    "book_leave": (handle_book_leave, {
+        "employee_id": ("integer", True, None),
+        "start_date": ("string", True, None),
+        "end_date": ("string", True, None),
+    }),
+    "list_leave": (handle_list_leave, {
+        "employee_id": ("integer", True, None),
+        "start_date": ("string", False, None),
+        "end_date": ("string", False, None),
+        "status": ("string", False, None),
+        "cursor": ("string", False, None),
+    }),
+    "cancel_leave": (handle_cancel_leave, {
+        "employee_id": ("integer", True, None),
+        "start_date": ("string", True, None),
+    }),
+    "employees_on_leave": (handle_employees_on_leave, {
+        "start_date": ("string", True, None),
+        "end_date": ("string", False, None),
+    }),
+    "leave_summary": (handle_leave_summary, {
+        "start_month": ("string", True, None),
+        "end_month": ("string", False, None),
+        "employee_id": ("integer", False, None),
+    }),
+    "check_question": (handle_prompt_check, AIRS_CHECK_PARAMETERS),
+    "check_answer": (handle_response_check, AIRS_CHECK_PARAMETERS),
+    "airs_prompt_check": (handle_prompt_check, AIRS_CHECK_PARAMETERS),
+    "airs_response_check": (handle_response_check, AIRS_CHECK_PARAMETERS),
+}
+
 # Lambda Handler for all functions
 def lambda_handler(event, context):
-    original_db_file = 'employee_database.db'
-    target_db_file = '/tmp/employee_database.db'
-    if not os.path.exists(target_db_file):
-        shutil.copy2(original_db_file, target_db_file)
-    
+    deadline = invocation_deadline(context)
+    # Flush in-memory writes still waiting on the sync interval
+    try:
+        sync_memory_db()
+    except sqlite3.Error as e:
+        logger.error(f"Error syncing the in-memory database to {DB_MEMORY_SYNC_PATH}: {e}")
+
     print(f"Received event: {json.dumps(event)}") # Good for seeing the input
 
     agent = event['agent']
@@ -344,147 +2145,23 @@ def lambda_handler(event, context):
             "body": "Error, no function was called"
         }
     }
-    
-    if function == 'get_employee_id':
-        employee_name = None
-        for param in parameters:
-            if param["name"] == "employee_name":
-                employee_name = param["value"]
-
-        if not employee_name:
-            raise Exception("Missing mandatory parameter: employee_name")
-        employee_id = get_employee_id(employee_name)
+
+    registered = FUNCTION_REGISTRY.get(function)
+    if registered is not None:
+        handler, spec = registered
+        try:
+            args = parse_parameters(parameters, spec)
+        except ValueError as e:
+            # A malformed value is the caller's mistake, answer it like any other function error rather than failing the invocation
+            body = json.dumps({"error": str(e)})
+        else:
+            body = handler(args, deadline)
         responseBody =  {
             'TEXT': {
-                "body": f"employees id for {employee_name}: {employee_id}"
+                "body": body
             }
         }
-    elif function == 'employee_details':
-        employee_id = None
-        for param in parameters:
-            if param["name"] == "employee_id":
-                employee_id = param["value"]
-
-        if not employee_id:
-            raise Exception("Missing mandatory parameter: employee_id")
-        employee_file = employee_details(employee_id)
-        responseBody =  {
-            'TEXT': {
-                "body": f"employee details: {employee_file}"
-            }
-        } 
-    elif function == 'get_leave_balance':
-        employee_id = None
-        for param in parameters:
-            if param["name"] == "employee_id":
-                employee_id = param["value"]
-
-        if not employee_id:
-            raise Exception("Missing mandatory parameter: employee_id")
-        vacation_days = get_leave_balance(employee_id)
-        responseBody =  {
-            'TEXT': {
-                "body": f"available vacation days for employed_id {employee_id}: {vacation_days}"
-            }
-        } 
-    elif function == 'book_leave':
-        employee_id = None
-        start_date = None
-        end_date = None
-        for param in parameters:
-            if param["name"] == "employee_id":
-                employee_id = param["value"]
-            if param["name"] == "start_date":
-                start_date = param["value"]
-            if param["name"] == "end_date":
-                end_date = param["value"]
-            
-        if not employee_id:
-            raise Exception("Missing mandatory parameter: employee_id")
-        if not start_date:
-            raise Exception("Missing mandatory parameter: start_date")
-        if not end_date:
-            raise Exception("Missing mandatory parameter: end_date")
-        
-        completion_message = book_leave(employee_id, start_date, end_date)
-        responseBody =  {
-            'TEXT': {
-                "body": json.dumps(completion_message)
-            }
-        }  
-    elif function == 'list_leave':
-        employee_id = None
-        start_date = None
-        end_date = None
-        for param in parameters:
-            if param["name"] == "employee_id":
-                employee_id = param["value"]
-            
-        if not employee_id:
-            raise Exception("Missing mandatory parameter: employee_id")
-        
-        completion_message = list_leave(employee_id)
-        responseBody =  {
-            'TEXT': {
-                "body": json.dumps(completion_message)
-            }
-        }  
-    elif function == 'cancel_leave':
-        employee_id = None
-        start_date = None
-        for param in parameters:
-            if param["name"] == "employee_id":
-                employee_id = param["value"]
-            if param["name"] == "start_date":
-                start_date = param["value"]
-        if not employee_id:
-            raise Exception("Missing mandatory parameter: employee_id")
-        if not start_date:
-            raise Exception("Missing mandatory parameter: start_date")
-        
-        completion_message = cancel_leave(employee_id, start_date)
-        responseBody =  {
-            'TEXT': {
-                "body": json.dumps(completion_message)
-            }
-        }  
-    elif function == 'check_question' or function == 'check_answer' :
-        reqtype = None
-        prompt = None
-        app_name = None
-        app_user = None
-        tr_id = None
-        for param in parameters:
-            if param["name"] == "input_val":
-                input_val = param["value"]
-            if param["name"] == "app_name":
-                app_name = param["value"]
-            if param["name"] == "app_user":
-                app_user = param["value"]
-            if param["name"] == "tr_id":
-                tr_id = param["value"]
-            
-        if not input_val:
-            raise Exception("Missing mandatory parameter: input_val")
-        if not app_name:
-            app_name ="test app"
-        if not app_user:
-            app_user = "test user"
-        if not tr_id:
-            tr_id = "test id"
-        
-        if function == 'check_question':
-            completion_message = airs_make_request("prompt",input_val, app_name, app_user, tr_id)
-        elif function == 'check_answer':
-            completion_message = airs_make_request("response",input_val, app_name, app_user, tr_id)
-        responseBody =  {
-            'TEXT': {
-                "body": completion_message
-            }
-        }  
-    
-    
-    
+
     action_response = {
         'actionGroup': actionGroup,
         'function': function,
@@ -498,3 +2175,10 @@ def lambda_handler(event, context):
     print("Response: {}".format(function_response))
 
     return function_response
+
+# Load the in-memory database during init rather than in the first invocation
+if DB_MEMORY_MODE:
+    create_db_connection()
+
+if import_profiler is not None:
+    import_profiler.report("init", time.perf_counter() - _init_started)
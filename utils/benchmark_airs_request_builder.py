@@ -0,0 +1,88 @@
+# Compares building and serializing the AIRS request body the old way (replace newlines, %-format a JSON template,
+# json.loads it) against airs_construct_request(), which builds the dict directly. It first checks the body round trips
+# content with quotes, backslashes, newlines and non-ASCII text unchanged.
+import os
+import sys
+import json
+import timeit
+import argparse
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--number", required=False, type=int, default=0, help="Iterations per size, 0 picks a count for each size")
+args = parser.parse_args()
+
+TRICKY_INPUTS = [
+    'He said "book my leave" for 2025-12-02',
+    "C:\\Users\\jane\\leave.txt and a trailing backslash \\",
+    "Line one\nLine two\r\n\ttabbed",
+    "Zoë's café holiday in Zürich, 東京 and 🌴",
+    '{"injected": "json", "tr_id": "x"}',
+    "",
+]
+
+SIZES = [("1KB", 1024), ("64KB", 64 * 1024), ("1MB", 1024 * 1024)]
+
+
+def legacy_construct_request(reqtype, input_value, app_name, app_user, tr_id, profile_name):
+    """The original builder, kept here for comparison."""
+    req = '''
+    {
+        "metadata": {
+        "ai_model": "Test AI model",
+        "app_name": "%s",
+        "app_user": "%s"
+        },
+        "contents": [
+        {
+        "%s": "%s"
+        }
+        ],
+        "tr_id": "%s",
+        "ai_profile": {
+        "profile_name": "%s"
+        }
+    }
+    ''' % (app_name, app_user, reqtype, input_value, tr_id, profile_name)
+    return json.loads(req)
+
+
+def legacy(prompt):
+    return json.dumps(legacy_construct_request("prompt", prompt.replace("\n", " "), "bench app", "bench user", "bench id", "bench-profile"))
+
+
+def builder(prompt):
+    return json.dumps(lambda_function.airs_construct_request("prompt", prompt, "bench app", "bench user", "bench id"))
+
+
+def check_round_trip():
+    """Returns True if every tricky input comes back out of the serialized body unchanged."""
+    ok = True
+    for text in TRICKY_INPUTS:
+        body = json.loads(builder(text))
+        if body["contents"][0]["prompt"] != text or body["ai_profile"]["profile_name"] != "bench-profile":
+            print(f"FAIL: {text!r} did not round trip")
+            ok = False
+        try:
+            legacy(text)
+            legacy_result = "ok"
+        except ValueError as e:
+            legacy_result = f"fails ({e.__class__.__name__})"
+        print(f"{text[:40]!r:<46} builder ok, legacy {legacy_result}")
+    return ok
+
+
+if __name__ == "__main__":
+    os.environ['AIRS_PROMPT_PROFILE'] = "bench-profile"
+    if not check_round_trip():
+        sys.exit(1)
+    # Plain text with newlines but no quotes or backslashes, so the legacy builder can handle it
+    line = "Please book annual leave from the second to the fifth of December for the whole team.\n"
+    print()
+    for name, size in SIZES:
+        prompt = (line * (size // len(line) + 1))[:size]
+        number = args.number or max(5, 2000 * 1024 // size)
+        legacy_time = timeit.timeit(lambda: legacy(prompt), number=number) / number
+        builder_time = timeit.timeit(lambda: builder(prompt), number=number) / number
+        print(f"{name:<5} legacy {legacy_time * 1e6:10.1f}us  builder {builder_time * 1e6:10.1f}us  ({legacy_time / builder_time:.1f}x)")
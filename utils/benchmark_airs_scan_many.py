@@ -0,0 +1,50 @@
+# Compares the wall-clock time of running independent AIRS scans one after another against airs_scan_many(),
+# using the local AIRS server with injected latency to stand in for the network round trip.
+import os
+import sys
+import time
+import argparse
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import lambda_function
+from local_airs_server import start_server
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--items", required=False, type=int, default=8, help="Number of scans in each batch")
+parser.add_argument("-l", "--latency", required=False, type=float, default=0.05, help="Seconds the local AIRS server waits before answering")
+args = parser.parse_args()
+
+
+def batch(run):
+    return [
+        {"reqtype": "prompt" if i % 2 == 0 else "response", "input_val": f"Can I book leave for the week {run}-{i}?"}
+        for i in range(args.items)
+    ]
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('AIRS_API', "local-test-token")
+    os.environ.setdefault('AIRS_PROMPT_PROFILE', "local-prompt-profile")
+    os.environ.setdefault('AIRS_RESPONSE_PROFILE', "local-response-profile")
+    # Every scan has to reach the server for the comparison to be fair
+    lambda_function.AIRS_CACHE_MAX_ENTRIES = 0
+    server, base_url = start_server(latency=args.latency)
+    lambda_function.AIRS_BASE_URL = base_url
+    print(f"{args.items} scans, {args.latency * 1e3:.0f}ms server latency, {lambda_function.AIRS_SCAN_WORKERS} workers")
+    try:
+        # Warm the connection pool so neither run pays for the connection setup
+        lambda_function.airs_scan_many(batch("warm"))
+
+        started = time.perf_counter()
+        for item in batch("sequential"):
+            lambda_function.airs_scan(item["reqtype"], item["input_val"], "bench app", "bench user", "bench id")
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = lambda_function.airs_scan_many(batch("parallel"))
+        parallel = time.perf_counter() - started
+    finally:
+        lambda_function.close_airs_session()
+        server.shutdown()
+    print(f"sequential      {sequential * 1e3:8.1f}ms")
+    print(f"airs_scan_many  {parallel * 1e3:8.1f}ms  ({sequential / parallel:.1f}x), merged action {result['merged']['action']}")
@@ -0,0 +1,64 @@
+# Compares AIRS scan latency using a new connection per call (requests.post) against the pooled keep-alive session.
+# Runs against the local HTTPS stand-in server so the TCP and TLS handshake cost is included.
+import os
+import sys
+import time
+import argparse
+import tempfile
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import requests
+import lambda_function
+from local_airs_server import generate_self_signed_cert, start_server
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--iterations", required=False, type=int, default=200, help="Number of scans to run for each pattern")
+args = parser.parse_args()
+
+
+def report(name, timings, connections):
+    """Prints the latency percentiles for a list of timings in seconds."""
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1e3
+    p99 = timings[int(len(timings) * 0.99)] * 1e3
+    mean = sum(timings) / len(timings) * 1e3
+    print(f"{name:<24} mean {mean:7.2f}ms  p50 {p50:7.2f}ms  p99 {p99:7.2f}ms  connections {connections}")
+
+
+def run(name, server, func):
+    start_connections = server.connection_count
+    timings = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        func(f"How many days of leave do I have left? {i}")
+        timings.append(time.perf_counter() - start)
+    report(name, timings, server.connection_count - start_connections)
+
+
+def post_per_call(prompt):
+    """The original pattern, requests.post builds a new session and connection every time."""
+    req = lambda_function.airs_construct_request("prompt", prompt, "bench app", "bench user", "bench id")
+    header = {"x-pan-token": os.environ['AIRS_API'], "Content-Type": "application/json"}
+    return requests.post(lambda_function.AIRS_BASE_URL + lambda_function.AIRS_SYNC_SCAN_PATH, headers=header, json=req).json()
+
+
+def pooled_session(prompt):
+    return lambda_function.airs_make_request("prompt", prompt, "bench app", "bench user", "bench id")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('AIRS_API', "local-test-token")
+    os.environ.setdefault('AIRS_PROMPT_PROFILE', "local-prompt-profile")
+    os.environ.setdefault('AIRS_RESPONSE_PROFILE', "local-response-profile")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        certfile, keyfile = generate_self_signed_cert(tmpdir)
+        os.environ['REQUESTS_CA_BUNDLE'] = certfile
+        server, base_url = start_server(certfile=certfile, keyfile=keyfile)
+        lambda_function.AIRS_BASE_URL = base_url
+        print(f"{args.iterations} scans against {base_url}")
+        try:
+            run("requests.post per call", server, post_per_call)
+            run("pooled session", server, pooled_session)
+        finally:
+            lambda_function.close_airs_session()
+            server.shutdown()
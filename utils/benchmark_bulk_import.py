@@ -0,0 +1,233 @@
+# Times utils/bulk_import.py loading synthetic files (10k employees, their leave balances and 1M bookings by default)
+# into a copy of the database, with a few bad rows mixed in: the load must reject exactly those lines, load the rest
+# (including a booking that only clashes with a rejected one), leave the summary tables matching the bookings and put
+# their triggers back. A dry run first must leave the copy as it was, schema version included. Compares the load with inserting the
+# bookings one execute() and commit per row (timed on a sample and scaled up) and with a bare executemany that checks
+# nothing, then times exporting the bookings back out with utils/bulk_export.py. Exits with status 1 if a check fails.
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+import itertools
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+import bulk_export
+import bulk_import
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-b", "--bookings", required=False, type=int, default=1000000, help="Synthetic bookings to load")
+parser.add_argument("-e", "--employees", required=False, type=int, default=10000, help="Synthetic employees the bookings belong to")
+parser.add_argument("--format", required=False, choices=["csv", "jsonl"], default="csv", help="Format of the generated files")
+parser.add_argument("-s", "--sample", required=False, type=int, default=10000, help="Bookings the row-at-a-time baseline inserts (timed and scaled up)")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and load into")
+args = parser.parse_args()
+
+FIRST_DATE = date(2030, 1, 1)
+FIRST_EMPLOYEE_ID = 100000
+# Each employee's bookings are a week at most and start ten days apart, so they never overlap
+BOOKING_STRIDE = 10
+COLUMNS = {
+    "employees": ["employee_id", "employee_name", "employee_job_title", "employee_start_date", "employee_calendar"],
+    "vacations": ["employee_id", "year", "employee_total_vacation_days", "employee_vacation_days_taken", "employee_carried_over_days"],
+    "planned_vacations": ["employee_id", "vacation_start_date", "vacation_end_date", "vacation_days_taken"],
+}
+INSERT_BOOKING = "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)"
+
+
+def synthetic_rows():
+    """The rows of each file, the bookings interleaved across employees. Every 10th booking leaves out its days."""
+    employee_ids = range(FIRST_EMPLOYEE_ID, FIRST_EMPLOYEE_ID + args.employees)
+    employees = [
+        {"employee_id": employee_id, "employee_name": f"Employee {employee_id}", "employee_job_title": ("Designer", "Engineer", "Manager")[employee_id % 3],
+         "employee_start_date": "2025-01-06", "employee_calendar": "default"}
+        for employee_id in employee_ids
+    ]
+    vacations = [
+        {"employee_id": employee_id, "year": year, "employee_total_vacation_days": 25, "employee_vacation_days_taken": 0, "employee_carried_over_days": 0}
+        for employee_id in employee_ids for year in (2030, 2031, 2032)
+    ]
+
+    def bookings():
+        for number in range(args.bookings):
+            employee_id = employee_ids[number % args.employees]
+            start = FIRST_DATE + timedelta(days=(number // args.employees) * BOOKING_STRIDE)
+            days = number % 7 + 1
+            yield {"employee_id": employee_id, "vacation_start_date": str(start), "vacation_end_date": str(start + timedelta(days=days - 1)),
+                   "vacation_days_taken": "" if number % 10 == 0 else days}
+
+    return {"employees": employees, "vacations": vacations, "planned_vacations": itertools.chain(bookings(), GAP_BOOKINGS)}
+
+
+# Bad bookings put in the file, each with the reason bulk_import should give
+BAD_BOOKINGS = [
+    ({"employee_id": FIRST_EMPLOYEE_ID, "vacation_start_date": "2030-02-30", "vacation_end_date": "2030-03-01", "vacation_days_taken": 1}, "not a YYYY-MM-DD date"),
+    ({"employee_id": FIRST_EMPLOYEE_ID, "vacation_start_date": "2030-03-02", "vacation_end_date": "2030-03-01", "vacation_days_taken": 1}, "before vacation_start_date"),
+    ({"employee_id": "x", "vacation_start_date": "2030-03-02", "vacation_end_date": "2030-03-02", "vacation_days_taken": 1}, "not a whole number"),
+    ({"employee_id": 1, "vacation_start_date": "", "vacation_end_date": "2030-03-02", "vacation_days_taken": 1}, "vacation_start_date is missing"),
+    ({"employee_id": 99999999, "vacation_start_date": "2030-03-02", "vacation_end_date": "2030-03-02", "vacation_days_taken": 1}, "unknown employee_id"),
+    # Starts on the employee's first booking and runs into the gap before the second
+    ({"employee_id": FIRST_EMPLOYEE_ID, "vacation_start_date": str(FIRST_DATE), "vacation_end_date": str(FIRST_DATE + timedelta(days=8)), "vacation_days_taken": 7},
+     "overlaps another booking"),
+]
+# Good bookings written after the rest, in the gap the rejected booking above runs into: they must still load
+GAP_BOOKINGS = [
+    {"employee_id": FIRST_EMPLOYEE_ID, "vacation_start_date": str(FIRST_DATE + timedelta(days=8)), "vacation_end_date": str(FIRST_DATE + timedelta(days=9)), "vacation_days_taken": 2},
+]
+
+
+def write_files(tmpdir):
+    """Writes the synthetic files, returns ({table: path}, {line of a bad booking: expected reason}, good bookings)."""
+    paths, expected = {}, {}
+    good = 0
+    for table, rows in synthetic_rows().items():
+        path = os.path.join(tmpdir, f"{table}.{args.format}")
+        paths[table] = path
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = None
+            if args.format == "csv":
+                writer = csv.DictWriter(file, fieldnames=COLUMNS[table])
+                writer.writeheader()
+            # CSV data starts on line 2, after the header
+            line = 2 if writer else 1
+            bad = iter(BAD_BOOKINGS if table == "planned_vacations" else [])
+            for number, row in enumerate(rows):
+                # A bad booking after every n good ones
+                if table == "planned_vacations" and number and number % max(1, args.bookings // (len(BAD_BOOKINGS) + 1)) == 0:
+                    bad_row = next(bad, None)
+                    if bad_row:
+                        row_to_write, reason = bad_row
+                        writer.writerow(row_to_write) if writer else file.write(json.dumps(row_to_write) + "\n")
+                        expected[line] = reason
+                        line += 1
+                writer.writerow(row) if writer else file.write(json.dumps(row) + "\n")
+                line += 1
+                if table == "planned_vacations":
+                    good += 1
+    return paths, expected, good
+
+
+def check_load(connection, results, expected, good):
+    """True if the load rejected exactly the bad bookings and kept the summary tables and their triggers."""
+    ok = True
+    for table, (read, loaded, errors) in results.items():
+        if table != "planned_vacations" and errors:
+            print(f"FAIL: {len(errors)} {table} rows rejected, e.g. {errors[:3]}")
+            ok = False
+    _, loaded, errors = results["planned_vacations"]
+    rejected = {line: reason for _, line, reason in errors}
+    if set(rejected) != set(expected) or any(expected[line] not in rejected[line] for line in expected):
+        print(f"FAIL: expected the bookings on lines {expected} to be rejected, got {rejected}")
+        ok = False
+    if loaded != good:
+        print(f"FAIL: loaded {loaded} bookings, expected {good}")
+        ok = False
+    differences = lambda_function.check_leave_summary(connection)
+    if differences:
+        print(f"FAIL: {len(differences)} summary rows do not match the bookings after the load")
+        ok = False
+    triggers = connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'planned_vacations_summary_%'").fetchone()[0]
+    if triggers != len(lambda_function.LEAVE_SUMMARY_TRIGGERS):
+        print(f"FAIL: {triggers} summary triggers after the load")
+        ok = False
+    if ok:
+        print(f"OK: loaded {loaded} bookings, rejected the {len(expected)} bad ones with the right reasons, the summary tables match")
+    return ok
+
+
+def check_dry_run(connection, paths):
+    """True if a dry run, on the copy set back to before schema migration 7, leaves it as it was."""
+    version, index = 7, "idx_planned_vacations_employee_id_end_start"
+    connection.execute(f"DROP INDEX {index}")
+    connection.execute(f"PRAGMA user_version = {version - 1}")
+    connection.commit()
+    bookings = connection.execute("SELECT COUNT(*) FROM planned_vacations").fetchone()[0]
+    bulk_import.bulk_import(connection, paths, args.format, dry_run=True)
+    after = (
+        connection.execute("PRAGMA user_version").fetchone()[0],
+        connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (index,)).fetchone()[0],
+        connection.execute("SELECT COUNT(*) FROM planned_vacations").fetchone()[0],
+    )
+    if after != (version - 1, 0, bookings):
+        print(f"FAIL: after a dry run the schema version, migration {version} index and bookings are {after}, expected {(version - 1, 0, bookings)}")
+        return False
+    print(f"OK: the dry run left schema version {version - 1} and the {bookings} bookings as they were")
+    return True
+
+
+def row_at_a_time(db_path, bookings_path, bad_lines):
+    """Seconds to insert the first args.sample good bookings with one execute() and commit each, and with one bare
+    executemany."""
+    rows = []
+    for line, row, _ in bulk_import.read_rows(bookings_path, args.format):
+        if line not in bad_lines and row["vacation_days_taken"] not in ("", None):
+            rows.append((int(row["employee_id"]), row["vacation_start_date"], row["vacation_end_date"], int(row["vacation_days_taken"])))
+        if len(rows) >= args.sample:
+            break
+    connection = sqlite3.connect(db_path)
+    lambda_function.apply_db_pragmas(connection)
+    started = time.perf_counter()
+    for row in rows:
+        connection.execute(INSERT_BOOKING, row)
+        connection.commit()
+    per_row = (time.perf_counter() - started) / len(rows)
+    connection.execute("DELETE FROM planned_vacations WHERE employee_id >= ?", (FIRST_EMPLOYEE_ID,))
+    connection.commit()
+    started = time.perf_counter()
+    connection.executemany(INSERT_BOOKING, rows)
+    connection.commit()
+    bare = (time.perf_counter() - started) / len(rows)
+    connection.close()
+    return per_row, bare
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.WARNING)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        started = time.perf_counter()
+        paths, expected, good = write_files(tmpdir)
+        size = os.path.getsize(paths["planned_vacations"])
+        print(f"Wrote {args.employees} employees, {args.employees * 3} balances and {good} bookings ({size / 1e6:.0f}MB {args.format}) in {time.perf_counter() - started:.1f}s")
+
+        db_path = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, db_path)
+        # Connected as utils/bulk_import.py does, without the lambda's PRAGMA profile
+        connection = sqlite3.connect(db_path)
+        failed = not check_dry_run(connection, paths)
+        started = time.perf_counter()
+        results = bulk_import.bulk_import(connection, paths, args.format)
+        load = time.perf_counter() - started
+        failed = not check_load(connection, results, expected, good) or failed
+        connection.close()
+
+        export_path = os.path.join(tmpdir, f"export.{args.format}")
+        connection = sqlite3.connect(db_path)
+        started = time.perf_counter()
+        with open(export_path, "w", newline="", encoding="utf-8") as file:
+            exported = bulk_export.write_export(connection, "planned_vacations", file, args.format)
+        export = time.perf_counter() - started
+        connection.close()
+
+        baseline_path = os.path.join(tmpdir, "baseline.db")
+        shutil.copy2(args.database, baseline_path)
+        connection = sqlite3.connect(baseline_path)
+        lambda_function.migrate_database(connection)
+        connection.executemany("INSERT INTO employees (employee_id, employee_name) VALUES (?, ?)", ((row["employee_id"], row["employee_name"]) for row in synthetic_rows()["employees"]))
+        connection.commit()
+        connection.close()
+        per_row, bare = row_at_a_time(baseline_path, paths["planned_vacations"], expected)
+
+    rows = sum(read for read, _, _ in results.values())
+    print(f"{'approach':<40} {'per 1M rows':>12} {'rows/s':>10}")
+    print(f"{'execute() and commit per row':<40} {per_row * 1e6:11.0f}s {1 / per_row:10.0f}  (timed for {args.sample}, scaled)")
+    print(f"{'bare executemany, no checks':<40} {bare * 1e6:11.1f}s {1 / bare:10.0f}  (timed for {args.sample}, scaled)")
+    print(f"{'bulk_import, all three files':<40} {load / rows * 1e6:11.1f}s {rows / load:10.0f}  ({rows} rows in {load:.1f}s)")
+    print(f"{'bulk_export, bookings':<40} {export / exported * 1e6:11.1f}s {exported / export:10.0f}  ({exported} rows in {export:.1f}s)")
+    sys.exit(1 if failed else 0)
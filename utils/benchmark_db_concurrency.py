@@ -0,0 +1,93 @@
+# Compares database throughput with the default SQLite settings against the tuned PRAGMA profile (WAL,
+# synchronous=NORMAL, ...) with several processes reading and writing the same /tmp copy at once.
+# Readers call get_leave_balance and list_leave, writers book and cancel a day of leave.
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import lambda_function
+from create_sample_db import setup_database
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-r", "--readers", required=False, type=int, default=4, help="Reader processes")
+parser.add_argument("-w", "--writers", required=False, type=int, default=2, help="Writer processes")
+parser.add_argument("-t", "--seconds", required=False, type=float, default=5, help="How long each profile runs")
+parser.add_argument("-e", "--employees", required=False, type=int, default=10000, help="Employees in the generated database")
+parser.add_argument("-p", "--profiles", required=False, type=str, default="default,tuned", help="Comma separated PRAGMA profiles to compare")
+args = parser.parse_args()
+
+
+def worker(role, index, db_path, profile, stop_at, results):
+    """Runs lookups or bookings against db_path until stop_at, puts (role, operations, errors, timings) on results."""
+    lambda_function.logger.setLevel(logging.ERROR)
+    lambda_function.DB_PATH = db_path
+    lambda_function.DB_PRAGMA_PROFILE = profile
+    # Each writer books its own Monday so writers never cancel or overlap each other's bookings
+    leave_date = date.today() + timedelta(days=400 + 7 * index)
+    leave_date = (leave_date - timedelta(days=leave_date.weekday())).strftime('%Y-%m-%d')
+    operations, errors, timings = 0, 0, []
+    while time.time() < stop_at:
+        employee_id = random.randint(1, args.employees)
+        started = time.perf_counter()
+        if role == "reader":
+            ok = "error" not in lambda_function.get_leave_balance(employee_id)
+            lambda_function.list_leave(employee_id)
+        else:
+            booked = lambda_function.book_leave(employee_id, leave_date, leave_date)
+            ok = "error" not in booked or booked["error"] == "Insufficient leave available"
+            if "error" not in booked:
+                ok = "error" not in lambda_function.cancel_leave(employee_id, leave_date)
+        timings.append(time.perf_counter() - started)
+        operations += 1
+        if not ok:
+            errors += 1
+    lambda_function.close_db_connection()
+    results.put((role, operations, errors, timings))
+
+
+def run_profile(source_path, workdir, profile):
+    """Runs the readers and writers against a fresh copy of the database, returns {role: (ops, errors, timings)}."""
+    db_path = os.path.join(workdir, f"employee_database_{profile}.db")
+    shutil.copy2(source_path, db_path)
+    results = multiprocessing.Queue()
+    stop_at = time.time() + 0.5 + args.seconds
+    processes = [
+        multiprocessing.Process(target=worker, args=(role, index, db_path, profile, stop_at, results))
+        for role, count in (("reader", args.readers), ("writer", args.writers))
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    totals = {"reader": [0, 0, []], "writer": [0, 0, []]}
+    for _ in processes:
+        role, operations, errors, timings = results.get()
+        totals[role][0] += operations
+        totals[role][1] += errors
+        totals[role][2] += timings
+    for process in processes:
+        process.join()
+    return totals
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source_path = os.path.join(tmpdir, "employee_database.db")
+        logging.getLogger().setLevel(logging.WARNING)
+        setup_database(source_path, args.employees)
+        print(f"{args.readers} readers, {args.writers} writers, {args.seconds}s per profile, {args.employees} employees")
+        print(f"{'profile':<10} {'role':<8} {'ops/s':>10} {'errors':>8} {'p50':>10} {'p99':>10}")
+        for profile in args.profiles.split(","):
+            totals = run_profile(source_path, tmpdir, profile)
+            for role, (operations, errors, timings) in totals.items():
+                timings.sort()
+                p50 = timings[len(timings) // 2] * 1e3 if timings else 0
+                p99 = timings[int(len(timings) * 0.99)] * 1e3 if timings else 0
+                print(f"{profile:<10} {role:<8} {operations / args.seconds:10.0f} {errors:8d} {p50:8.2f}ms {p99:8.2f}ms")
@@ -0,0 +1,57 @@
+# Compares per-call latency of the warm-container connection against opening and closing a connection per call
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--iterations", required=False, type=int, default=5000, help="Number of lookups to run for each pattern")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and benchmark against")
+args = parser.parse_args()
+
+
+def open_close_lookup(employee_number):
+    """The original pattern, a fresh connection for every call."""
+    connection = sqlite3.connect(lambda_function.DB_PATH)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = ?",
+            (employee_number,),
+        )
+        return cursor.fetchone()
+    finally:
+        connection.close()
+
+
+def report(name, timings):
+    """Prints the latency percentiles for a list of timings in seconds."""
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    mean = sum(timings) / len(timings) * 1e6
+    print(f"{name:<20} mean {mean:8.1f}us  p50 {p50:8.1f}us  p99 {p99:8.1f}us")
+
+
+def run(name, func):
+    timings = []
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        func((i % 10) + 1)
+        timings.append(time.perf_counter() - start)
+    report(name, timings)
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lambda_function.DB_PATH = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, lambda_function.DB_PATH)
+        print(f"{args.iterations} lookups against {args.database}")
+        run("open/close per call", open_close_lookup)
+        run("warm connection", lambda_function.get_leave_balance)
+        lambda_function.close_db_connection()
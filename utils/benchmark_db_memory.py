@@ -0,0 +1,142 @@
+# Compares the file-backed database against the in-memory mode (DB_MEMORY_MODE) at several database sizes.
+# Reports the p50/p99 latency of each lookup, the load time of the in-memory copy, and the cost of a booking plus
+# cancellation under each DB_MEMORY_SYNC policy. Databases are generated with create_sample_db.py, pass --keep-dir to
+# reuse them between runs (the 1M employee database takes a couple of minutes to build and is around 500MB).
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import lambda_function
+from create_sample_db import setup_database
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-s", "--sizes", required=False, type=str, default="10,10000,1000000", help="Comma separated employee counts")
+parser.add_argument("-n", "--iterations", required=False, type=int, default=2000, help="Calls per lookup")
+parser.add_argument("-w", "--writes", required=False, type=int, default=20, help="Booking and cancellation pairs per sync policy")
+parser.add_argument("-k", "--keep-dir", required=False, type=str, default="", help="Directory to keep and reuse the generated databases in")
+args = parser.parse_args()
+
+LOOKUPS = [
+    ("get_employee_id", lambda employee_id: lambda_function.get_employee_id(employee_name(employee_id))),
+    ("employee_details", lambda employee_id: lambda_function.employee_details(employee_id)),
+    ("get_leave_balance", lambda employee_id: lambda_function.get_leave_balance(employee_id)),
+    ("list_leave", lambda employee_id: lambda_function.list_leave(employee_id)),
+]
+# (label, in-memory mode, sync policy)
+WRITE_MODES = [
+    ("file", False, None),
+    ("memory/commit", True, "commit"),
+    ("memory/interval", True, "interval"),
+    ("memory/off", True, "off"),
+]
+SAMPLE_NAMES = ['John Doe', 'Jane Smith', 'Bob Johnson', 'Alice Williams', 'Tom Brown', 'Emily Davis', 'Michael Wilson', 'Sarah Taylor', 'David Anderson', 'Jessica Thompson']
+
+
+def employee_name(employee_id):
+    """The name create_sample_db.py gives an employee id."""
+    return SAMPLE_NAMES[employee_id - 1] if employee_id <= len(SAMPLE_NAMES) else f"Employee {employee_id}"
+
+
+def sample_database(directory, employees):
+    """Returns the path of a generated database with the given number of employees, building it if needed."""
+    path = os.path.join(directory, f"employees_{employees}.db")
+    if not os.path.exists(path):
+        print(f"Generating {path}...")
+        setup_database(path, employees)
+    return path
+
+
+def percentiles(timings):
+    """Returns (p50, p99) in microseconds."""
+    timings.sort()
+    return timings[len(timings) // 2] * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+
+def configure(bundled_path, workdir, memory, sync=None):
+    """Points the lambda at a database and a clean /tmp stand-in, in file-backed or in-memory mode."""
+    lambda_function.close_db_connection()
+    lambda_function.BUNDLED_DB_PATH = bundled_path
+    lambda_function.DB_PATH = os.path.join(workdir, "employee_database.db")
+    lambda_function.DB_MEMORY_SYNC_PATH = os.path.join(workdir, "employee_database_sync.db")
+    lambda_function.DB_MEMORY_MODE = memory
+    lambda_function.DB_MEMORY_SYNC = sync or "commit"
+    for path in (lambda_function.DB_PATH, lambda_function.DB_MEMORY_SYNC_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_lookups(employees):
+    """Returns {lookup name: (p50, p99)} for random employees."""
+    ids = [random.randint(1, employees) for _ in range(args.iterations)]
+    results = {}
+    for name, lookup in LOOKUPS:
+        timings = []
+        for employee_id in ids:
+            started = time.perf_counter()
+            lookup(employee_id)
+            timings.append(time.perf_counter() - started)
+        results[name] = percentiles(timings)
+    return results
+
+
+def run_writes(employees):
+    """Books and cancels a day of leave for random employees with some leave left, returns (p50, p99) or None.
+    The first pair is not timed, in file-backed mode it is the one that copies the database to /tmp."""
+    # A Monday, so the booking takes one working day
+    leave_date = date.today() + timedelta(days=400)
+    leave_date = (leave_date - timedelta(days=leave_date.weekday())).strftime('%Y-%m-%d')
+    timings = []
+    for _ in range(args.writes * 20):
+        if len(timings) > args.writes:
+            break
+        employee_id = random.randint(1, employees)
+        started = time.perf_counter()
+        booked = lambda_function.book_leave(employee_id, leave_date, leave_date)
+        if "error" in booked:
+            continue
+        lambda_function.cancel_leave(employee_id, leave_date)
+        timings.append(time.perf_counter() - started)
+    return percentiles(timings[1:]) if len(timings) > 1 else None
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.WARNING)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        keep_dir = args.keep_dir or tmpdir
+        os.makedirs(keep_dir, exist_ok=True)
+        for employees in sizes:
+            bundled = sample_database(keep_dir, employees)
+            print(f"\n{employees} employees ({os.path.getsize(bundled) / 1024 / 1024:.1f}MB), {args.iterations} calls per lookup")
+
+            configure(bundled, tmpdir, memory=False)
+            lambda_function.create_db_connection(readonly=True)
+            file_results = run_lookups(employees)
+
+            configure(bundled, tmpdir, memory=True)
+            started = time.perf_counter()
+            lambda_function.create_db_connection()
+            print(f"in-memory load {(time.perf_counter() - started) * 1e3:.1f}ms")
+            memory_results = run_lookups(employees)
+
+            print(f"{'lookup':<18} {'file p50':>10} {'p99':>10} {'memory p50':>12} {'p99':>10}")
+            for name, _ in LOOKUPS:
+                file_p50, file_p99 = file_results[name]
+                memory_p50, memory_p99 = memory_results[name]
+                print(f"{name:<18} {file_p50:8.1f}us {file_p99:8.1f}us {memory_p50:10.1f}us {memory_p99:8.1f}us")
+
+            print(f"{'book + cancel':<18} {'p50':>10} {'p99':>10}")
+            for label, memory, sync in WRITE_MODES:
+                configure(bundled, tmpdir, memory, sync)
+                result = run_writes(employees)
+                if result is None:
+                    print(f"{label:<18} no employee had leave left to book")
+                else:
+                    print(f"{label:<18} {result[0] / 1e3:8.2f}ms {result[1] / 1e3:8.2f}ms")
+            lambda_function.close_db_connection()
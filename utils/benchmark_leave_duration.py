@@ -0,0 +1,82 @@
+# Checks the leave duration engine against a day-by-day count for random ranges and weekmasks, then compares the time
+# to count a batch of ranges day by day, with count_leave_days() per range, and with one count_leave_days_many() call.
+import sys
+import time
+import random
+import argparse
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--ranges", required=False, type=int, default=100000, help="Date ranges in the batch")
+parser.add_argument("-m", "--max-days", required=False, type=int, default=30, help="Longest range in days")
+args = parser.parse_args()
+
+WEEKMASKS = ["1111100", "0111111", "1000001", "1111111", "1011010"]
+# A year of made up holidays, some on weekends
+HOLIDAYS = [date(2026, 1, 1) + timedelta(days=day) for day in range(0, 730, 17)]
+
+
+def day_by_day(start, end, weekmask, holidays):
+    """The obvious loop, one day at a time."""
+    days = 0
+    day = start
+    while day <= end:
+        if weekmask[day.weekday()] == "1" and day not in holidays:
+            days += 1
+        day += timedelta(days=1)
+    return days
+
+
+def random_ranges(count, max_days):
+    """Random (start, end) YYYY-MM-DD pairs, as they come out of the database."""
+    ranges = []
+    for _ in range(count):
+        start = date(2026, 1, 1) + timedelta(days=random.randrange(700))
+        ranges.append((str(start), str(start + timedelta(days=random.randrange(max_days)))))
+    return ranges
+
+
+def check_engine():
+    """Returns True if the engine matches the day-by-day count for every weekmask."""
+    holiday_set = set(HOLIDAYS)
+    for weekmask in WEEKMASKS:
+        calendar = lambda_function.compile_leave_calendar(weekmask, HOLIDAYS)
+        ranges = random_ranges(2000, 60) + [("2026-03-10", "2026-03-09")]
+        expected = [day_by_day(date.fromisoformat(start), date.fromisoformat(end), weekmask, holiday_set) for start, end in ranges]
+        if lambda_function.count_leave_days_many(ranges, calendar) != expected:
+            print(f"FAIL: count_leave_days_many disagrees with the day-by-day count for weekmask {weekmask}")
+            return False
+        if [lambda_function.count_leave_days(start, end, calendar) for start, end in ranges] != expected:
+            print(f"FAIL: count_leave_days disagrees with the day-by-day count for weekmask {weekmask}")
+            return False
+    print(f"OK: engine matches the day-by-day count for weekmasks {', '.join(WEEKMASKS)}")
+    return True
+
+
+if __name__ == "__main__":
+    if not check_engine():
+        sys.exit(1)
+    calendar = lambda_function.compile_leave_calendar("1111100", HOLIDAYS)
+    holiday_set = set(HOLIDAYS)
+    ranges = random_ranges(args.ranges, args.max_days)
+
+    started = time.perf_counter()
+    for start, end in ranges:
+        day_by_day(date.fromisoformat(start), date.fromisoformat(end), "1111100", holiday_set)
+    loop = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start, end in ranges:
+        lambda_function.count_leave_days(start, end, calendar)
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    lambda_function.count_leave_days_many(ranges, calendar)
+    batch = time.perf_counter() - started
+
+    print(f"{args.ranges} ranges of up to {args.max_days} days")
+    print(f"day by day              {loop * 1e3:9.1f}ms  {loop / args.ranges * 1e9:7.0f}ns per range")
+    print(f"count_leave_days        {single * 1e3:9.1f}ms  {single / args.ranges * 1e9:7.0f}ns per range  ({loop / single:.1f}x)")
+    print(f"count_leave_days_many   {batch * 1e3:9.1f}ms  {batch / args.ranges * 1e9:7.0f}ns per range  ({loop / batch:.1f}x)")
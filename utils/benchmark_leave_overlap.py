@@ -0,0 +1,118 @@
+# Shows the cost of book_leave's overlap check as one employee's booking history grows. It compares the query
+# book_leave runs (OVERLAPPING_LEAVE_QUERY, a seek on the bookings ending on or after the new one starts) against the
+# same range condition walked through the start date index, which has to visit every earlier booking of the employee.
+# New bookings are never in the past, so the probes are in the last UPCOMING bookings of the history. The history also
+# holds a long booking that overlaps several short ones (older data can), and both queries must still find it.
+# Reports the p50 time per check and the number of SQLite VM steps, which grows with the rows examined.
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-s", "--sizes", required=False, type=str, default="10,1000,100000,1000000", help="Comma separated booking counts for the employee")
+parser.add_argument("-n", "--iterations", required=False, type=int, default=300, help="Checks per size")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and benchmark against")
+args = parser.parse_args()
+
+EMPLOYEE_ID = 1
+FIRST_DATE = date(2030, 1, 1)
+# Every booking is one day long with a free day after it
+BOOKING_STRIDE = 2
+# Bookings at the end of the history that are still to come
+UPCOMING = 20
+
+NAIVE_OVERLAP_QUERY = """
+    SELECT vacation_start_date, vacation_end_date, vacation_days_taken
+    FROM planned_vacations INDEXED BY idx_planned_vacations_employee_id_start_end
+    WHERE employee_id = :employee_id AND vacation_start_date <= :end_date AND vacation_end_date >= :start_date
+"""
+
+
+def add_bookings(connection, count):
+    """Replaces the employee's bookings with count single-day bookings from FIRST_DATE on, plus one booking that spans
+    the first half of the upcoming ones."""
+    connection.execute("DELETE FROM planned_vacations WHERE employee_id = ?", (EMPLOYEE_ID,))
+    days = (str(FIRST_DATE + timedelta(days=i * BOOKING_STRIDE)) for i in range(count))
+    connection.executemany(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, 1)",
+        ((EMPLOYEE_ID, day, day) for day in days),
+    )
+    first_upcoming = FIRST_DATE + timedelta(days=max(0, count - UPCOMING) * BOOKING_STRIDE)
+    connection.execute(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)",
+        (EMPLOYEE_ID, str(first_upcoming), str(first_upcoming + timedelta(days=UPCOMING)), UPCOMING),
+    )
+    connection.commit()
+
+
+def probes(count):
+    """Random three-day ranges among the upcoming bookings and just after them, the way a booking request would look."""
+    first_upcoming = max(0, count - UPCOMING) * BOOKING_STRIDE
+    span = (count - first_upcoming // BOOKING_STRIDE + 5) * BOOKING_STRIDE
+    for _ in range(args.iterations):
+        start = FIRST_DATE + timedelta(days=first_upcoming + random.randrange(span))
+        yield {"employee_id": EMPLOYEE_ID, "start_date": str(start), "end_date": str(start + timedelta(days=2))}
+
+
+def measure(connection, query, ranges):
+    """Returns (p50 in microseconds, mean VM steps) for running the query on each range."""
+    timings = []
+    for params in ranges:
+        started = time.perf_counter()
+        connection.execute(query, params).fetchall()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    steps = [0]
+
+    def count_step():
+        steps[0] += 1
+        return 0
+
+    connection.set_progress_handler(count_step, 1)
+    sample = ranges[:20]
+    for params in sample:
+        connection.execute(query, params).fetchall()
+    connection.set_progress_handler(None, 1)
+    return timings[len(timings) // 2] * 1e6, steps[0] / len(sample)
+
+
+def check_same_answers(connection, ranges, count):
+    """True if both queries find the same conflicts, and find the long booking on a day only it covers."""
+    first_upcoming = FIRST_DATE + timedelta(days=max(0, count - UPCOMING) * BOOKING_STRIDE)
+    # An odd day after the long booking's start, which no short booking covers
+    inside = str(first_upcoming + timedelta(days=BOOKING_STRIDE + 1))
+    params = {"employee_id": EMPLOYEE_ID, "start_date": inside, "end_date": inside}
+    if [row[0] for row in connection.execute(lambda_function.OVERLAPPING_LEAVE_QUERY, params)] != [str(first_upcoming)]:
+        print(f"FAIL: the overlap check misses the long booking from {first_upcoming} on {inside}")
+        return False
+    for params in ranges:
+        if sorted(connection.execute(lambda_function.OVERLAPPING_LEAVE_QUERY, params).fetchall()) != sorted(connection.execute(NAIVE_OVERLAP_QUERY, params).fetchall()):
+            print(f"FAIL: the queries disagree for {params}")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, db_path)
+        connection = sqlite3.connect(db_path)
+        lambda_function.migrate_database(connection)
+        print(f"{'bookings':>10} {'overlap check p50':>18} {'VM steps':>10} {'range scan p50':>16} {'VM steps':>10}")
+        for count in [int(size) for size in args.sizes.split(",")]:
+            add_bookings(connection, count)
+            ranges = list(probes(count))
+            if not check_same_answers(connection, ranges[:100], count):
+                sys.exit(1)
+            check_p50, check_steps = measure(connection, lambda_function.OVERLAPPING_LEAVE_QUERY, ranges)
+            naive_p50, naive_steps = measure(connection, NAIVE_OVERLAP_QUERY, ranges)
+            print(f"{count:>10} {check_p50:16.1f}us {check_steps:10.0f} {naive_p50:14.1f}us {naive_steps:10.0f}")
+        connection.close()
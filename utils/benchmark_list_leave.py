@@ -0,0 +1,175 @@
+# Shows what paging does for list_leave as one employee's booking history grows. For each size it checks that walking
+# every page (with and without a date range) returns exactly the bookings of a plain query, also for a range only a
+# long booking overlapping the short ones covers (older data can hold such bookings), then compares fetching the
+# whole history (what list_leave used to return) with fetching one page at the start, middle and end of the history
+# with the keyset cursor, and with LIMIT/OFFSET paging, which has to step over every row before the page, and a page of
+# a date range in the middle and at the end.
+# Reports the p50 time, the SQLite VM steps (which grow with the rows examined) and the size of the JSON response.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-s", "--sizes", required=False, type=str, default="100,10000,1000000", help="Comma separated booking counts for the employee")
+parser.add_argument("-n", "--iterations", required=False, type=int, default=50, help="Timed calls per measurement")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and benchmark against")
+args = parser.parse_args()
+
+EMPLOYEE_ID = 1
+FIRST_DATE = date(2030, 1, 1)
+# Every booking is one day long with a free day after it
+BOOKING_STRIDE = 2
+# Days of the long booking put over the short ones in the middle of the history
+LONG_BOOKING_DAYS = 40
+PAGE_SIZE = lambda_function.LIST_LEAVE_LIMIT
+
+FULL_HISTORY_QUERY = """
+    SELECT vacation_start_date, vacation_end_date, vacation_days_taken
+    FROM planned_vacations
+    WHERE employee_id = ?
+"""
+OFFSET_PAGE_QUERY = """
+    SELECT request_id, vacation_start_date, vacation_end_date, vacation_days_taken
+    FROM planned_vacations
+    WHERE employee_id = ?
+    ORDER BY vacation_start_date, request_id
+    LIMIT ? OFFSET ?
+"""
+
+
+def long_booking_start(count):
+    """The first day of the long booking, on a short booking in the middle of the history."""
+    return FIRST_DATE + timedelta(days=count // 2 * BOOKING_STRIDE)
+
+
+def add_bookings(connection, count):
+    """Replaces the employee's bookings with count single-day bookings from FIRST_DATE on, and one LONG_BOOKING_DAYS
+    long booking over the short ones in the middle."""
+    connection.execute("DELETE FROM planned_vacations WHERE employee_id = ?", (EMPLOYEE_ID,))
+    days = (str(FIRST_DATE + timedelta(days=i * BOOKING_STRIDE)) for i in range(count))
+    connection.executemany(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, 1)",
+        ((EMPLOYEE_ID, day, day) for day in days),
+    )
+    start = long_booking_start(count)
+    connection.execute(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)",
+        (EMPLOYEE_ID, str(start), str(start + timedelta(days=LONG_BOOKING_DAYS - 1)), LONG_BOOKING_DAYS),
+    )
+    connection.commit()
+
+
+def walk_pages(limit, **filters):
+    """Every booking list_leave returns when following next_cursor to the end."""
+    bookings, cursor = [], None
+    while True:
+        page = lambda_function.list_leave(EMPLOYEE_ID, cursor=cursor, limit=limit, **filters)
+        if "error" in page:
+            raise Exception(page["error"])
+        bookings += [(row["start_date"], row["end_date"]) for row in page["leave_requests"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return bookings
+
+
+def check_pages(connection, count):
+    """True if walking the pages gives the same bookings as a plain query, for the whole history and a date range."""
+    everything = sorted(row[:2] for row in connection.execute(FULL_HISTORY_QUERY, (EMPLOYEE_ID,)))
+    start = str(FIRST_DATE + timedelta(days=random.randrange(count * BOOKING_STRIDE)))
+    end = str(date.fromisoformat(start) + timedelta(days=min(count, 500)))
+    in_range = [row for row in everything if row[1] >= start and row[0] <= end]
+    limit = max(1, min(lambda_function.LIST_LEAVE_MAX_LIMIT, count // 7))
+    if walk_pages(limit) != everything:
+        print(f"FAIL: the pages of {count} bookings do not add up to the whole history")
+        return False
+    if walk_pages(limit, start_date=start, end_date=end) != in_range:
+        print(f"FAIL: the pages of {count} bookings from {start} to {end} do not match a plain filter")
+        return False
+    # Odd days late in the long booking, which only it covers
+    start = str(long_booking_start(count) + timedelta(days=LONG_BOOKING_DAYS - 5))
+    end = str(long_booking_start(count) + timedelta(days=LONG_BOOKING_DAYS - 3))
+    in_range = [row for row in everything if row[1] >= start and row[0] <= end]
+    if walk_pages(limit, start_date=start, end_date=end) != in_range:
+        print(f"FAIL: the pages of {count} bookings from {start} to {end} miss the long booking")
+        return False
+    return True
+
+
+def measure(connection, function):
+    """Returns (p50 in microseconds, VM steps for one call, JSON size of the result) for calling function."""
+    timings = []
+    for _ in range(args.iterations):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    steps = [0]
+
+    def count_step():
+        steps[0] += 1
+        return 0
+
+    connection.set_progress_handler(count_step, 1)
+    function()
+    connection.set_progress_handler(None, 1)
+    return timings[len(timings) // 2] * 1e6, steps[0], len(json.dumps(result))
+
+
+def as_response(rows):
+    """The bookings as list_leave returns them, for the response size."""
+    return [{"start_date": row[-3], "end_date": row[-2], "days of vacation": row[-1]} for row in rows]
+
+
+def list_leave_page(connection, position):
+    """A function fetching the keyset page that starts at the position'th booking."""
+    cursor = None
+    if position:
+        # The cursor list_leave would have handed out for the page before
+        day = str(FIRST_DATE + timedelta(days=(position - 1) * BOOKING_STRIDE))
+        request_id = connection.execute(
+            "SELECT request_id FROM planned_vacations WHERE employee_id = ? AND vacation_start_date = ?", (EMPLOYEE_ID, day)
+        ).fetchone()[0]
+        cursor = lambda_function.encode_leave_cursor(day, request_id)
+    return lambda: lambda_function.list_leave(EMPLOYEE_ID, cursor=cursor)
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.ERROR)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, db_path)
+        lambda_function.DB_PATH = db_path
+        print(f"{'bookings':>10} {'request':<26} {'p50':>12} {'VM steps':>10} {'response':>12}")
+        for count in [int(size) for size in args.sizes.split(",")]:
+            # The lambda's own connection, so the progress handler counts the queries it runs
+            connection = lambda_function.create_db_connection()
+            add_bookings(connection, count)
+            if not check_pages(connection, count):
+                failed = True
+                break
+            requests_to_time = [
+                ("whole history", lambda: as_response(connection.execute(FULL_HISTORY_QUERY, (EMPLOYEE_ID,)))),
+            ]
+            for label, position in (("first", 0), ("middle", count // 2), ("last", max(0, count - PAGE_SIZE))):
+                requests_to_time.append((f"keyset page, {label}", list_leave_page(connection, position)))
+                requests_to_time.append((f"offset page, {label}", lambda position=position: as_response(connection.execute(OFFSET_PAGE_QUERY, (EMPLOYEE_ID, PAGE_SIZE + 1, position)))))
+            # A date range costs a seek over the bookings ending after it starts, so it grows with the history after it
+            for label, position in (("middle", count // 2), ("last", max(0, count - PAGE_SIZE))):
+                start = str(FIRST_DATE + timedelta(days=position * BOOKING_STRIDE))
+                end = str(FIRST_DATE + timedelta(days=(position + PAGE_SIZE) * BOOKING_STRIDE))
+                requests_to_time.append((f"date range page, {label}", lambda start=start, end=end: lambda_function.list_leave(EMPLOYEE_ID, start, end)))
+            for label, function in requests_to_time:
+                p50, steps, size = measure(connection, function)
+                print(f"{count:>10} {label:<26} {p50:10.1f}us {steps:10} {size:>11}B")
+        lambda_function.close_db_connection()
+    sys.exit(1 if failed else 0)
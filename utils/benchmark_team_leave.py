@@ -0,0 +1,169 @@
+# Checks employees_on_leave() on a copy of the database filled with synthetic bookings (1M by default): the range query
+# and the in-memory interval index (TEAM_LEAVE_INDEX=on) must find the same bookings as a plain Python filter, and the
+# index must follow book_leave and cancel_leave. Then compares the p50 time to answer "who is off next week" with the
+# range query, with the index, and with the old route of calling list_leave once per employee and filtering.
+# Exits with status 1 if any check fails.
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-b", "--bookings", required=False, type=int, default=1000000, help="Synthetic bookings to add")
+parser.add_argument("-e", "--employees", required=False, type=int, default=10000, help="Synthetic employees the bookings belong to")
+parser.add_argument("-n", "--iterations", required=False, type=int, default=50, help="Questions per approach")
+parser.add_argument("-l", "--list-leave-employees", required=False, type=int, default=1000, help="Employees the list_leave baseline asks about (it is timed per employee and scaled up)")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and benchmark against")
+args = parser.parse_args()
+
+FIRST_DATE = date(2020, 1, 1)
+# Bookings are spread over this many days, about 14 years
+SPAN_DAYS = 5000
+FIRST_EMPLOYEE_ID = 1000
+
+
+def fill_database(db_path):
+    """Adds the synthetic employees and bookings, returns every booking as (request_id, employee_id, start, end)."""
+    connection = sqlite3.connect(db_path)
+    lambda_function.migrate_database(connection)
+    employee_ids = range(FIRST_EMPLOYEE_ID, FIRST_EMPLOYEE_ID + args.employees)
+    connection.executemany(
+        "INSERT INTO employees (employee_id, employee_name) VALUES (?, ?)",
+        ((employee_id, f"Employee {employee_id}") for employee_id in employee_ids),
+    )
+
+    def synthetic_bookings():
+        for _ in range(args.bookings):
+            start = FIRST_DATE + timedelta(days=random.randrange(SPAN_DAYS))
+            days = random.choice((1, 1, 2, 3, 5, 5, 10, 15))
+            yield (random.choice(employee_ids), str(start), str(start + timedelta(days=days - 1)), days)
+
+    connection.executemany(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)",
+        synthetic_bookings(),
+    )
+    connection.commit()
+    bookings = connection.execute("SELECT request_id, employee_id, vacation_start_date, vacation_end_date FROM planned_vacations").fetchall()
+    connection.close()
+    return bookings
+
+
+def questions():
+    """Random week-long ranges inside the booked span, like "who is off next week"."""
+    ranges = []
+    for _ in range(args.iterations):
+        start = FIRST_DATE + timedelta(days=random.randrange(SPAN_DAYS))
+        ranges.append((str(start), str(start + timedelta(days=6))))
+    return ranges
+
+
+def found_bookings(result):
+    """The (employee_id, start, end) of every booking in an employees_on_leave result, sorted."""
+    return sorted((row["employee_id"], row["start_date"], row["end_date"]) for row in result["employees_on_leave"])
+
+
+def check_answers(bookings, ranges, label):
+    """True if employees_on_leave finds the bookings a plain Python filter finds for every range."""
+    for start, end in ranges:
+        expected = sorted((row[1], row[2], row[3]) for row in bookings if row[3] >= start and row[2] <= end)
+        result = lambda_function.employees_on_leave(start, end)
+        if "error" in result or found_bookings(result) != expected:
+            print(f"FAIL: {label} disagrees with a plain filter for {start} to {end}")
+            return False
+    print(f"OK: {label} matches a plain filter for {len(ranges)} ranges")
+    return True
+
+
+def check_incremental():
+    """True if the interval index picks up a booking from book_leave and drops it after cancel_leave."""
+    # book_leave opens the leave year with the default entitlement
+    employee_id = FIRST_EMPLOYEE_ID
+    # A Monday after every synthetic booking, so it cannot overlap one
+    leave_date = FIRST_DATE + timedelta(days=SPAN_DAYS + 30)
+    leave_date = str(leave_date + timedelta(days=-leave_date.weekday()))
+    before = len(lambda_function.team_leave_index(lambda_function.create_db_connection(readonly=True)))
+    booked = lambda_function.book_leave(employee_id, leave_date, leave_date)
+    on_leave = found_bookings(lambda_function.employees_on_leave(leave_date))
+    cancelled = lambda_function.cancel_leave(employee_id, leave_date)
+    after = found_bookings(lambda_function.employees_on_leave(leave_date))
+    index_size = len(lambda_function._team_leave_index)
+    if "error" in booked or "error" in cancelled or on_leave != [(employee_id, leave_date, leave_date)] or after or index_size != before:
+        print(f"FAIL: the interval index did not follow book_leave and cancel_leave ({booked}, {on_leave}, {cancelled}, {after})")
+        return False
+    print("OK: the interval index follows book_leave and cancel_leave")
+    return True
+
+
+def p50(function, ranges):
+    """The median time in milliseconds to call function on each range."""
+    timings = []
+    for start, end in ranges:
+        started = time.perf_counter()
+        function(start, end)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e3
+
+
+def list_leave_everyone(start, end, employee_ids):
+    """The old route: list_leave for each employee, asking for the bookings in the range page by page."""
+    on_leave = []
+    for employee_id in employee_ids:
+        cursor = None
+        while True:
+            page = lambda_function.list_leave(employee_id, start, end, cursor=cursor, limit=lambda_function.LIST_LEAVE_MAX_LIMIT)
+            on_leave += [(employee_id, booking) for booking in page["leave_requests"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+    return on_leave
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.ERROR)
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, db_path)
+        started = time.perf_counter()
+        bookings = fill_database(db_path)
+        print(f"Added {args.bookings} bookings for {args.employees} employees in {time.perf_counter() - started:.1f}s")
+        lambda_function.DB_PATH = db_path
+        ranges = questions()
+
+        connection = sqlite3.connect(db_path)
+        plan = connection.execute(f"EXPLAIN QUERY PLAN {lambda_function.EMPLOYEES_ON_LEAVE_QUERY}", {"start_date": ranges[0][0], "end_date": ranges[0][1]}).fetchall()
+        print("Range query plan: " + "; ".join(row[3] for row in plan))
+        connection.close()
+
+        lambda_function.TEAM_LEAVE_INDEX_ENABLED = False
+        failed = not check_answers(bookings, ranges[:10], "the range query")
+        query_p50 = p50(lambda_function.employees_on_leave, ranges)
+
+        lambda_function.TEAM_LEAVE_INDEX_ENABLED = True
+        started = time.perf_counter()
+        lambda_function.team_leave_index(lambda_function.create_db_connection(readonly=True))
+        build = time.perf_counter() - started
+        failed = not check_answers(bookings, ranges[:10], "the interval index") or failed
+        index_p50 = p50(lambda_function.employees_on_leave, ranges)
+        failed = not check_incremental() or failed
+        del bookings
+
+        sample = range(FIRST_EMPLOYEE_ID, FIRST_EMPLOYEE_ID + min(args.list_leave_employees, args.employees))
+        baseline_p50 = p50(lambda lo, hi: list_leave_everyone(lo, hi, sample), ranges[:3]) * args.employees / len(sample)
+        lambda_function.close_db_connection()
+
+    print(f"Interval index built in {build * 1e3:.0f}ms")
+    print(f"{'approach':<30} {'p50 per question':>18}")
+    print(f"{'list_leave per employee':<30} {baseline_p50:16.1f}ms  (timed for {len(sample)} employees, scaled to {args.employees})")
+    print(f"{'range query':<30} {query_p50:16.1f}ms")
+    print(f"{'interval index':<30} {index_p50:16.1f}ms")
+    sys.exit(1 if failed else 0)
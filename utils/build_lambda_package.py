@@ -0,0 +1,186 @@
+# Builds a pruned, precompiled deployment package for the lambda function.
+# Only the vendored modules reachable from lambda_function are kept (dist-info, bin/, __pycache__, unused modules
+# such as the emscripten and socks contrib modules and native extensions built for another platform are dropped), the database is migrated to the latest schema, .pyc
+# files are compiled ahead of time for the Lambda runtime, and the size and cold-start import time are compared
+# against zipping the lambda directory as-is.
+# Point terraform at the output with lambda_source_dir = "./build/lambda".
+import os
+import sys
+import shutil
+import sqlite3
+import zipfile
+import argparse
+import tempfile
+import compileall
+import statistics
+import subprocess
+import py_compile
+import modulefinder
+
+# Modules that are only imported behind a platform check or an ImportError guard, and whose own dependencies
+# (pyodide, PySocks, pyOpenSSL) are not vendored
+DEFAULT_EXCLUDES = [
+    "urllib3.contrib.emscripten",
+    "urllib3.contrib.socks",
+    "urllib3.contrib.pyopenssl",
+]
+# Files that are not Python modules but are needed at runtime
+DEFAULT_INCLUDES = ["employee_database.db"]
+# Package data that is never needed at runtime
+SKIPPED_DATA_FILES = {"py.typed"}
+# Native extension files. Only the ones built for the Lambda runtime are packaged, vendored wheels can carry builds for
+# other platforms (charset_normalizer's darwin mypyc modules) that would only be dead weight next to the .py fallback.
+NATIVE_EXTENSION_SUFFIXES = (".so", ".pyd", ".dylib")
+# Lambda architecture -> the machine name in CPython's extension suffix
+LAMBDA_MACHINES = {"x86_64": "x86_64", "arm64": "aarch64"}
+# Fixed timestamp for the zip entries so the same inputs always give the same zip (and source_code_hash)
+ZIP_DATE_TIME = (2020, 1, 1, 0, 0, 0)
+
+
+def find_reachable_modules(source_dir, handler_module, excludes):
+    """Returns {module name: file} for every module under source_dir reachable from the handler module, including
+    imports made inside functions (the lazy requests import)."""
+    source_dir = os.path.abspath(source_dir)
+    finder = modulefinder.ModuleFinder(path=[source_dir] + sys.path[1:], excludes=excludes)
+    finder.run_script(os.path.join(source_dir, f"{handler_module}.py"))
+    reachable = {}
+    for name, module in finder.modules.items():
+        path = module.__file__
+        if path and os.path.abspath(path).startswith(source_dir + os.sep):
+            reachable[handler_module if name == "__main__" else name] = os.path.abspath(path)
+    return reachable
+
+
+def loads_on_runtime(name, python_version, architecture):
+    """True if a native extension file can be imported by the Lambda runtime: built for its CPython version and
+    machine, for the stable ABI, or untagged."""
+    if not name.endswith(".so"):
+        return False
+    tag = f".cpython-{python_version.replace('.', '')}-{LAMBDA_MACHINES[architecture]}-linux-gnu.so"
+    return name.endswith((tag, ".abi3.so")) or name.count(".") == 1
+
+
+def copy_package(source_dir, build_dir, reachable, includes, python_version, architecture):
+    """Copies the reachable modules, the data files of their packages and the extra includes into build_dir. Returns
+    (files copied, native extensions skipped as built for another platform)."""
+    source_dir = os.path.abspath(source_dir)
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    files = set(reachable.values())
+    skipped = []
+    for path in list(files):
+        if os.path.basename(path) == "__init__.py":
+            package_dir = os.path.dirname(path)
+            for entry in os.listdir(package_dir):
+                entry_path = os.path.join(package_dir, entry)
+                if not os.path.isfile(entry_path) or entry.endswith((".py", ".pyc")) or entry in SKIPPED_DATA_FILES:
+                    continue
+                if entry.endswith(NATIVE_EXTENSION_SUFFIXES) and not loads_on_runtime(entry, python_version, architecture):
+                    skipped.append(os.path.relpath(entry_path, source_dir))
+                    continue
+                files.add(entry_path)
+    for include in includes:
+        files.add(os.path.join(source_dir, include))
+    for path in sorted(files):
+        target = os.path.join(build_dir, os.path.relpath(path, source_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(path, target)
+    return len(files), sorted(skipped)
+
+
+def migrate_bundled_database(source_dir, build_dir, handler_module):
+    """Brings the packaged database up to the latest schema, so the function can read it in place (immutable)
+    instead of copying it to /tmp to migrate it at cold start."""
+    sys.path.insert(0, os.path.abspath(source_dir))
+    handler = __import__(handler_module)
+    connection = sqlite3.connect(os.path.join(build_dir, os.path.basename(handler.BUNDLED_DB_PATH)))
+    try:
+        return handler.migrate_database(connection)
+    finally:
+        connection.close()
+
+
+def precompile(build_dir, python_version):
+    """Compiles every module to __pycache__ with unchecked hash based pycs, so the runtime loads them without
+    checking source timestamps. Only possible when this interpreter matches the Lambda runtime version."""
+    running = f"{sys.version_info.major}.{sys.version_info.minor}"
+    if running != python_version:
+        print(f"WARNING: running Python {running} but the Lambda runtime is {python_version}, skipping precompile")
+        return False
+    return compileall.compile_dir(build_dir, quiet=1, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+
+def zip_directory(directory, output_path):
+    """Zips a directory the way archive_file does, returns (size in bytes, number of files)."""
+    count = 0
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                info = zipfile.ZipInfo(os.path.relpath(path, directory), ZIP_DATE_TIME)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                with open(path, "rb") as file:
+                    archive.writestr(info, file.read())
+                count += 1
+    return os.path.getsize(output_path), count
+
+
+def measure_cold_start(zip_path, handler_module, runs):
+    """Extracts the zip and times importing the handler module and then the requests stack in fresh interpreters.
+    Bytecode writing is disabled, like on Lambda's read-only /var/task. Returns the median (init, requests) in ms."""
+    script = (
+        "import time; t = time.perf_counter(); "
+        f"import {handler_module} as handler; t1 = time.perf_counter(); "
+        "handler.load_requests(); t2 = time.perf_counter(); "
+        "print((t1 - t) * 1e3, (t2 - t1) * 1e3)"
+    )
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", IMPORT_PROFILE="off")
+    init_times, requests_times = [], []
+    with tempfile.TemporaryDirectory() as extract_dir:
+        with zipfile.ZipFile(zip_path) as archive:
+            archive.extractall(extract_dir)
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, "-c", script], cwd=extract_dir, env=env, capture_output=True, text=True, check=True)
+            init_ms, requests_ms = map(float, result.stdout.split()[-2:])
+            init_times.append(init_ms)
+            requests_times.append(requests_ms)
+    return statistics.median(init_times), statistics.median(requests_times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--source", required=False, type=str, default="lambda", help="Lambda source directory")
+    parser.add_argument("-b", "--build", required=False, type=str, default="build/lambda", help="Directory to write the pruned package to")
+    parser.add_argument("-o", "--output", required=False, type=str, default="build/lambda_function_payload.zip", help="Zip file to write")
+    parser.add_argument("-m", "--handler-module", required=False, type=str, default="lambda_function", help="Module containing lambda_handler")
+    parser.add_argument("-p", "--python-version", required=False, type=str, default="3.12", help="Python version of the Lambda runtime")
+    parser.add_argument("-a", "--architecture", required=False, choices=sorted(LAMBDA_MACHINES), default="x86_64", help="Instruction set of the Lambda function")
+    parser.add_argument("-x", "--exclude", required=False, action="append", default=[], help="Extra module to drop (repeatable)")
+    parser.add_argument("-r", "--runs", required=False, type=int, default=5, help="Cold-start measurements per package, 0 to skip")
+    args = parser.parse_args()
+
+    reachable = find_reachable_modules(args.source, args.handler_module, DEFAULT_EXCLUDES + args.exclude)
+    copied, skipped = copy_package(args.source, args.build, reachable, DEFAULT_INCLUDES, args.python_version, args.architecture)
+    print(f"{len(reachable)} reachable modules, {copied} files copied to {args.build}")
+    for path in skipped:
+        print(f"  skipped {path}, not built for python{args.python_version} on Linux {args.architecture}")
+    print(f"Packaged database at schema version {migrate_bundled_database(args.source, args.build, args.handler_module)}")
+    compiled = precompile(args.build, args.python_version)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    size, count = zip_directory(args.build, args.output)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # The current deployment: the whole lambda directory as archive_file zips it
+        baseline_zip = os.path.join(tmpdir, "baseline.zip")
+        baseline_size, baseline_count = zip_directory(args.source, baseline_zip)
+        print(f"{'':<10} {'files':>7} {'zip size':>12}")
+        print(f"{'current':<10} {baseline_count:>7} {baseline_size / 1024:>10.1f}KB")
+        print(f"{'pruned':<10} {count:>7} {size / 1024:>10.1f}KB  ({(size - baseline_size) / baseline_size:+.0%}){'  precompiled' if compiled else ''}")
+        if args.runs:
+            baseline_init, baseline_requests = measure_cold_start(baseline_zip, args.handler_module, args.runs)
+            init, requests_ms = measure_cold_start(args.output, args.handler_module, args.runs)
+            print(f"cold start (median of {args.runs}): init {baseline_init:.1f}ms -> {init:.1f}ms, "
+                  f"requests import {baseline_requests:.1f}ms -> {requests_ms:.1f}ms")
+    print(f"Wrote {args.output}")
@@ -0,0 +1,83 @@
+# Streams the employees, leave balances (vacations) or bookings (planned_vacations) out of the database as CSV or JSONL,
+# fetchmany batches at a time so memory stays flat however big the table is. The columns are the ones
+# utils/bulk_import.py reads, so an export loads back in (bookings get new request_ids).
+import sys
+import csv
+import json
+import time
+import sqlite3
+import argparse
+from urllib.parse import quote
+
+BATCH_SIZE = 10000
+
+EXPORT_QUERIES = {
+    "employees": """
+        SELECT employee_id, employee_name, employee_dob, employee_homepage, employee_job_title, employee_start_date,
+               employee_employment_status, employee_calendar
+        FROM employees ORDER BY employee_id
+    """,
+    "vacations": """
+        SELECT employee_id, year, employee_total_vacation_days, employee_vacation_days_taken,
+               employee_vacation_days_available, employee_carried_over_days
+        FROM vacations ORDER BY employee_id, year
+    """,
+    "planned_vacations": """
+        SELECT request_id, employee_id, vacation_start_date, vacation_end_date, vacation_days_taken
+        FROM planned_vacations ORDER BY request_id
+    """,
+}
+
+
+def export_rows(connection, table, batch_size=BATCH_SIZE):
+    """Yields the column names, then each batch of rows of the table."""
+    cursor = connection.execute(EXPORT_QUERIES[table])
+    yield [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def write_export(connection, table, file, file_format="csv", batch_size=BATCH_SIZE):
+    """Writes the table to an open text file, returns the number of rows written."""
+    batches = export_rows(connection, table, batch_size)
+    columns = next(batches)
+    written = 0
+    if file_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            written += len(rows)
+    else:
+        for rows in batches:
+            file.write("".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows))
+            written += len(rows)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("table", choices=["employees", "vacations", "bookings"], help="What to export")
+    parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to export from")
+    parser.add_argument("-o", "--output", required=False, type=str, help="File to write, stdout if not given")
+    parser.add_argument("--format", required=False, choices=["csv", "jsonl"], help="File format, by default from the output file extension (CSV for stdout)")
+    parser.add_argument("-b", "--batch-size", required=False, type=int, default=BATCH_SIZE, help="Rows per fetchmany batch")
+    args = parser.parse_args()
+
+    table = "planned_vacations" if args.table == "bookings" else args.table
+    file_format = args.format or ("jsonl" if args.output and args.output.endswith((".jsonl", ".json")) else "csv")
+    # Read-only, so an export can run next to the lambda or a load
+    connection = sqlite3.connect(f"file:{quote(args.database)}?mode=ro", uri=True)
+    started = time.perf_counter()
+    try:
+        if args.output:
+            with open(args.output, "w", newline="", encoding="utf-8") as file:
+                written = write_export(connection, table, file, file_format, args.batch_size)
+            print(f"Exported {written} {args.table} rows to {args.output} in {time.perf_counter() - started:.1f}s")
+        else:
+            write_export(connection, table, sys.stdout, file_format, args.batch_size)
+    finally:
+        connection.close()
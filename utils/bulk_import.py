@@ -0,0 +1,396 @@
+# Bulk loads employees, leave balances and bookings from CSV (with a header line) or JSONL files, for onboarding a
+# region in one go rather than one book_leave call per booking. Files are streamed, never read into memory whole.
+# The columns are the database's own (see utils/bulk_export.py, its output loads back in). Each row is checked as it
+# is read (types, dates, required columns), the good ones are staged in batches with executemany, and the checks that
+# need the database (unknown employees, duplicates, overlapping bookings) run as set-based queries on the staged rows.
+# Everything is one transaction: either every good row is loaded or, with --dry-run or on an error, nothing is.
+# Rejected rows are listed with their line number and reason in the --errors report.
+# Bookings are loaded as they are, they do not change the balances (load those from the vacations file). A booking
+# without vacation_days_taken gets the working days in the employee's calendar.
+import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import date
+from functools import lru_cache
+sys.path.append('./lambda')
+import lambda_function
+
+BATCH_SIZE = 10000
+# Page cache for the load, negative is in KiB so 256MB
+LOAD_CACHE_SIZE = -262144
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def integer(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not a whole number: {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"not a whole number: {value!r}")
+
+
+def day(value):
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"not a YYYY-MM-DD date: {value!r}")
+    return parse_day(value)
+
+
+# Files repeat the same dates over and over, so the parsed ones are cached
+@lru_cache(maxsize=65536)
+def parse_day(value):
+    try:
+        if not DATE_PATTERN.fullmatch(value):
+            raise ValueError
+        return str(date.fromisoformat(value))
+    except ValueError:
+        raise ValueError(f"not a YYYY-MM-DD date: {value!r}")
+
+
+def text(value):
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def check_employee(row):
+    if row["employee_dob"] and row["employee_start_date"] and row["employee_start_date"] < row["employee_dob"]:
+        raise ValueError("employee_start_date is before employee_dob")
+
+
+def check_vacation(row):
+    for column in ("employee_total_vacation_days", "employee_vacation_days_taken", "employee_carried_over_days"):
+        if row[column] is not None and row[column] < 0:
+            raise ValueError(f"{column} is negative")
+    if row["employee_vacation_days_taken"] is None:
+        row["employee_vacation_days_taken"] = 0
+    if row["employee_carried_over_days"] is None:
+        row["employee_carried_over_days"] = 0
+    if row["employee_vacation_days_available"] is None:
+        row["employee_vacation_days_available"] = row["employee_total_vacation_days"] - row["employee_vacation_days_taken"]
+
+
+def check_booking(row):
+    if row["vacation_end_date"] < row["vacation_start_date"]:
+        raise ValueError("vacation_end_date is before vacation_start_date")
+    if row["vacation_days_taken"] is not None and row["vacation_days_taken"] < 0:
+        raise ValueError("vacation_days_taken is negative")
+
+
+# The set-based checks, each one returns (line, reason) for the staged rows it rejects. A check is a query, or a
+# function of the connection for one that needs more than a query. They run in order, so a check can leave out the
+# rows an earlier one rejected.
+EMPLOYEE_CHECKS = [
+    """SELECT s.line, 'employee_id appears earlier in the file' FROM staged s
+       WHERE s.employee_id IS NOT NULL AND EXISTS (SELECT 1 FROM staged t WHERE t.employee_id = s.employee_id AND t.line < s.line)""",
+    """SELECT s.line, 'employee_id already exists' FROM staged s JOIN employees e ON e.employee_id = s.employee_id""",
+    """SELECT s.line, 'unknown employee_calendar ' || s.employee_calendar FROM staged s
+       WHERE s.employee_calendar IS NOT NULL AND s.employee_calendar NOT IN (SELECT calendar FROM leave_calendars)""",
+]
+VACATION_CHECKS = [
+    """SELECT s.line, 'unknown employee_id' FROM staged s WHERE NOT EXISTS (SELECT 1 FROM employees e WHERE e.employee_id = s.employee_id)""",
+    """SELECT s.line, 'employee_id and year appear earlier in the file' FROM staged s
+       WHERE EXISTS (SELECT 1 FROM staged t WHERE t.employee_id = s.employee_id AND t.year = s.year AND t.line < s.line)""",
+]
+
+# An employee's bookings in the database and the staged ones not already rejected, sorted by start date. The database's
+# bookings sort first on equal start dates, so a clash rejects the new one.
+_EMPLOYEE_BOOKINGS = """
+    SELECT employee_id, vacation_start_date, vacation_end_date, NULL AS line FROM planned_vacations
+    WHERE employee_id IN ({employees})
+    UNION ALL
+    SELECT employee_id, vacation_start_date, vacation_end_date, line FROM staged
+    WHERE employee_id IN ({employees}) AND line NOT IN (SELECT line FROM rejected)
+"""
+# Sorted by start date, a booking overlaps an earlier one when one of them ends on or after its start. The employees
+# with such a clash, found in one pass with a window over every staged employee.
+OVERLAP_CANDIDATES = f"""
+    SELECT DISTINCT employee_id FROM (
+        SELECT employee_id, line, vacation_start_date,
+               MAX(vacation_end_date) OVER (PARTITION BY employee_id ORDER BY vacation_start_date, line NULLS FIRST
+                                            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS previous_end
+        FROM ({_EMPLOYEE_BOOKINGS.format(employees="SELECT DISTINCT employee_id FROM staged")})
+    )
+    WHERE line IS NOT NULL AND previous_end >= vacation_start_date
+"""
+OVERLAP_EMPLOYEE_BOOKINGS = _EMPLOYEE_BOOKINGS.format(employees="?") + " ORDER BY vacation_start_date, line NULLS FIRST"
+
+
+def overlapping_bookings(connection):
+    """The staged bookings that overlap a booking in the database or one loaded before them from the file. The window
+    finds the employees with a clash, their bookings are then walked in start order keeping the latest end of the ones
+    that stay, so a rejected booking does not get the ones after it rejected too."""
+    rejected = []
+    for (employee_id,) in connection.execute(OVERLAP_CANDIDATES).fetchall():
+        kept_end = None
+        for _, start, end, line in connection.execute(OVERLAP_EMPLOYEE_BOOKINGS, (employee_id, employee_id)):
+            if line is not None and kept_end is not None and kept_end >= start:
+                rejected.append((line, "overlaps another booking of the employee"))
+            elif kept_end is None or end > kept_end:
+                kept_end = end
+    return rejected
+
+
+BOOKING_CHECKS = [
+    """SELECT s.line, 'unknown employee_id' FROM staged s WHERE NOT EXISTS (SELECT 1 FROM employees e WHERE e.employee_id = s.employee_id)""",
+    overlapping_bookings,
+]
+
+# table -> (columns with (name, parser, required), row check, staging indexes, set-based checks, insert statement)
+TABLES = {
+    "employees": (
+        [
+            ("employee_id", integer, False),
+            ("employee_name", text, True),
+            ("employee_dob", day, False),
+            ("employee_homepage", text, False),
+            ("employee_job_title", text, False),
+            ("employee_start_date", day, False),
+            ("employee_employment_status", text, False),
+            ("employee_calendar", text, False),
+        ],
+        check_employee,
+        ["employee_id"],
+        EMPLOYEE_CHECKS,
+        """INSERT INTO employees (employee_id, employee_name, employee_dob, employee_homepage, employee_job_title,
+                                  employee_start_date, employee_employment_status, employee_calendar)
+           SELECT employee_id, employee_name, employee_dob, employee_homepage, employee_job_title,
+                  employee_start_date, employee_employment_status, COALESCE(employee_calendar, 'default')
+           FROM staged WHERE line NOT IN (SELECT line FROM rejected) ORDER BY line""",
+    ),
+    "vacations": (
+        [
+            ("employee_id", integer, True),
+            ("year", integer, True),
+            ("employee_total_vacation_days", integer, True),
+            ("employee_vacation_days_taken", integer, False),
+            ("employee_vacation_days_available", integer, False),
+            ("employee_carried_over_days", integer, False),
+        ],
+        check_vacation,
+        ["employee_id, year"],
+        VACATION_CHECKS,
+        # A year the employee already has is replaced by the file's balances
+        """INSERT INTO vacations (employee_id, year, employee_total_vacation_days, employee_vacation_days_taken,
+                                  employee_vacation_days_available, employee_carried_over_days)
+           SELECT employee_id, year, employee_total_vacation_days, employee_vacation_days_taken,
+                  employee_vacation_days_available, employee_carried_over_days
+           FROM staged WHERE line NOT IN (SELECT line FROM rejected) ORDER BY employee_id, year
+           ON CONFLICT (employee_id, year) DO UPDATE SET
+               employee_total_vacation_days = excluded.employee_total_vacation_days,
+               employee_vacation_days_taken = excluded.employee_vacation_days_taken,
+               employee_vacation_days_available = excluded.employee_vacation_days_available,
+               employee_carried_over_days = excluded.employee_carried_over_days""",
+    ),
+    "planned_vacations": (
+        [
+            ("employee_id", integer, True),
+            ("vacation_start_date", day, True),
+            ("vacation_end_date", day, True),
+            ("vacation_days_taken", integer, False),
+        ],
+        check_booking,
+        ["employee_id"],
+        BOOKING_CHECKS,
+        """INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken)
+           SELECT employee_id, vacation_start_date, vacation_end_date, vacation_days_taken
+           FROM staged WHERE line NOT IN (SELECT line FROM rejected) ORDER BY employee_id, vacation_start_date""",
+    ),
+}
+# Loaded in this order, so a file's bookings can belong to employees from the same run
+LOAD_ORDER = ["employees", "vacations", "planned_vacations"]
+
+
+def read_rows(path, file_format=None):
+    """Yields (line number, row dict or None, error or None) from a CSV or JSONL file, one row at a time. The format
+    comes from the file extension unless given."""
+    file_format = file_format or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f"not valid JSON: {e}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, None, "not a JSON object"
+                    continue
+                yield line_number, row, None
+
+
+class BookingDays:
+    """Fills in vacation_days_taken for bookings that leave it out, from each employee's calendar."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.employee_calendars = None
+
+    def __call__(self, row):
+        if self.employee_calendars is None:
+            self.employee_calendars = dict(self.connection.execute("SELECT employee_id, employee_calendar FROM employees"))
+        calendar = lambda_function.load_leave_calendar(
+            self.connection, self.employee_calendars.get(row["employee_id"]) or lambda_function.DEFAULT_LEAVE_CALENDAR
+        )
+        return lambda_function.count_leave_days(row["vacation_start_date"], row["vacation_end_date"], calendar)
+
+
+def stage_rows(connection, table, path, file_format, errors, batch_size=BATCH_SIZE):
+    """Reads the file into the temp table staged, checking each row. Returns the number of rows read."""
+    columns, check_row, indexes, _, _ = TABLES[table]
+    names = [name for name, _, _ in columns]
+    connection.execute("DROP TABLE IF EXISTS temp.staged")
+    connection.execute(f"CREATE TEMP TABLE staged (line INTEGER PRIMARY KEY, {', '.join(names)})")
+    insert = f"INSERT INTO staged (line, {', '.join(names)}) VALUES (?{', ?' * len(names)})"
+    booking_days = BookingDays(connection) if table == "planned_vacations" else None
+    batch, read = [], 0
+    for line, raw, error in read_rows(path, file_format):
+        read += 1
+        if error:
+            errors.append((path, line, error))
+            continue
+        try:
+            row = {}
+            for name, parse, required in columns:
+                value = parse(raw.get(name))
+                if value is None and required:
+                    raise ValueError(f"{name} is missing")
+                row[name] = value
+            check_row(row)
+            if booking_days is not None and row["vacation_days_taken"] is None:
+                row["vacation_days_taken"] = booking_days(row)
+        except ValueError as e:
+            errors.append((path, line, str(e)))
+            continue
+        batch.append((line, *(row[name] for name in names)))
+        if len(batch) >= batch_size:
+            connection.executemany(insert, batch)
+            batch = []
+    if batch:
+        connection.executemany(insert, batch)
+    # Indexes for the checks, built once after the rows are in
+    for number, index_columns in enumerate(indexes):
+        connection.execute(f"CREATE INDEX temp.staged_{number} ON staged ({index_columns})")
+    return read
+
+
+def load_table(connection, table, path, file_format=None, batch_size=BATCH_SIZE):
+    """Loads one file into its table inside the caller's transaction. Returns (rows read, rows loaded, errors)."""
+    _, _, _, checks, insert = TABLES[table]
+    errors = []
+    read = stage_rows(connection, table, path, file_format, errors, batch_size)
+    connection.execute("DROP TABLE IF EXISTS temp.rejected")
+    connection.execute("CREATE TEMP TABLE rejected (line INTEGER PRIMARY KEY, reason TEXT)")
+    for check in checks:
+        if callable(check):
+            connection.executemany("INSERT OR IGNORE INTO rejected (line, reason) VALUES (?, ?)", check(connection))
+        else:
+            connection.execute(f"INSERT OR IGNORE INTO rejected (line, reason) {check}")
+    errors += [(path, line, reason) for line, reason in connection.execute("SELECT line, reason FROM rejected")]
+
+    # Per-row summary triggers cost more than a rebuild once the load is a good part of the table
+    rebuild_summary = False
+    if table == "planned_vacations":
+        staged = connection.execute("SELECT COUNT(*) FROM staged").fetchone()[0]
+        existing = connection.execute("SELECT MAX(request_id) FROM planned_vacations").fetchone()[0] or 0
+        rebuild_summary = staged > existing // 10
+    if rebuild_summary:
+        for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'planned_vacations_summary_%'").fetchall():
+            connection.execute(f"DROP TRIGGER {name}")
+    loaded = connection.execute(insert).rowcount
+    if rebuild_summary:
+        for statement in lambda_function.LEAVE_SUMMARY_FILL + lambda_function.LEAVE_SUMMARY_TRIGGERS:
+            connection.execute(statement)
+    connection.execute("DROP TABLE temp.staged")
+    connection.execute("DROP TABLE temp.rejected")
+    return read, loaded, sorted(errors, key=lambda error: error[1])
+
+
+def bulk_import(connection, files, file_format=None, batch_size=BATCH_SIZE, dry_run=False):
+    """Loads {table: path} in LOAD_ORDER in one transaction. Returns {table: (rows read, rows loaded, errors)}.
+    Pending schema migrations run in the same transaction, so a dry run leaves the schema as it was too."""
+    connection.execute(f"PRAGMA cache_size = {LOAD_CACHE_SIZE}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    results = {}
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        lambda_function.migrate_database(connection, in_transaction=True)
+        for table in LOAD_ORDER:
+            if files.get(table):
+                results[table] = load_table(connection, table, files[table], file_format, batch_size)
+        if dry_run:
+            connection.rollback()
+        else:
+            connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return results
+
+
+def write_error_report(path, results):
+    """Writes every rejected row as CSV (file, line, error)."""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["file", "line", "error"])
+        for _, _, errors in results.values():
+            writer.writerows(errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to load into")
+    parser.add_argument("--employees", required=False, type=str, help="CSV or JSONL file of employees")
+    parser.add_argument("--vacations", required=False, type=str, help="CSV or JSONL file of leave balances, one row per employee per leave year")
+    parser.add_argument("--bookings", required=False, type=str, help="CSV or JSONL file of planned_vacations bookings")
+    parser.add_argument("--format", required=False, choices=["csv", "jsonl"], help="File format, by default from the file extension")
+    parser.add_argument("-b", "--batch-size", required=False, type=int, default=BATCH_SIZE, help="Rows per executemany batch")
+    parser.add_argument("-e", "--errors", required=False, type=str, help="Write the rejected rows to this CSV file")
+    parser.add_argument("--dry-run", action="store_true", help="Check and load everything, then roll back")
+    args = parser.parse_args()
+
+    files = {"employees": args.employees, "vacations": args.vacations, "planned_vacations": args.bookings}
+    if not any(files.values()):
+        parser.error("give at least one of --employees, --vacations and --bookings")
+    lambda_function.logger.setLevel(logging.WARNING)
+    connection = sqlite3.connect(args.database)
+    # Not the lambda's PRAGMA profile: its WAL mode would stay set on the file (the default target is the bundled
+    # database that gets deployed), and one big transaction gains nothing from it. Wait for the lambda's writes.
+    connection.execute("PRAGMA busy_timeout = 5000")
+    try:
+        started = time.perf_counter()
+        results = bulk_import(connection, files, args.format, args.batch_size, args.dry_run)
+        elapsed = time.perf_counter() - started
+    finally:
+        connection.close()
+
+    rejected = 0
+    for table, (read, loaded, errors) in results.items():
+        rejected += len(errors)
+        print(f"{table:<18} {read:>9} rows read, {loaded:>9} loaded, {len(errors):>7} rejected")
+        for path, line, error in errors[:5]:
+            print(f"  {os.path.basename(path)} line {line}: {error}")
+        if len(errors) > 5:
+            print(f"  ... and {len(errors) - 5} more")
+    total = sum(read for read, _, _ in results.values())
+    print(f"{'rolled back' if args.dry_run else 'committed'} in {elapsed:.1f}s, {total / elapsed:.0f} rows/s")
+    if args.errors:
+        write_error_report(args.errors, results)
+        print(f"Rejected rows written to {args.errors}")
+    sys.exit(1 if rejected else 0)
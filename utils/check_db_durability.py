@@ -0,0 +1,163 @@
+# Kills a process that is booking and cancelling leave at random points (including mid-commit) and checks the database
+# afterwards, for each PRAGMA profile. After every kill the database must pass integrity_check, every booking or
+# cancellation the process reported as done must be there, at most the one in flight may also have landed, and the
+# days taken across the employee's leave years must match the bookings (the insert and the balance update commit
+# together or not at all).
+# Exits with status 1 if any check fails.
+import os
+import sys
+import time
+import signal
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-k", "--kills", required=False, type=int, default=50, help="Kills per profile")
+parser.add_argument("-m", "--max-delay", required=False, type=float, default=0.05, help="Longest time in seconds to let the process run before killing it")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and test against")
+parser.add_argument("-p", "--profiles", required=False, type=str, default="default,tuned", help="Comma separated PRAGMA profiles to test")
+args = parser.parse_args()
+
+EMPLOYEE_ID = 1
+STARTING_BALANCE = 1000000
+FIRST_DATE = date.today() + timedelta(days=1000)
+
+
+def operation(index):
+    """The index'th operation of the fixed sequence: two bookings on new days, then cancel the oldest one left."""
+    if index % 3 == 2:
+        return ("cancel", (FIRST_DATE + timedelta(days=(index // 3) * 2)).strftime('%Y-%m-%d'))
+    return ("book", (FIRST_DATE + timedelta(days=(index // 3) * 2 + index % 3)).strftime('%Y-%m-%d'))
+
+
+def expected_bookings(count):
+    """The set of booked start dates after the first count operations."""
+    booked = set()
+    for index in range(count):
+        action, leave_date = operation(index)
+        if action == "book":
+            booked.add(leave_date)
+        else:
+            booked.discard(leave_date)
+    return booked
+
+
+def run_operations(db_path, profile, start, done):
+    """Runs the operation sequence from start until killed, sending the index of each one after it commits."""
+    lambda_function.logger.setLevel(logging.ERROR)
+    lambda_function.DB_PATH = db_path
+    lambda_function.DB_PRAGMA_PROFILE = profile
+    # The leave years the bookings open need enough days for every one of them
+    lambda_function.LEAVE_ANNUAL_ENTITLEMENT = STARTING_BALANCE
+    index = start
+    while True:
+        action, leave_date = operation(index)
+        if action == "book":
+            result = lambda_function.book_leave(EMPLOYEE_ID, leave_date, leave_date)
+        else:
+            result = lambda_function.cancel_leave(EMPLOYEE_ID, leave_date)
+        if "error" in result:
+            done.send(("error", index, result["error"]))
+            return
+        done.send(("done", index, None))
+        index += 1
+
+
+def check_database(db_path, acknowledged):
+    """Checks the database after a kill, returns (number of operations applied, list of problems)."""
+    connection = sqlite3.connect(db_path)
+    try:
+        problems = []
+        integrity = connection.execute("PRAGMA integrity_check").fetchone()[0]
+        if integrity != "ok":
+            problems.append(f"integrity_check: {integrity}")
+        rows = connection.execute(
+            "SELECT vacation_start_date, vacation_days_taken FROM planned_vacations WHERE employee_id = ? AND vacation_start_date >= ?",
+            (EMPLOYEE_ID, FIRST_DATE.strftime('%Y-%m-%d')),
+        ).fetchall()
+        booked = {row[0] for row in rows}
+        taken = connection.execute("SELECT SUM(employee_vacation_days_taken) FROM vacations WHERE employee_id = ?", (EMPLOYEE_ID,)).fetchone()[0]
+    finally:
+        connection.close()
+    # Everything acknowledged must be there, and the next operation may or may not have committed before the kill
+    if booked == expected_bookings(acknowledged):
+        applied = acknowledged
+    elif booked == expected_bookings(acknowledged + 1):
+        applied = acknowledged + 1
+    else:
+        applied = acknowledged
+        problems.append(f"after {acknowledged} acknowledged operations the bookings are {sorted(booked)}")
+    if taken != sum(row[1] for row in rows):
+        problems.append(f"{taken} days taken does not match {len(rows)} bookings")
+    return applied, problems
+
+
+def run_profile(source_path, workdir, profile):
+    """Runs the kill loop for one profile, returns (operations applied, kills landing mid-operation, problems)."""
+    db_path = os.path.join(workdir, f"employee_database_{profile}.db")
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    shutil.copy2(source_path, db_path)
+    connection = sqlite3.connect(db_path)
+    lambda_function.migrate_database(connection)
+    connection.execute(
+        "UPDATE vacations SET employee_total_vacation_days = ?, employee_vacation_days_taken = 0, employee_vacation_days_available = ? WHERE employee_id = ?",
+        (STARTING_BALANCE, STARTING_BALANCE, EMPLOYEE_ID),
+    )
+    # Every day is a working day, so each single-day booking takes one day whatever the weekday
+    connection.execute("INSERT OR IGNORE INTO leave_calendars (calendar, weekmask) VALUES ('every_day', '1111111')")
+    connection.execute("UPDATE employees SET employee_calendar = 'every_day' WHERE employee_id = ?", (EMPLOYEE_ID,))
+    connection.commit()
+    connection.close()
+
+    applied, in_flight, problems = 0, 0, []
+    for kill in range(args.kills):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_operations, args=(db_path, profile, applied, sender))
+        process.start()
+        sender.close()
+        time.sleep(random.uniform(0.005, args.max_delay))
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+        # Everything sent before the kill was acknowledged
+        acknowledged, error = applied, None
+        while receiver.poll():
+            try:
+                status, index, detail = receiver.recv()
+            except EOFError:
+                break
+            if status == "error":
+                error = detail
+            else:
+                acknowledged = index + 1
+        receiver.close()
+        if error:
+            problems.append(f"kill {kill}: operation failed before the kill: {error}")
+            break
+        now_applied, kill_problems = check_database(db_path, acknowledged)
+        if now_applied > acknowledged:
+            in_flight += 1
+        problems += [f"kill {kill}: {problem}" for problem in kill_problems]
+        applied = now_applied
+    return applied, in_flight, problems
+
+
+if __name__ == "__main__":
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for profile in args.profiles.split(","):
+            applied, in_flight, problems = run_profile(args.database, tmpdir, profile)
+            print(f"{profile:<10} {args.kills} kills, {applied} operations applied, {in_flight} kills after a commit that was not yet acknowledged, {len(problems)} problems")
+            for problem in problems:
+                print(f"  FAIL {problem}")
+            failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,71 @@
+# Checks that every hot query in the lambda function is served by an index rather than a full table scan.
+# Exits with a non-zero status if any query regresses to a SCAN, so it can be run before deploying.
+import os
+import sys
+import shutil
+import sqlite3
+import argparse
+import tempfile
+sys.path.append('./lambda')
+from lambda_function import migrate_database, BOOK_LEAVE_UPDATE, CANCEL_LEAVE_UPDATE, OVERLAPPING_LEAVE_QUERY, EMPLOYEES_ON_LEAVE_QUERY, LIST_LEAVE_QUERY, \
+    LEAVE_BALANCE_QUERY, OPEN_LEAVE_YEAR, SETTLE_CARRY_OVER, SETTLE_NO_CARRY_OVER
+
+# (name, query, parameters) for each query the lambda runs on the hot path
+HOT_QUERIES = [
+    ("get_employee_id", "SELECT employee_id FROM employees WHERE employee_name = ?", ("John Doe",)),
+    ("employee_details", "SELECT * FROM employees WHERE employee_id = ?", (1,)),
+    ("get_leave_balance", LEAVE_BALANCE_QUERY, {"employee_id": 1, "year": 2025, "entitlement": 20, "carry_max": 5, "carry_due": 1}),
+    ("list_leave", LIST_LEAVE_QUERY, {"employee_id": 1, "start_floor": "", "start_ceiling": "2025-12-31", "end_floor": "2025-01-01", "end_ceiling": "9999-12-31",
+                                      "after_start": "2025-03-01", "after_request_id": 10, "limit": 21}),
+    ("book_leave overlap", OVERLAPPING_LEAVE_QUERY, {"employee_id": 1, "start_date": "2025-01-01", "end_date": "2025-01-05"}),
+    ("open_leave_year", OPEN_LEAVE_YEAR, {"employee_id": 1, "year": 2025, "entitlement": 20}),
+    ("settle_carry_over", SETTLE_CARRY_OVER, {"employee_id": 1, "year": 2025, "carry_max": 5}),
+    ("settle_no_carry_over", SETTLE_NO_CARRY_OVER, {"employee_id": 1, "year": 2025}),
+    ("book_leave", BOOK_LEAVE_UPDATE, {"employee_id": 1, "year": 2025, "days": 1, "carry_due": 1}),
+    ("employee_leave_calendar", "SELECT employee_calendar FROM employees WHERE employee_id = ?", (1,)),
+    ("employees_on_leave", EMPLOYEES_ON_LEAVE_QUERY, {"start_date": "2025-01-01", "end_date": "2025-01-07"}),
+    ("leave_summary", "SELECT month, bookings, days FROM leave_summary WHERE employee_id = ? AND month BETWEEN ? AND ? ORDER BY month", (1, "2025-01", "2025-12")),
+    ("leave_summary by title", "SELECT month, job_title, bookings, days FROM leave_title_summary WHERE month BETWEEN ? AND ? ORDER BY month, job_title", ("2025-01", "2025-12")),
+    ("cancel_leave credit", CANCEL_LEAVE_UPDATE, {"employee_id": 1, "year": 2025, "days": 1}),
+    ("cancel_leave", "DELETE FROM planned_vacations WHERE employee_id = ? AND vacation_start_date = ? RETURNING request_id, vacation_end_date, vacation_days_taken", (1, "2025-01-01")),
+]
+
+
+def check_query_plans(connection):
+    """Returns a list of (name, plan detail) for every hot query that does a full table scan."""
+    failures = []
+    for name, query, params in HOT_QUERIES:
+        plan = connection.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        details = [row[3] for row in plan]
+        print(f"{name:<24} {' | '.join(details)}")
+        for detail in details:
+            # A SCAN over a covering index or over a subquery's result is fine, a bare SCAN of the table is not
+            if detail.startswith("SCAN") and "INDEX" not in detail and not detail.startswith("SCAN (subquery"):
+                failures.append((name, detail))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to check, it is copied and migrated first")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Error: Database file not found at {args.database}")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_copy = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(args.database, db_copy)
+        connection = sqlite3.connect(db_copy)
+        try:
+            print(f"Schema version {migrate_database(connection)}")
+            failures = check_query_plans(connection)
+        finally:
+            connection.close()
+
+    if failures:
+        for name, detail in failures:
+            print(f"FAIL: {name} does a full table scan: {detail}")
+        sys.exit(1)
+    print("OK: all hot queries use an index")
@@ -1,8 +1,12 @@
 # creating employee database to be used by lambda function
+import sys
 import sqlite3
 import random
+import argparse
 from datetime import date, timedelta
 import logging
+sys.path.append('./lambda')
+from lambda_function import migrate_database
 
 DB_PATH = "lambda/employee_database.db"  # Path to the SQLite database file
 
@@ -11,11 +15,11 @@ logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d}
 logger = logging.getLogger(__name__)
 
 
-def setup_database():
-    """Sets up the SQLite database with sample data."""
+def setup_database(db_path=DB_PATH, employee_count=10):
+    """Sets up the SQLite database with sample data. Employees past the ten sample names are called "Employee <n>"."""
     # Connect to the SQLite database (creates a new one if it doesn't exist)
     try:
-        connection = sqlite3.connect(DB_PATH)
+        connection = sqlite3.connect(db_path)
     except Exception as e:
         logger.error(f"Error connecting to the database: {e}")
         return None
@@ -75,8 +79,8 @@ def setup_database():
         cursor.execute("DELETE FROM vacations")
         cursor.execute("DELETE FROM planned_vacations")
         logger.info(f"Populate Table")
-        for i in range(10):
-            name = employee_names[i]
+        for i in range(employee_count):
+            name = employee_names[i] if i < len(employee_names) else f"Employee {i + 1}"
             job_title = random.choice(job_titles)
             start_date = date(2015 + random.randint(0, 9), random.randint(1, 12), random.randint(1, 28)).strftime('%Y-%m-%d')
             date_of_birth = random.choice(DOB)
@@ -85,6 +89,7 @@ def setup_database():
             cursor.execute("INSERT INTO employees (employee_name, employee_job_title, employee_start_date, employee_dob, employee_homepage, employee_employment_status) VALUES (?, ?, ?, ?, ?, ?)", (name, job_title, start_date, date_of_birth, home_page, employment_status))
             employee_id = cursor.lastrowid
 
+            booked = []
             # Generate vacation data for the current employee
             for year in range(date.today().year, date.today().year - 3, -1):
                 total_vacation_days = random.randint(10, 30)
@@ -92,21 +97,34 @@ def setup_database():
                 days_available = total_vacation_days - days_taken
                 connection.execute("INSERT INTO vacations (employee_id, year, employee_total_vacation_days, employee_vacation_days_taken, employee_vacation_days_available) VALUES (?, ?, ?, ?, ?)", (employee_id, year, total_vacation_days, days_taken, days_available))
 
-                # Generate some planned vacations for the current employee and year
+                # Generate some planned vacations for the current employee and year. book_leave refuses overlapping
+                # bookings, so a random one that overlaps a booking already generated is dropped
                 num_planned_vacations = random.randint(0, 3)
                 for _ in range(num_planned_vacations):
                     start_date = date(year, random.randint(1, 12), random.randint(1, 28)).strftime('%Y-%m-%d')
                     end_date = (date(int(start_date[:4]), int(start_date[5:7]), int(start_date[8:])) + timedelta(days=random.randint(1, 14))).strftime('%Y-%m-%d')
                     days_taken = (date(int(end_date[:4]), int(end_date[5:7]), int(end_date[8:])) - date(int(start_date[:4]), int(start_date[5:7]), int(start_date[8:])))
+                    if any(start_date <= booked_end and end_date >= booked_start for booked_start, booked_end in booked):
+                        continue
+                    booked.append((start_date, end_date))
                     connection.execute("INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)", (employee_id, start_date, end_date, days_taken.days))
 
 
         connection.commit()
+
+        # Bring the schema up to the version the lambda expects (indexes etc.)
+        logger.info(f"Migrate Schema")
+        migrate_database(connection)
     except Exception as e:
         logger.error(f"Error setting up database: {e}")
     finally:
         connection.close()
 
 
-setup_database()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", required=False, type=str, default=DB_PATH, help="Database file to create or refill")
+    parser.add_argument("-n", "--employees", required=False, type=int, default=10, help="Number of employees to generate")
+    args = parser.parse_args()
+    setup_database(args.database, args.employees)
 
@@ -0,0 +1,70 @@
+# Prints every employee's leave balance for a leave year (entitlement, days carried over, taken and available) from the
+# one set-based query behind leave_balance_report(), optionally as CSV. With --compare it also times the report against
+# calling get_leave_balance once per employee and checks both give the same balances.
+import os
+import sys
+import csv
+import time
+import logging
+import argparse
+import tempfile
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to report on")
+parser.add_argument("-y", "--year", required=False, type=int, help="Leave year, defaults to the current one")
+parser.add_argument("-l", "--limit", required=False, type=int, default=20, help="Number of employees to print, 0 for all")
+parser.add_argument("--csv", action="store_true", help="Print the whole report as CSV")
+parser.add_argument("--compare", action="store_true", help="Time the report against get_leave_balance per employee")
+args = parser.parse_args()
+
+COLUMNS = ["employee_id", "employee_name", "employee_job_title", "entitlement", "carried_over_days", "days_taken", "days_available"]
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.WARNING)
+    # Read in place, or from a migrated copy if the database's schema is behind
+    workdir = tempfile.TemporaryDirectory()
+    lambda_function.BUNDLED_DB_PATH = args.database
+    lambda_function.DB_PATH = os.path.join(workdir.name, "employee_database.db")
+    # Open (and if needed copy and migrate) the database before timing anything
+    lambda_function.release_db_connection(lambda_function.create_db_connection(readonly=True))
+
+    started = time.perf_counter()
+    report = lambda_function.leave_balance_report(args.year)
+    elapsed = time.perf_counter() - started
+    if "error" in report:
+        print(report["error"])
+        sys.exit(1)
+    balances = report["balances"]
+
+    if args.csv:
+        writer = csv.DictWriter(sys.stdout, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(balances)
+        sys.exit(0)
+
+    print(f"Leave year {report['leave_year']}, {len(balances)} employees in {elapsed * 1e3:.1f}ms")
+    print(f"{'id':>8} {'name':<20} {'entitlement':>11} {'carried':>8} {'taken':>6} {'available':>9}")
+    for row in balances[:args.limit or None]:
+        print(f"{row['employee_id']:>8} {str(row['employee_name']):<20} {str(row['entitlement']):>11} {row['carried_over_days']:>8} "
+              f"{row['days_taken']:>6} {str(row['days_available']):>9}")
+
+    if args.compare:
+        started = time.perf_counter()
+        single = [lambda_function.get_leave_balance(row["employee_id"], report["leave_year"]) for row in balances]
+        loop = time.perf_counter() - started
+        mismatches = [
+            (row["employee_id"], row["days_available"], answer.get("employee_vacation_days_available"))
+            for row, answer in zip(balances, single)
+            if row["days_available"] != answer.get("employee_vacation_days_available")
+        ]
+        print(f"set-based report           {elapsed * 1e3:9.1f}ms")
+        print(f"get_leave_balance x {len(balances):<7}{loop * 1e3:9.1f}ms  ({loop / elapsed:.1f}x)")
+        if mismatches:
+            print(f"FAIL: {len(mismatches)} employees differ, e.g. {mismatches[:5]}")
+            sys.exit(1)
+        print("OK: the report matches get_leave_balance for every employee")
+    lambda_function.close_db_connection()
+    workdir.cleanup()
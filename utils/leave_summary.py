@@ -0,0 +1,167 @@
+# Maintains the leave summary tables (leave_summary and leave_title_summary, kept current by triggers on
+# planned_vacations). --check compares them with the summary computed from the bookings and exits with status 1 if
+# they differ, --rebuild refills them from the bookings. --benchmark adds synthetic bookings to a copy of the database
+# (1M by default), checks the triggers kept up, and compares answering "days booked per job title in a month" from the
+# summary against aggregating planned_vacations, and the cost the triggers add to book_leave and cancel_leave.
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+from datetime import date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to check or rebuild")
+parser.add_argument("--check", action="store_true", help="Compare the summary tables with the bookings")
+parser.add_argument("--rebuild", action="store_true", help="Refill the summary tables from the bookings")
+parser.add_argument("--benchmark", required=False, type=int, default=0, metavar="BOOKINGS", help="Benchmark on a copy with this many synthetic bookings added")
+parser.add_argument("-n", "--iterations", required=False, type=int, default=50, help="Questions or bookings per timing")
+args = parser.parse_args()
+
+FIRST_DATE = date(2020, 1, 1)
+SPAN_DAYS = 5000
+# Days booked per job title in one month, aggregated from the bookings
+TITLE_MONTH_QUERY = """
+    SELECT COALESCE(e.employee_job_title, ''), COUNT(*), SUM(p.vacation_days_taken)
+    FROM planned_vacations p LEFT JOIN employees e ON e.employee_id = p.employee_id
+    WHERE p.vacation_start_date BETWEEN :month || '-01' AND :month || '-31'
+    GROUP BY 1
+"""
+SUMMARY_TITLE_MONTH_QUERY = "SELECT job_title, bookings, days FROM leave_title_summary WHERE month = :month"
+
+
+def print_differences(differences, limit=10):
+    for table, key, stored, expected in differences[:limit]:
+        print(f"  {table} {key}: stored {stored}, expected {expected}")
+    if len(differences) > limit:
+        print(f"  ... and {len(differences) - limit} more")
+
+
+def add_bookings(connection, count):
+    """Adds count random bookings for the existing employees with executemany, the triggers fire for every row."""
+    employee_ids = [row[0] for row in connection.execute("SELECT employee_id FROM employees")]
+
+    def synthetic_bookings():
+        for _ in range(count):
+            start = FIRST_DATE + timedelta(days=random.randrange(SPAN_DAYS))
+            days = random.randint(1, 10)
+            yield (random.choice(employee_ids), str(start), str(start + timedelta(days=days - 1)), days)
+
+    connection.executemany(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)",
+        synthetic_bookings(),
+    )
+    connection.commit()
+
+
+def p50(function, values):
+    """The median time in milliseconds to call function on each value."""
+    timings = []
+    for value in values:
+        started = time.perf_counter()
+        function(value)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e3
+
+
+def book_and_cancel(db_path, count):
+    """The p50 in milliseconds of a book_leave and cancel_leave pair through the lambda functions."""
+    lambda_function.DB_PATH = db_path
+    # Mondays well after every synthetic booking
+    first = FIRST_DATE + timedelta(days=SPAN_DAYS + 30)
+    first -= timedelta(days=first.weekday())
+    days = [str(first + timedelta(weeks=week)) for week in range(count)]
+
+    def pair(day):
+        booked = lambda_function.book_leave(1, day, day)
+        if "error" in booked:
+            raise Exception(booked["error"])
+        lambda_function.cancel_leave(1, day)
+
+    timing = p50(pair, days)
+    lambda_function.close_db_connection()
+    return timing
+
+
+def benchmark(source_path, bookings):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "employee_database.db")
+        shutil.copy2(source_path, db_path)
+        connection = sqlite3.connect(db_path)
+        lambda_function.migrate_database(connection)
+        started = time.perf_counter()
+        add_bookings(connection, bookings)
+        print(f"Added {bookings} bookings with the triggers in {time.perf_counter() - started:.1f}s")
+        differences = lambda_function.check_leave_summary(connection)
+        if differences:
+            print("FAIL: the summary tables do not match the bookings")
+            print_differences(differences)
+            return False
+        print("OK: the summary tables match the bookings")
+
+        months = [str(FIRST_DATE + timedelta(days=random.randrange(SPAN_DAYS)))[:7] for _ in range(args.iterations)]
+        for month in months[:5]:
+            aggregated = sorted(connection.execute(TITLE_MONTH_QUERY, {"month": month}).fetchall())
+            summarized = sorted(connection.execute(SUMMARY_TITLE_MONTH_QUERY, {"month": month}).fetchall())
+            if aggregated != summarized:
+                print(f"FAIL: the summary disagrees with the aggregate for {month}")
+                return False
+        aggregate_p50 = p50(lambda month: connection.execute(TITLE_MONTH_QUERY, {"month": month}).fetchall(), months)
+        summary_p50 = p50(lambda month: connection.execute(SUMMARY_TITLE_MONTH_QUERY, {"month": month}).fetchall(), months)
+
+        started = time.perf_counter()
+        counts = lambda_function.rebuild_leave_summary(connection)
+        rebuild = time.perf_counter() - started
+        connection.close()
+
+        with_triggers = book_and_cancel(db_path, args.iterations)
+        connection = sqlite3.connect(db_path)
+        for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'planned_vacations_summary_%'").fetchall():
+            connection.execute(f"DROP TRIGGER {name}")
+        connection.commit()
+        connection.close()
+        without_triggers = book_and_cancel(db_path, args.iterations)
+
+    print(f"Rebuilt {counts['leave_summary']} employee and {counts['leave_title_summary']} job title rows in {rebuild * 1e3:.0f}ms")
+    print(f"{'days per job title in a month':<36} {'p50':>10}")
+    print(f"{'aggregate planned_vacations':<36} {aggregate_p50:8.3f}ms")
+    print(f"{'read leave_title_summary':<36} {summary_p50:8.3f}ms  ({aggregate_p50 / summary_p50:.0f}x)")
+    print(f"{'book_leave + cancel_leave':<36} {'p50':>10}")
+    print(f"{'with the summary triggers':<36} {with_triggers:8.3f}ms")
+    print(f"{'without them':<36} {without_triggers:8.3f}ms")
+    return True
+
+
+if __name__ == "__main__":
+    lambda_function.logger.setLevel(logging.WARNING)
+    if not (args.check or args.rebuild or args.benchmark):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    failed = False
+    if args.check or args.rebuild:
+        connection = sqlite3.connect(args.database)
+        try:
+            lambda_function.migrate_database(connection)
+            if args.rebuild:
+                counts = lambda_function.rebuild_leave_summary(connection)
+                print(f"Rebuilt {counts['leave_summary']} employee and {counts['leave_title_summary']} job title rows")
+            if args.check:
+                differences = lambda_function.check_leave_summary(connection)
+                if differences:
+                    print(f"FAIL: {len(differences)} summary rows do not match the bookings, run with --rebuild to fix them")
+                    print_differences(differences)
+                    failed = True
+                else:
+                    print("OK: the summary tables match the bookings")
+        finally:
+            connection.close()
+    if args.benchmark and not benchmark(args.database, args.benchmark):
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,227 @@
+# A local stand-in for the AIRS scan API, so the lambda's AIRS paths can be tested and benchmarked offline.
+# Point the lambda at it with AIRS_BASE_URL (and REQUESTS_CA_BUNDLE when using the self-signed certificate).
+import os
+import ssl
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import subprocess
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Content containing any of these is blocked, mapped to the detection flag that is raised
+DEFAULT_BLOCK_PATTERNS = {
+    "sapa-group.com.ar": "url_cats",
+    "palapaslot.com": "url_cats",
+    "ignore previous instructions": "injection",
+    "drop table": "db_security",
+}
+
+DETECTION_FLAGS = ['url_cats', 'dlp', 'injection', 'toxic_content', 'malicious_code', 'agent', 'db_security', 'ungrounded', 'topic_violation']
+
+
+def scan_content(contents, block_patterns):
+    """Builds an AIRS style verdict for one contents entry."""
+    prompt_detected = {flag: False for flag in DETECTION_FLAGS}
+    response_detected = {flag: False for flag in DETECTION_FLAGS}
+    for key, detected in (("prompt", prompt_detected), ("response", response_detected)):
+        text = str(contents.get(key, "")).lower()
+        for pattern, flag in block_patterns.items():
+            if pattern in text:
+                detected[flag] = True
+    blocked = any(prompt_detected.values()) or any(response_detected.values())
+    return {
+        "action": "block" if blocked else "allow",
+        "category": "malicious" if blocked else "benign",
+        "prompt_detected": prompt_detected,
+        "response_detected": response_detected,
+        "scan_id": str(uuid.uuid4()),
+        "report_id": "R" + uuid.uuid4().hex,
+    }
+
+
+class AIRSRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, without this Nagle adds ~40ms to every kept-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def check_request(self):
+        """Applies the injected faults and the token check, returns False if the request has been answered."""
+        self.server.count_request()
+        # Injected faults, used to exercise the lambda's timeouts and circuit breaker
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json(503, {"error": {"message": "Injected failure"}})
+            return False
+        if not self.headers.get("x-pan-token"):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json(401, {"error": {"message": "Missing x-pan-token"}})
+            return False
+        return True
+
+    def do_POST(self):
+        if not self.check_request():
+            return
+        try:
+            req = self.read_json()
+        except ValueError:
+            self.send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+        if self.path == "/v1/scan/sync/request":
+            if not isinstance(req, dict) or not req.get("contents"):
+                self.send_json(400, {"error": {"message": "Missing contents"}})
+                return
+            self.send_json(200, self.server.scan_request(req))
+        elif self.path == "/v1/scan/async/request":
+            if not isinstance(req, list) or not all(isinstance(entry, dict) and entry.get("scan_req") for entry in req):
+                self.send_json(400, {"error": {"message": "Expected a list of req_id/scan_req entries"}})
+                return
+            scan_id = self.server.submit_async(req)
+            self.send_json(200, {"received": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "scan_id": scan_id, "report_id": "R" + scan_id})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        if not self.check_request():
+            return
+        url = urlparse(self.path)
+        if url.path == "/v1/scan/results":
+            scan_ids = [scan_id for scan_id in parse_qs(url.query).get("scan_ids", [""])[0].split(",") if scan_id]
+            if not scan_ids:
+                self.send_json(400, {"error": {"message": "Missing scan_ids"}})
+                return
+            self.send_json(200, self.server.async_results(scan_ids))
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+class LocalAIRSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, block_patterns=None, latency=0.0, error_rate=0.0, async_delay=0.5, verbose=False):
+        super().__init__(address, AIRSRequestHandler)
+        self.block_patterns = dict(block_patterns or DEFAULT_BLOCK_PATTERNS)
+        # These can be changed while the server is running
+        self.latency = latency
+        self.error_rate = error_rate
+        # Async scans complete one by one, each async_delay seconds after the previous one
+        self.async_delay = async_delay
+        self.async_scans = {}  # scan_id -> list of (ready_at, req_id, verdict)
+        self.verbose = verbose
+        self.request_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        # Called once per accepted TCP (and TLS) connection
+        with self._lock:
+            self.connection_count += 1
+        return super().get_request()
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def scan_request(self, req):
+        """Returns the verdict for a single scan request body."""
+        verdict = scan_content(req["contents"][0], self.block_patterns)
+        verdict["tr_id"] = req.get("tr_id")
+        verdict["profile_name"] = req.get("ai_profile", {}).get("profile_name")
+        return verdict
+
+    def submit_async(self, entries):
+        """Queues an async batch, returns its scan id."""
+        scan_id = str(uuid.uuid4())
+        now = time.time()
+        scans = [
+            (now + self.async_delay * (position + 1), entry.get("req_id"), self.scan_request(entry["scan_req"]))
+            for position, entry in enumerate(entries)
+        ]
+        with self._lock:
+            self.async_scans[scan_id] = scans
+        return scan_id
+
+    def async_results(self, scan_ids):
+        """Returns the per request results for the scan ids, pending until each one is ready."""
+        now = time.time()
+        results = []
+        with self._lock:
+            for scan_id in scan_ids:
+                for ready_at, req_id, verdict in self.async_scans.get(scan_id, []):
+                    result = {"req_id": req_id, "scan_id": scan_id, "status": "complete" if ready_at <= now else "pending"}
+                    if ready_at <= now:
+                        result["result"] = verdict
+                    results.append(result)
+        return results
+
+
+def generate_self_signed_cert(directory, hostname="localhost"):
+    """Creates a self-signed certificate with the openssl CLI, returns (certfile, keyfile)."""
+    certfile = os.path.join(directory, "airs_cert.pem")
+    keyfile = os.path.join(directory, "airs_key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", keyfile, "-out", certfile, "-subj", f"/CN={hostname}",
+         "-addext", f"subjectAltName=DNS:{hostname},IP:127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def start_server(host="127.0.0.1", port=0, certfile=None, keyfile=None, **kwargs):
+    """Starts the stand-in server on a background thread, returns (server, base_url)."""
+    server = LocalAIRSServer((host, port), **kwargs)
+    scheme = "http"
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        # Defer the handshake to the handler thread so a slow client does not stall accept()
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+        scheme = "https"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"{scheme}://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", required=False, type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", required=False, type=int, default=8443, help="Port to listen on")
+    parser.add_argument("--tls", action="store_true", help="Serve HTTPS with a self-signed certificate written to the current directory")
+    parser.add_argument("--latency", required=False, type=float, default=0.0, help="Seconds to wait before answering each request")
+    parser.add_argument("--error-rate", required=False, type=float, default=0.0, help="Fraction of requests to answer with a 503")
+    parser.add_argument("--async-delay", required=False, type=float, default=0.5, help="Seconds between each async scan result becoming ready")
+    args = parser.parse_args()
+
+    certfile = keyfile = None
+    if args.tls:
+        certfile, keyfile = generate_self_signed_cert(os.getcwd())
+        print(f"Set REQUESTS_CA_BUNDLE={certfile} so the lambda trusts the certificate")
+    server, base_url = start_server(args.host, args.port, certfile, keyfile, latency=args.latency, error_rate=args.error_rate, async_delay=args.async_delay, verbose=True)
+    print(f"Local AIRS server listening on {base_url}, set AIRS_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
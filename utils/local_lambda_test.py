@@ -11,9 +11,10 @@ parser.add_argument("-f", "--filename", required=False, type=str, help="Enter a
 parser.add_argument('-d', '--employeedetails', required=False, type=str, help="Enter the Employee Number")
 parser.add_argument('-n', '--employeename', required=False, type=str, help="Enter the Employee Name")
 parser.add_argument('-a', '--availableleave', required=False, type=str, help="Enter the Employee ID for their leave balance")
-parser.add_argument('-l', '--listleave', required=False, type=str, help="Enter the Employee ID for their leave ")
+parser.add_argument('-l', '--listleave', required=False, type=str, help="Enter the Employee ID for their leave - the start and end date optionally limit it to a range")
 parser.add_argument('-b', '--bookleave', required=False, type=str, help="Enter the Employee ID for their leave - you must also specify the start and end date")
 parser.add_argument('-c', '--cancelleave', required=False, type=str, help="Enter the Employee ID for their leave - you must also specify the start date")
+parser.add_argument('-o', '--onleave', action='store_true', help="List the employees on leave - you must also specify the start date, the end date is optional")
 parser.add_argument('-s', '--startdate', required=False, type=str, help="Enter the Start date in the formate YYYY-MM-DD")
 parser.add_argument('-e', '--enddate', required=False, type=str, help="Enter the End date in the formate YYYY-MM-DD")
 parser.add_argument('-r', '--prismaairs', required=False, type=str, choices=['prompt', 'response'], help="Enter Prompt or Response - you must also specific the prompt")
@@ -35,6 +36,9 @@ if args.bookleave is not None:
 if args.cancelleave is not None and args.enddate is None:
         parser.error(f"When -c/--cancelleave is specified, the -e/--enddate arguments is also required")
 
+if args.onleave and args.startdate is None:
+        parser.error(f"When -o/--onleave is specified, the -s/--startdate arguments is also required")
+
 if args.prismaairs is not None and args.prompt is None:
         parser.error(f"When -r/--prismaairs is specified, the -p/--prompt arguments is also required")
 
@@ -47,9 +51,11 @@ if args.availableleave:
 if args.bookleave:
     print('Book Employee Leave', lambda_function.book_leave(args.bookleave,args.startdate,args.enddate))
 if args.listleave:
-    print('List Employee Leave', lambda_function.list_leave(args.listleave))
+    print('List Employee Leave', lambda_function.list_leave(args.listleave,args.startdate,args.enddate))
 if args.cancelleave:
     print('Cancel Employee Leave', lambda_function.cancel_leave(args.cancelleave,args.startdate))
+if args.onleave:
+    print('Employees On Leave', lambda_function.employees_on_leave(args.startdate,args.enddate))
 if args.prismaairs:
     print('Check on AIRS', lambda_function.airs_make_request(args.prismaairs,args.prompt,'test_app','test_user','test_id'))
     # print('Check on AIRS', lambda_function.airs_make_request('prompt','https://everoprime.com/wp-includes/certificates 192.168.86.123','test_app','test_user','test_id'))
@@ -0,0 +1,76 @@
+# Recalculates vacation_days_taken for every booking with the leave duration engine (each employee's calendar, so
+# weekends and public holidays are not counted) and reports the bookings whose stored duration differs.
+# With --apply the durations are updated and the difference is credited back to (or taken from) the balance of the
+# leave year it was taken from, so cancelling a booking later still returns exactly what it took.
+import sys
+import time
+import sqlite3
+import argparse
+from collections import defaultdict
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to recalculate")
+parser.add_argument("-f", "--from-date", required=False, type=str, default="0000-00-00", help="Only bookings ending on or after this date (YYYY-MM-DD)")
+parser.add_argument("-l", "--limit", required=False, type=int, default=20, help="Number of changed bookings to print")
+parser.add_argument("--apply", action="store_true", help="Write the recalculated durations and adjust the balances")
+args = parser.parse_args()
+
+
+def load_bookings(connection):
+    """Returns {calendar: [(request_id, employee_id, start, end, stored days)]} for the selected bookings."""
+    bookings = defaultdict(list)
+    cursor = connection.execute(
+        """
+        SELECT p.request_id, p.employee_id, p.vacation_start_date, p.vacation_end_date, p.vacation_days_taken,
+               COALESCE(e.employee_calendar, ?)
+        FROM planned_vacations p LEFT JOIN employees e ON e.employee_id = p.employee_id
+        WHERE p.vacation_end_date >= ?
+        """,
+        (lambda_function.DEFAULT_LEAVE_CALENDAR, args.from_date),
+    )
+    for request_id, employee_id, start, end, stored, calendar in cursor:
+        bookings[calendar].append((request_id, employee_id, start, end, stored))
+    return bookings
+
+
+if __name__ == "__main__":
+    connection = sqlite3.connect(args.database)
+    try:
+        lambda_function.migrate_database(connection)
+        bookings = load_bookings(connection)
+        started = time.perf_counter()
+        changes = []
+        credits = defaultdict(int)  # (employee_id, leave year) -> days to give back
+        for calendar_name, rows in bookings.items():
+            calendar = lambda_function.load_leave_calendar(connection, calendar_name)
+            durations = lambda_function.count_leave_days_many([(row[2], row[3]) for row in rows], calendar)
+            for row, days in zip(rows, durations):
+                if days == row[4]:
+                    continue
+                changes.append(row + (days,))
+                # What cancel_leave would give back to each year now, less what each year should have paid
+                taken = lambda_function.leave_days_by_year(row[2], row[3], calendar, total=row[4])
+                for (year, old), (_, new) in zip(taken, lambda_function.leave_days_by_year(row[2], row[3], calendar)):
+                    credits[(row[1], year)] += old - new
+        elapsed = time.perf_counter() - started
+        total = sum(len(rows) for rows in bookings.values())
+        print(f"Recalculated {total} bookings in {elapsed * 1e3:.1f}ms, {len(changes)} have a different duration")
+        for request_id, employee_id, start, end, stored, days in changes[:args.limit]:
+            print(f"  request {request_id:<6} employee {employee_id:<6} {start} to {end}: {stored} -> {days}")
+
+        if args.apply and changes:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "UPDATE planned_vacations SET vacation_days_taken = ? WHERE request_id = ?",
+                [(change[5], change[0]) for change in changes],
+            )
+            connection.executemany(
+                lambda_function.CANCEL_LEAVE_UPDATE,
+                [{"employee_id": employee_id, "year": year, "days": credit} for (employee_id, year), credit in credits.items() if credit],
+            )
+            connection.commit()
+            print(f"Updated {len(changes)} bookings and {len(credits)} leave year balances")
+    finally:
+        connection.close()
@@ -0,0 +1,56 @@
+# Re-scans every employee_homepage URL in the database with the AIRS async batch endpoint, printing verdicts as they complete.
+# Needs AIRS_API and AIRS_RESPONSE_PROFILE set, or use --local to run against the local AIRS stand-in server.
+import os
+import sys
+import time
+import sqlite3
+import argparse
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to read the homepages from")
+parser.add_argument("--local", action="store_true", help="Scan against the local AIRS stand-in server instead of AIRS")
+args = parser.parse_args()
+
+
+def load_homepages(db_path):
+    """Returns (employee_id, employee_homepage) for every employee with a homepage."""
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT employee_id, employee_homepage FROM employees WHERE employee_homepage IS NOT NULL AND employee_homepage != ''")
+        return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    server = None
+    if args.local:
+        from local_airs_server import start_server
+        os.environ.setdefault('AIRS_API', "local-test-token")
+        os.environ.setdefault('AIRS_PROMPT_PROFILE', "local-prompt-profile")
+        os.environ.setdefault('AIRS_RESPONSE_PROFILE', "local-response-profile")
+        server, lambda_function.AIRS_BASE_URL = start_server(async_delay=0.05)
+
+    homepages = load_homepages(args.database)
+    items = [
+        {"reqtype": "response", "input_val": homepage, "app_name": "homepage rescan", "tr_id": f"homepage-{employee_id}"}
+        for employee_id, homepage in homepages
+    ]
+    print(f"Scanning {len(items)} homepages")
+    started = time.perf_counter()
+    blocked = 0
+    try:
+        for index, verdict in lambda_function.airs_scan_async_iter(items):
+            employee_id, homepage = homepages[index]
+            if verdict["action"] != "allow":
+                blocked += 1
+            print(f"{time.perf_counter() - started:6.2f}s employee {employee_id:<5} {verdict['action']:<6} {homepage}")
+    finally:
+        lambda_function.close_airs_session()
+        if server is not None:
+            server.shutdown()
+    print(f"{blocked} of {len(items)} homepages blocked")
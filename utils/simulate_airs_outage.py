@@ -0,0 +1,57 @@
+# Drives the lambda's AIRS circuit breaker through an outage using the local AIRS server's fault injection.
+# Phases: healthy, failing with 503s, slow responses, then recovered. Prints the breaker state after each scan.
+import os
+import sys
+import time
+import argparse
+sys.path.append('./lambda')
+sys.path.append('./utils')
+import lambda_function
+from local_airs_server import start_server
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--scans", required=False, type=int, default=10, help="Number of scans in each phase")
+parser.add_argument("-o", "--open-seconds", required=False, type=float, default=1.0, help="How long the breaker stays open before probing")
+args = parser.parse_args()
+
+# (phase name, injected latency, injected error rate)
+PHASES = [
+    ("healthy", 0.0, 0.0),
+    ("failing", 0.0, 1.0),
+    ("slow", 0.3, 0.0),
+    ("recovered", 0.0, 0.0),
+]
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('AIRS_API', "local-test-token")
+    os.environ.setdefault('AIRS_PROMPT_PROFILE', "local-prompt-profile")
+    os.environ.setdefault('AIRS_RESPONSE_PROFILE', "local-response-profile")
+    # Scans are all different so the verdict cache does not hide the outage
+    lambda_function.AIRS_CACHE_MAX_ENTRIES = 0
+    lambda_function.AIRS_BREAKER_OPEN_SECONDS = args.open_seconds
+    lambda_function.AIRS_BREAKER_SLOW_CALL = 0.2
+    server, base_url = start_server()
+    lambda_function.AIRS_BASE_URL = base_url
+    lambda_function.airs_breaker_reset()
+
+    scan = 0
+    try:
+        for phase, latency, error_rate in PHASES:
+            server.latency = latency
+            server.error_rate = error_rate
+            print(f"--- {phase}: latency {latency}s, error rate {error_rate}")
+            for _ in range(args.scans):
+                scan += 1
+                before = server.request_count
+                started = time.perf_counter()
+                result = lambda_function.airs_make_request("prompt", f"Leave question {scan}", "sim app", "sim user", "sim id")
+                elapsed = (time.perf_counter() - started) * 1e3
+                sent = "sent" if server.request_count > before else "short-circuited"
+                print(f"scan {scan:3d} {sent:<16} {elapsed:7.1f}ms  breaker {lambda_function.airs_breaker_stats['state']:<9} {result[:60]!r}")
+                time.sleep(args.open_seconds / 4)
+    finally:
+        lambda_function.close_airs_session()
+        server.shutdown()
+    print(f"Breaker metrics: {lambda_function.airs_breaker_stats}")
+    print(f"Requests reaching AIRS: {server.request_count} of {scan} scans")
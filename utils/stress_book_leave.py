@@ -0,0 +1,267 @@
+# Stress tests book_leave with several processes booking leave for the same few employees at once, comparing the
+# original SELECT, check, INSERT, UPDATE sequence against the atomic BEGIN IMMEDIATE / conditional UPDATE version.
+# The overdraft phase gives each employee a small balance and books days of next leave year until it runs out, any
+# booking past the balance is an overdraft. The throughput phase gives them a large balance and counts bookings per second.
+# The cancel phase books days for one employee and has every process cancel all of them at once, each booking must be
+# cancelled and credited back exactly once. The legacy cancel case cancels a booking that crosses a leave year end and
+# took fewer days than the calendar counts today, each year must get back its share and neither may be debited.
+# Exits with status 1 if the current book_leave overdraws a balance or cancel_leave credits a booking twice or wrongly.
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime, date, timedelta
+sys.path.append('./lambda')
+import lambda_function
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-p", "--processes", required=False, type=int, default=8, help="Processes booking at once")
+parser.add_argument("-e", "--employees", required=False, type=int, default=3, help="Employees the processes compete for")
+parser.add_argument("-b", "--balance", required=False, type=int, default=20, help="Starting balance in the overdraft phase")
+parser.add_argument("-c", "--cancellations", required=False, type=int, default=200, help="Bookings the processes all try to cancel in the cancel phase")
+parser.add_argument("-t", "--seconds", required=False, type=float, default=3, help="Length of the throughput phase")
+parser.add_argument("-d", "--database", required=False, type=str, default="lambda/employee_database.db", help="Database to copy and test against")
+args = parser.parse_args()
+
+# Far enough apart that no two processes ever book the same day. In the overdraft phase the processes share out the
+# days of one leave year instead, so every booking comes out of the same balance.
+DAYS_PER_PROCESS = 20000
+
+
+def legacy_book_leave(employee_number, start_date_str, end_date_str):
+    """The original book_leave, kept here for comparison: the balance is checked before the write transaction starts."""
+    connection = lambda_function.create_db_connection()
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        cursor = connection.cursor()
+        cursor.execute("SELECT employee_vacation_days_available FROM vacations WHERE employee_id = ?", (employee_number,))
+        result = cursor.fetchone()
+        if not result:
+            return {"error": "Employee not found"}
+        leave_duration = (end_date - start_date).days + 1
+        if result[0] < leave_duration:
+            return {"error": "Insufficient leave available", "leave_available": result[0]}
+        cursor.execute(
+            "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (?, ?, ?, ?)",
+            (employee_number, str(start_date), str(end_date), leave_duration),
+        )
+        cursor.execute(
+            "UPDATE vacations SET employee_vacation_days_available = employee_vacation_days_available - ? WHERE employee_id = ?",
+            (leave_duration, employee_number),
+        )
+        connection.commit()
+        return {"message": "Leave booked successfully"}
+    except Exception as e:
+        return {"error": f"Error booking leave: {e}"}
+    finally:
+        lambda_function.release_db_connection(connection)
+
+
+IMPLEMENTATIONS = {
+    "legacy": legacy_book_leave,
+    "atomic": lambda_function.book_leave,
+}
+
+
+def booker(implementation, index, db_path, seconds, one_year, start, results):
+    """Books single days for random contended employees for the given time or until every one of them is out of leave."""
+    lambda_function.logger.setLevel(logging.ERROR)
+    lambda_function.DB_PATH = db_path
+    book = IMPLEMENTATIONS[implementation]
+    if one_year:
+        days_per_process = 365 // args.processes
+        first_day = lambda_function.leave_year_start(lambda_function.leave_year(date.today()) + 1) + timedelta(days=index * days_per_process)
+    else:
+        days_per_process = DAYS_PER_PROCESS
+        first_day = date.today() + timedelta(days=1 + index * DAYS_PER_PROCESS)
+    booked, errors, exhausted = 0, 0, set()
+    start.wait()
+    stop_at = time.time() + seconds
+    for day in range(days_per_process):
+        if time.time() >= stop_at or len(exhausted) == args.employees:
+            break
+        employee_id = random.randint(1, args.employees)
+        leave_date = (first_day + timedelta(days=day)).strftime('%Y-%m-%d')
+        result = book(employee_id, leave_date, leave_date)
+        if "error" not in result:
+            booked += 1
+        elif result["error"] == "Insufficient leave available":
+            exhausted.add(employee_id)
+        else:
+            errors += 1
+    lambda_function.close_db_connection()
+    results.put((booked, errors))
+
+
+def canceller(db_path, days, start, results):
+    """Cancels every one of the days for employee 1, in its own random order."""
+    lambda_function.logger.setLevel(logging.ERROR)
+    lambda_function.DB_PATH = db_path
+    days = random.sample(days, len(days))
+    cancelled, errors = 0, 0
+    start.wait()
+    for leave_date in days:
+        result = lambda_function.cancel_leave(1, leave_date)
+        if "error" not in result:
+            cancelled += 1
+        elif result["error"] != "Leave entry not found":
+            errors += 1
+    lambda_function.close_db_connection()
+    results.put((cancelled, errors))
+
+
+def run_cancel_phase(workdir, count):
+    """Books count days for employee 1, then has every process cancel all of them. Returns (cancellations that
+    succeeded, errors, balance before the bookings, balance after the cancellations)."""
+    db_path = os.path.join(workdir, "employee_database_cancel.db")
+    shutil.copy2(args.database, db_path)
+    lambda_function.DB_PATH = db_path
+    connection = lambda_function.create_db_connection()
+    connection.execute("INSERT OR IGNORE INTO leave_calendars (calendar, weekmask) VALUES ('every_day', '1111111')")
+    connection.execute("UPDATE employees SET employee_calendar = 'every_day' WHERE employee_id = 1")
+    connection.commit()
+    # Days of next leave year, all paid from one balance
+    first_day = lambda_function.leave_year_start(lambda_function.leave_year(date.today()) + 1)
+    days = [(first_day + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(count)]
+    lambda_function.open_leave_year(connection, 1, lambda_function.leave_year(first_day))
+    balance_query = "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = 1 AND year = ?"
+    connection.execute("UPDATE vacations SET employee_vacation_days_available = ? WHERE employee_id = 1 AND year = ?", (count * 10, lambda_function.leave_year(first_day)))
+    connection.commit()
+    before = connection.execute(balance_query, (lambda_function.leave_year(first_day),)).fetchone()[0]
+    for leave_date in days:
+        result = lambda_function.book_leave(1, leave_date, leave_date)
+        if "error" in result:
+            raise Exception(result["error"])
+    lambda_function.close_db_connection()
+
+    results = multiprocessing.Queue()
+    start = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=canceller, args=(db_path, days, start, results)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    start.set()
+    cancelled, errors = 0, 0
+    for _ in processes:
+        process_cancelled, process_errors = results.get()
+        cancelled += process_cancelled
+        errors += process_errors
+    for process in processes:
+        process.join()
+
+    connection = sqlite3.connect(db_path)
+    after = connection.execute(balance_query, (lambda_function.leave_year(first_day),)).fetchone()[0]
+    connection.close()
+    return cancelled, errors, before, after
+
+
+def run_legacy_cancel(workdir, days_taken=1):
+    """Cancels a 7 day booking across the end of this leave year (5 days in it, 2 in the next) that is stored as taking
+    days_taken days, as an old booking counted under another calendar may be. Returns ({leave year: days credited},
+    error or None)."""
+    db_path = os.path.join(workdir, "employee_database_legacy_cancel.db")
+    shutil.copy2(args.database, db_path)
+    lambda_function.DB_PATH = db_path
+    connection = lambda_function.create_db_connection()
+    connection.execute("INSERT OR IGNORE INTO leave_calendars (calendar, weekmask) VALUES ('every_day', '1111111')")
+    connection.execute("UPDATE employees SET employee_calendar = 'every_day' WHERE employee_id = 1")
+    next_year = lambda_function.leave_year(date.today()) + 1
+    start_date = lambda_function.leave_year_start(next_year) - timedelta(days=5)
+    years = (next_year - 1, next_year)
+    for year in years:
+        lambda_function.open_leave_year(connection, 1, year)
+    connection.execute(
+        "INSERT INTO planned_vacations (employee_id, vacation_start_date, vacation_end_date, vacation_days_taken) VALUES (1, ?, ?, ?)",
+        (str(start_date), str(start_date + timedelta(days=6)), days_taken),
+    )
+    connection.commit()
+    balance_query = "SELECT employee_vacation_days_available FROM vacations WHERE employee_id = 1 AND year = ?"
+    before = {year: connection.execute(balance_query, (year,)).fetchone()[0] for year in years}
+    lambda_function.close_db_connection()
+    lambda_function.clear_leave_calendars()
+
+    result = lambda_function.cancel_leave(1, str(start_date))
+    lambda_function.close_db_connection()
+    connection = sqlite3.connect(db_path)
+    credited = {year: connection.execute(balance_query, (year,)).fetchone()[0] - before[year] for year in years}
+    connection.close()
+    return credited, result.get("error")
+
+
+def run_phase(implementation, workdir, balance, seconds, one_year=False):
+    """Runs the bookers against a fresh copy of the database, returns (bookings, errors, elapsed, final balances)."""
+    db_path = os.path.join(workdir, f"employee_database_{implementation}_{balance}.db")
+    shutil.copy2(args.database, db_path)
+    connection = sqlite3.connect(db_path)
+    lambda_function.migrate_database(connection)
+    # Every leave year has the same balance, the new ones open with it as their entitlement
+    connection.execute(
+        "UPDATE vacations SET employee_total_vacation_days = ?, employee_vacation_days_taken = 0, employee_vacation_days_available = ? WHERE employee_id <= ?",
+        (balance, balance, args.employees),
+    )
+    # Every day is a working day, so both versions take one day for each single-day booking
+    connection.execute("INSERT OR IGNORE INTO leave_calendars (calendar, weekmask) VALUES ('every_day', '1111111')")
+    connection.execute("UPDATE employees SET employee_calendar = 'every_day' WHERE employee_id <= ?", (args.employees,))
+    connection.commit()
+    connection.close()
+
+    results = multiprocessing.Queue()
+    start = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=booker, args=(implementation, index, db_path, seconds, one_year, start, results))
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    started = time.perf_counter()
+    start.set()
+    booked, errors = 0, 0
+    for _ in processes:
+        process_booked, process_errors = results.get()
+        booked += process_booked
+        errors += process_errors
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    connection = sqlite3.connect(db_path)
+    balances = dict(connection.execute(
+        "SELECT employee_id, MIN(employee_vacation_days_available) FROM vacations WHERE employee_id <= ? GROUP BY employee_id",
+        (args.employees,),
+    ).fetchall())
+    connection.close()
+    return booked, errors, elapsed, balances
+
+
+if __name__ == "__main__":
+    overdrawn = False
+    print(f"{args.processes} processes booking for {args.employees} employees")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for implementation in IMPLEMENTATIONS:
+            booked, errors, _, balances = run_phase(implementation, tmpdir, args.balance, args.seconds * 10, one_year=True)
+            allowed = args.balance * args.employees
+            status = "ok" if booked <= allowed and min(balances.values()) >= 0 else "OVERDRAFT"
+            print(f"{implementation:<8} balance {args.balance} each: {booked} days booked of {allowed}, "
+                  f"lowest balance {min(balances.values())}, {errors} errors  {status}")
+            if implementation == "atomic" and status != "ok":
+                overdrawn = True
+
+            booked, errors, elapsed, _ = run_phase(implementation, tmpdir, 10 ** 9, args.seconds)
+            print(f"{implementation:<8} throughput: {booked / elapsed:8.0f} bookings/s, {errors} errors")
+
+        cancelled, errors, before, after = run_cancel_phase(tmpdir, args.cancellations)
+        double_credit = cancelled != args.cancellations or after != before
+        print(f"cancel   {args.cancellations} bookings cancelled by {args.processes} processes at once: {cancelled} cancellations, "
+              f"balance {before} before booking and {after} after, {errors} errors  {'DOUBLE CREDIT' if double_credit else 'ok'}")
+
+        credited, error = run_legacy_cancel(tmpdir)
+        wrong_credit = bool(error) or sum(credited.values()) != 1 or min(credited.values()) < 0
+        print(f"legacy   cancelling a year-end booking stored as 1 day: credited {credited}"
+              f"{f', error {error}' if error else ''}  {'WRONG CREDIT' if wrong_credit else 'ok'}")
+    sys.exit(1 if overdrawn or double_credit or wrong_credit else 0)
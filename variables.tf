@@ -33,4 +33,16 @@ locals {
 variable "aws_bedrock_model" {
   description = "AWS LLM Model to use, defaults to the Claude 3 Haiku"
   default = "arn:aws:bedrock:us-east-1::foundation-model/anthropic.claude-3-haiku-20240307-v1:0"
-}
\ No newline at end of file
+}
+
+# Directory zipped for the Lambda function. Run utils/build_lambda_package.py and set this to "./build/lambda" to deploy the pruned, precompiled package
+variable "lambda_source_dir" {
+  description = "Directory containing the Lambda function code and database"
+  default = "./lambda"
+}
+
+# Comma separated domains the local pre-filter blocks before calling AIRS, e.g. "sapa-group.com.ar,palapaslot.com" for the sample data
+variable "airs_prefilter_deny_domains" {
+  description = "Comma separated domains blocked by the local pre-filter"
+  default = ""
+}